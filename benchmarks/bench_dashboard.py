@@ -0,0 +1,122 @@
+"""
+仪表板与查询层基准测试
+
+在合成数据集上通过Flask测试客户端(无需浏览器)依次请求每个仪表板接口，
+测量 1h、24h、7d、30d 窗口下的延迟与响应体大小，并可与基线结果比较以发现回退。
+
+用法:
+    python benchmarks/bench_dashboard.py --db /tmp/ollama_30d.db
+    python benchmarks/bench_dashboard.py --preset ci --baseline benchmarks/results/dashboard-base.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import common
+import fake_ollama
+import gen_dataset
+
+ENDPOINTS = [
+    "/api/status",
+    "/api/metrics/system",
+    "/api/metrics/gpu",
+    "/api/logs/requests",
+    "/api/stats/models",
+    "/api/stats/ips",
+    "/api/stats/requests",
+]
+WINDOWS = {"1h": 1, "24h": 24, "7d": 168, "30d": 720}
+
+
+def bench_endpoint(client, url, repeat):
+    timings = []
+    size = 0
+    status = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resp = client.get(url)
+        body = resp.get_data()
+        timings.append(time.perf_counter() - start)
+        size = len(body)
+        status = resp.status_code
+    stats = common.summarize(timings)
+    return {
+        "status": status,
+        "payload_bytes": size,
+        "min_ms": min(timings) * 1000.0,
+        "p50_ms": stats["p50_ms"],
+    }
+
+
+def run_benchmark(args, db_file):
+    workdir = tempfile.mkdtemp(prefix="ollama-dash-")
+    monitor_module = common.import_monitor(workdir)
+    monitor_module.DB_FILE = db_file
+    upstream = fake_ollama.start_fake_server()
+    monitor_module.OLLAMA_HOST = upstream.url
+    monitor_module.app.config["MONITOR"] = monitor_module.OllamaMonitor(host=upstream.url)
+    client = monitor_module.app.test_client()
+
+    results = {}
+    for endpoint in args.endpoints.split(","):
+        for label in args.windows.split(","):
+            url = f"{endpoint}?hours={WINDOWS[label]}"
+            result = bench_endpoint(client, url, args.repeat)
+            results.setdefault(endpoint, {})[label] = result
+            print(f"{endpoint:<22} {label:>4}  p50 {result['p50_ms']:9.1f} ms  "
+                  f"{result['payload_bytes'] / 1024:10.1f} KiB  status {result['status']}", flush=True)
+    upstream.shutdown()
+    return results
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Ollama Monitor 仪表板查询基准测试")
+    parser.add_argument("--db", help="已有的数据集；不存在时按预设生成")
+    parser.add_argument("--preset", choices=sorted(gen_dataset.PRESETS), default="ci")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--windows", default=",".join(WINDOWS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="结果JSON路径")
+    parser.add_argument("--baseline", help="基线结果JSON，用于回退检测")
+    parser.add_argument("--max-regression", type=float, default=0.5,
+                        help="延迟或响应体增长超过该比例时判定为回退(默认50%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0,
+                        help="延迟绝对增长低于该值(毫秒)时不判定为回退")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    db_file = os.path.abspath(args.db) if args.db else None
+    if db_file is None or not os.path.exists(db_file):
+        db_file = db_file or os.path.join(tempfile.mkdtemp(prefix="ollama-data-"), f"{args.preset}.db")
+        preset = gen_dataset.PRESETS[args.preset]
+        print(f"生成 {args.preset} 数据集: {db_file}")
+        dataset = gen_dataset.generate(db_file, preset["days"], preset["interval"], preset["requests"])
+    else:
+        dataset = None
+
+    results = {
+        "meta": common.run_metadata("dashboard", args),
+        "results": run_benchmark(args, db_file),
+    }
+    results["meta"]["db_file"] = db_file
+    results["meta"]["db_bytes"] = os.path.getsize(db_file)
+    results["meta"]["dataset_rows"] = dataset
+    common.save_results(args.output or common.default_output("dashboard"), results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = common.compare_results(
+                json.load(f), results, threshold=args.max_regression, min_abs_ms=args.min_delta_ms)
+        if regressions:
+            print(f"检测到 {len(regressions)} 项性能回退")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+"""
+代理吞吐与延迟基准测试
+
+启动模拟Ollama服务器和独立的代理进程，分别直连和经由代理发起负载，
+报告代理吞吐(req/s)、附加延迟p50/p99、首token透传延迟、每个打开的流占用的内存
+以及数据库写入吞吐，结果保存为JSON以便比较多次运行。
+
+用法:
+    python benchmarks/bench_proxy.py --requests 200 --concurrency 8
+    python benchmarks/bench_proxy.py --compare benchmarks/results/proxy-old.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+import requests
+
+import common
+
+SCENARIOS = {
+    "generate": ("/api/generate", False),
+    "generate_stream": ("/api/generate", True),
+    "chat": ("/api/chat", False),
+    "chat_stream": ("/api/chat", True),
+    "embed": ("/api/embed", False),
+}
+
+
+def build_payload(endpoint, stream, num_predict=None):
+    payload = {"model": "llama3.2:3b", "stream": stream}
+    if endpoint == "/api/chat":
+        payload["messages"] = [{"role": "user", "content": "Why is the sky blue? " * 8}]
+    elif endpoint == "/api/embed":
+        payload["input"] = "The quick brown fox jumps over the lazy dog. " * 8
+        payload.pop("stream")
+    else:
+        payload["prompt"] = "Why is the sky blue? " * 8
+    if num_predict is not None:
+        payload["options"] = {"num_predict": num_predict}
+    return payload
+
+
+class LoadGenerator:
+    def __init__(self, base_url, concurrency):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def one(self, endpoint, payload, stream):
+        """发送单个请求，返回(总耗时, 首字节耗时, 是否成功)"""
+        start = time.perf_counter()
+        ttft = None
+        try:
+            resp = self._session().post(self.base_url + endpoint, json=payload, stream=stream, timeout=120)
+            if stream:
+                for chunk in resp.iter_content(chunk_size=None):
+                    if chunk and ttft is None:
+                        ttft = time.perf_counter() - start
+            else:
+                resp.content
+            total = time.perf_counter() - start
+            return total, ttft if ttft is not None else total, resp.status_code == 200
+        except requests.RequestException:
+            return time.perf_counter() - start, None, False
+
+    def run(self, endpoint, payload, stream, count):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(lambda _: self.one(endpoint, payload, stream), range(count)))
+        elapsed = time.perf_counter() - started
+        ok = [r for r in results if r[2]]
+        return {
+            "requests": count,
+            "errors": count - len(ok),
+            "elapsed_s": elapsed,
+            "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+            "latency": common.summarize([r[0] for r in ok]),
+            "ttft": common.summarize([r[1] for r in ok]),
+        }
+
+
+def rss_median(proc, samples, interval=0.1):
+    """多次读取RSS取中位数，减少单次读取受分配器和GC时机的影响"""
+    readings = []
+    for i in range(samples):
+        if i:
+            time.sleep(interval)
+        readings.append(proc.memory_info().rss)
+    return statistics.median(readings)
+
+
+def measure_stream_memory(proxy_url, proxy_pid, streams, settle, samples=5):
+    """保持若干流式请求处于打开状态，测量代理进程的RSS增量"""
+    proc = psutil.Process(proxy_pid)
+    # 先完整走一次流式请求，让连接池、线程和首次分配计入基线
+    warmup = build_payload("/api/generate", True, num_predict=64)
+    with requests.post(proxy_url + "/api/generate", json=warmup, stream=True, timeout=120) as resp:
+        for _ in resp.iter_content(chunk_size=None):
+            pass
+    baseline = rss_median(proc, samples)
+    stop = threading.Event()
+    opened = []
+
+    def hold():
+        # 输出足够多的token，使流在测量期间保持打开
+        payload = build_payload("/api/generate", True, num_predict=100000)
+        try:
+            with requests.post(proxy_url + "/api/generate", json=payload, stream=True, timeout=120) as resp:
+                opened.append(resp.status_code)
+                for _ in resp.iter_content(chunk_size=None):
+                    if stop.is_set():
+                        break
+        except requests.RequestException:
+            pass
+
+    threads = [threading.Thread(target=hold, daemon=True) for _ in range(streams)]
+    for t in threads:
+        t.start()
+    time.sleep(settle)
+    peak = rss_median(proc, samples)
+    stop.set()
+    return {
+        "open_streams": streams,
+        "rss_samples": samples,
+        "rss_idle_bytes": baseline,
+        "rss_open_bytes": peak,
+        "per_stream_bytes": (peak - baseline) / streams if streams else 0,
+    }
+
+
+def measure_db_writes(monitor_module, db_file, rows):
+    """测量OllamaMetricsDB的写入吞吐"""
+    db = monitor_module.OllamaMetricsDB(db_file)
+    log = {
+        "timestamp": None,
+        "client_ip": "127.0.0.1",
+        "model_name": "llama3.2:3b",
+        "input_tokens": 42,
+        "output_tokens": 128,
+        "response_time": 1.5,
+        "status_code": 200,
+        "endpoint": "/api/generate",
+    }
+    start = time.perf_counter()
+    for _ in range(rows):
+        log["timestamp"] = monitor_module.datetime.now().isoformat()
+        db.save_request_log(dict(log))
+    request_elapsed = time.perf_counter() - start
+
+    metrics = {
+        "timestamp": None,
+        "server_status": True,
+        "system": {"cpu_percent": 12.5, "memory_percent": 40.1, "disk_percent": 55.0,
+                   "network_bytes_sent": 123456789, "network_bytes_recv": 987654321},
+        "gpu": {"gpu_name": "Fake GPU", "gpu_utilization": 80.0, "gpu_memory_total": 24576.0,
+                "gpu_memory_used": 8192.0, "gpu_temperature": 65.0, "gpu_power_draw": 250.0,
+                "gpu_power_limit": 350.0},
+        "ollama_process": {"cpu_percent": 5.0, "memory_percent": 10.0, "connections": 3},
+    }
+    start = time.perf_counter()
+    for _ in range(rows):
+        metrics["timestamp"] = monitor_module.datetime.now().isoformat()
+        db.save_system_metrics(metrics)
+        db.save_gpu_metrics(metrics)
+    tick_elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "request_log_rows_per_s": rows / request_elapsed if request_elapsed else 0.0,
+        "request_log_write_ms": request_elapsed / rows * 1000.0,
+        "metrics_ticks_per_s": rows / tick_elapsed if tick_elapsed else 0.0,
+        "metrics_tick_write_ms": tick_elapsed / rows * 1000.0,
+    }
+
+
+def serve_proxy(args):
+    """子进程模式：以生产相同的方式运行代理"""
+    monitor_module = common.import_monitor(args.workdir)
+    monitor_module.OLLAMA_HOST = args.upstream
+    monitor_module.DB_FILE = args.db
+    monitor_module.OllamaMetricsDB(args.db)
+    monitor_module.serve(monitor_module.app, host="127.0.0.1", port=args.port, threads=args.proxy_threads)
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="ollama-bench-")
+    fake_port, proxy_port = common.free_port(), common.free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    proxy_url = f"http://127.0.0.1:{proxy_port}/ollama"
+    db_file = os.path.join(workdir, "bench.db")
+    procs = []
+    try:
+        procs.append(common.spawn([
+            os.path.join(common.BENCH_DIR, "fake_ollama.py"),
+            "--port", str(fake_port),
+            "--ttft", str(args.ttft),
+            "--token-rate", str(args.token_rate),
+            "--tokens", str(args.tokens),
+        ], stdout=subprocess.DEVNULL))
+        common.wait_http(fake_url + "/api/version")
+        procs.append(common.spawn([
+            os.path.abspath(__file__), "--serve-proxy",
+            "--upstream", fake_url,
+            "--port", str(proxy_port),
+            "--db", db_file,
+            "--workdir", workdir,
+            "--proxy-threads", str(args.proxy_threads),
+        ]))
+        common.wait_http(proxy_url + "/api/version")
+
+        results = {"scenarios": {}}
+        direct = LoadGenerator(fake_url, args.concurrency)
+        proxied = LoadGenerator(proxy_url, args.concurrency)
+        for name in args.scenarios.split(","):
+            endpoint, stream = SCENARIOS[name]
+            payload = build_payload(endpoint, stream)
+            # 预热连接和代理进程
+            proxied.run(endpoint, payload, stream, min(args.concurrency, args.requests))
+            base = direct.run(endpoint, payload, stream, args.requests)
+            via = proxied.run(endpoint, payload, stream, args.requests)
+            added = {}
+            for key in ("p50_ms", "p99_ms"):
+                if base["latency"].get(key) is not None and via["latency"].get(key) is not None:
+                    added[f"added_latency_{key}"] = via["latency"][key] - base["latency"][key]
+                if base["ttft"].get(key) is not None and via["ttft"].get(key) is not None:
+                    added[f"ttft_delay_{key}"] = via["ttft"][key] - base["ttft"][key]
+            results["scenarios"][name] = {"direct": base, "proxy": via, "overhead": added}
+            print(f"{name:<16} proxy {via['throughput_rps']:8.1f} req/s  "
+                  f"added p50 {added.get('added_latency_p50_ms', 0):7.2f} ms  "
+                  f"p99 {added.get('added_latency_p99_ms', 0):7.2f} ms  "
+                  f"ttft delay p50 {added.get('ttft_delay_p50_ms', 0):8.2f} ms  "
+                  f"errors {via['errors']}")
+
+        results["stream_memory"] = measure_stream_memory(proxy_url, procs[1].pid, args.open_streams, args.settle,
+                                                         args.rss_samples)
+        print(f"memory per open stream: {results['stream_memory']['per_stream_bytes'] / 1024:.1f} KiB")
+
+        monitor_module = common.import_monitor(workdir)
+        results["db_writes"] = measure_db_writes(monitor_module, os.path.join(workdir, "writes.db"), args.db_rows)
+        print(f"db writes: {results['db_writes']['request_log_rows_per_s']:.0f} request logs/s, "
+              f"{results['db_writes']['metrics_ticks_per_s']:.0f} metric ticks/s")
+        return results
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=5)
+            except Exception:
+                proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Ollama Monitor 代理基准测试")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--ttft", type=float, default=0.02)
+    parser.add_argument("--token-rate", type=float, default=500.0)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--proxy-threads", type=int, default=10, help="与生产一致的waitress线程数")
+    parser.add_argument("--open-streams", type=int, default=8)
+    parser.add_argument("--settle", type=float, default=2.0, help="测量内存前保持流打开的秒数")
+    parser.add_argument("--rss-samples", type=int, default=5, help="每次内存测量读取RSS的次数，取中位数")
+    parser.add_argument("--db-rows", type=int, default=500)
+    parser.add_argument("--output", help="结果JSON路径")
+    parser.add_argument("--compare", help="与之前的结果JSON比较")
+    # 内部使用：代理子进程
+    parser.add_argument("--serve-proxy", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.serve_proxy:
+        serve_proxy(args)
+        return 0
+    results = {"meta": common.run_metadata("proxy", args), "results": run_benchmark(args)}
+    common.save_results(args.output or common.default_output("proxy"), results)
+    if args.compare:
+        with open(args.compare) as f:
+            common.compare_results(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
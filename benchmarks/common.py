@@ -0,0 +1,151 @@
+"""基准测试公共工具"""
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+
+def import_monitor(workdir):
+    """
+    在隔离的工作目录中导入ollama_monitor
+
+    导入前先配置根日志，使模块中的basicConfig不再写入/app/log。
+    """
+    logging.basicConfig(level=logging.WARNING)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import ollama_monitor
+    return ollama_monitor
+
+
+def free_port():
+    """获取一个空闲的本地端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url, timeout=15.0):
+    """等待HTTP服务可用"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"服务未在{timeout}秒内就绪: {url}")
+
+
+def spawn(args, **kwargs):
+    """以子进程方式启动Python脚本"""
+    return subprocess.Popen([sys.executable] + list(args), cwd=REPO_DIR, **kwargs)
+
+
+def percentile(values, p):
+    """线性插值计算百分位数，values无需预先排序"""
+    if not values:
+        return None
+    data = sorted(values)
+    k = (len(data) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (k - lo)
+
+
+def summarize(values):
+    """返回常用的延迟统计(毫秒)"""
+    if not values:
+        return {"count": 0}
+    ms = [v * 1000.0 for v in values]
+    return {
+        "count": len(ms),
+        "mean_ms": sum(ms) / len(ms),
+        "p50_ms": percentile(ms, 50),
+        "p90_ms": percentile(ms, 90),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": max(ms),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_metadata(name, args):
+    return {
+        "benchmark": name,
+        "timestamp": datetime.now().isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def default_output(name):
+    return os.path.join(RESULTS_DIR, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+
+
+def save_results(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"结果已保存: {path}")
+
+
+def flatten(obj, prefix=""):
+    """把嵌套字典展开为 {"a.b.c": 数值}"""
+    items = {}
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            items.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        items[prefix[:-1]] = obj
+    return items
+
+
+def compare_results(old, new, threshold=None, min_abs_ms=0.0, lower_is_better=("_ms", "_bytes", "_s")):
+    """
+    打印两次运行的数值差异
+
+    参数:
+        threshold: 若设置，耗时/体积类指标增长超过该比例时视为回退
+        min_abs_ms: 毫秒类指标的绝对增长低于该值时忽略，避免小数值的抖动误报
+    返回:
+        回退的指标列表
+    """
+    old_flat = flatten(old.get("results", {}))
+    new_flat = flatten(new.get("results", {}))
+    regressions = []
+    print(f"{'metric':<60} {'old':>14} {'new':>14} {'change':>9}")
+    for key in sorted(set(old_flat) & set(new_flat)):
+        a, b = old_flat[key], new_flat[key]
+        change = (b - a) / a if a else 0.0
+        flag = ""
+        noise = key.endswith("_ms") and b - a < min_abs_ms
+        if threshold is not None and key.endswith(lower_is_better) and change > threshold and not noise:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<60} {a:>14.3f} {b:>14.3f} {change:>+8.1%}{flag}")
+    return regressions
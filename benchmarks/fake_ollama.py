@@ -0,0 +1,347 @@
+"""
+本地模拟Ollama服务器
+
+用于基准测试的Ollama替身，提供 /api/generate、/api/chat、/api/embed 等接口，
+可配置首token延迟、token生成速率、输出长度以及冷加载延迟。
+
+用法:
+    python benchmarks/fake_ollama.py --port 11435 --ttft 0.05 --token-rate 50
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODELS = ["llama3.2:3b", "qwen2.5:7b", "mistral:7b"]
+
+
+class FakeOllamaConfig:
+    def __init__(self, ttft=0.05, token_rate=50.0, tokens=32, jitter=0.0,
+                 embed_latency=0.01, embed_dim=768, load_delay=0.0,
+                 keep_alive=300.0, models=None, parallel=0):
+        """
+        初始化模拟服务器配置
+
+        参数:
+            ttft: 首token延迟(秒)，非流式请求同样计入
+            token_rate: 每秒生成的token数
+            tokens: 默认输出token数(可被options.num_predict覆盖)
+            jitter: 延迟的随机抖动比例(0~1)
+            embed_latency: embed请求延迟(秒)
+            embed_dim: embedding向量维度
+            load_delay: 模型未加载时的冷加载延迟(秒)
+            keep_alive: 默认模型驻留时间(秒)
+            models: 模拟的模型名称列表
+            parallel: 同时处理的生成请求数(类似OLLAMA_NUM_PARALLEL)，0表示不限制
+        """
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.jitter = jitter
+        self.embed_latency = embed_latency
+        self.embed_dim = embed_dim
+        self.load_delay = load_delay
+        self.keep_alive = keep_alive
+        self.models = models or list(DEFAULT_MODELS)
+        self.parallel = parallel
+        # 超出并发数的请求在此排队，模拟Ollama的请求队列
+        self.slots = threading.Semaphore(parallel) if parallel else None
+        # 已加载模型 -> 过期时间
+        self.loaded = {}
+        self.lock = threading.Lock()
+        self.request_count = 0
+        # 收到的W3C traceparent头，用于验证追踪上下文的传递
+        self.traceparents = []
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _parse_keep_alive(value, default):
+    """解析keep_alive参数，支持数字秒和 '5m'、'1h' 形式"""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = {"s": 1, "m": 60, "h": 3600}
+    value = str(value).strip()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOllama/0.1"
+    # 头部与正文分两次写出，关闭Nagle避免与延迟ACK叠加产生40ms停顿
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # 基准测试时不输出访问日志
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _jittered(self, value):
+        if self.config.jitter:
+            value *= 1 + random.uniform(-self.config.jitter, self.config.jitter)
+        return max(value, 0.0)
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _load_model(self, model, keep_alive):
+        """模拟模型加载，返回加载耗时(秒)"""
+        cfg = self.config
+        now = time.time()
+        with cfg.lock:
+            cfg.request_count += 1
+            expires = cfg.loaded.get(model)
+            cold = expires is None or expires < now
+        load_duration = 0.0
+        if cold and cfg.load_delay:
+            load_duration = self._jittered(cfg.load_delay)
+            time.sleep(load_duration)
+        ttl = _parse_keep_alive(keep_alive, cfg.keep_alive)
+        with cfg.lock:
+            if ttl == 0:
+                cfg.loaded.pop(model, None)
+            else:
+                cfg.loaded[model] = float("inf") if ttl < 0 else time.time() + ttl
+        return load_duration
+
+    def do_GET(self):
+        if self.path in ("/", ""):
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path.startswith("/api/version"):
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path.startswith("/api/tags"):
+            self._send_json({"models": [
+                {
+                    "name": name,
+                    "model": name,
+                    "modified_at": _now(),
+                    "size": 4_000_000_000,
+                    "details": {"family": name.split(":")[0], "parameter_size": name.split(":")[-1].upper()},
+                }
+                for name in self.config.models
+            ]})
+        elif self.path.startswith("/api/ps"):
+            now = time.time()
+            with self.config.lock:
+                loaded = [(m, exp) for m, exp in self.config.loaded.items() if exp >= now]
+            self._send_json({"models": [
+                {
+                    "name": m,
+                    "model": m,
+                    "size": 4_000_000_000,
+                    "size_vram": 4_000_000_000,
+                    "expires_at": datetime.fromtimestamp(min(exp, now + 10 ** 8), timezone.utc).isoformat(),
+                }
+                for m, exp in loaded
+            ]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        data = self._read_json()
+        traceparent = self.headers.get("traceparent")
+        if traceparent:
+            with self.config.lock:
+                self.config.traceparents.append(traceparent)
+        if self.path.startswith("/api/generate") or self.path.startswith("/api/chat"):
+            slots = self.config.slots
+            if slots is None:
+                self._handle_generate(data, chat=self.path.startswith("/api/chat"))
+                return
+            with slots:
+                self._handle_generate(data, chat=self.path.startswith("/api/chat"))
+        elif self.path.startswith("/api/embed"):
+            self._handle_embed(data)
+        elif self.path.startswith("/api/show"):
+            self._send_json({"modelfile": "", "details": {"family": "fake"}})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _handle_generate(self, data, chat):
+        cfg = self.config
+        model = data.get("model") or cfg.models[0]
+        stream = data.get("stream", True)
+        options = data.get("options") or {}
+        num_predict = int(options.get("num_predict") or cfg.tokens)
+        if chat:
+            prompt = " ".join(str(m.get("content", "")) for m in data.get("messages") or [])
+        else:
+            prompt = str(data.get("prompt", ""))
+        prompt_tokens = len(prompt.split())
+        start = time.time()
+
+        load_duration = self._load_model(model, data.get("keep_alive"))
+        # 空提示词只加载模型，与Ollama行为一致
+        if not prompt:
+            num_predict = 0
+
+        prompt_eval_duration = self._jittered(cfg.ttft)
+        time.sleep(prompt_eval_duration)
+        interval = 1.0 / cfg.token_rate if cfg.token_rate > 0 else 0.0
+
+        def chunk(text, done):
+            obj = {"model": model, "created_at": _now(), "done": done}
+            if chat:
+                obj["message"] = {"role": "assistant", "content": text}
+            else:
+                obj["response"] = text
+            return obj
+
+        def final(eval_duration):
+            obj = chunk("", True)
+            obj.update({
+                "done_reason": "stop",
+                "total_duration": int((time.time() - start) * 1e9),
+                "load_duration": int(load_duration * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_eval_duration * 1e9),
+                "eval_count": num_predict,
+                "eval_duration": int(eval_duration * 1e9),
+            })
+            return obj
+
+        if not stream:
+            eval_start = time.time()
+            if num_predict:
+                time.sleep(self._jittered(interval * num_predict))
+            result = final(time.time() - eval_start)
+            text = " ".join("tok" for _ in range(num_predict))
+            if chat:
+                result["message"] = {"role": "assistant", "content": text}
+            else:
+                result["response"] = text
+            self._send_json(result)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            eval_start = time.time()
+            for i in range(num_predict):
+                if i and interval:
+                    time.sleep(self._jittered(interval))
+                self._write_chunk(json.dumps(chunk("tok ", False)).encode() + b"\n")
+            self._write_chunk(json.dumps(final(time.time() - eval_start)).encode() + b"\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _handle_embed(self, data):
+        cfg = self.config
+        model = data.get("model") or cfg.models[0]
+        inputs = data.get("input", data.get("prompt", ""))
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        start = time.time()
+        load_duration = self._load_model(model, data.get("keep_alive"))
+        time.sleep(self._jittered(cfg.embed_latency))
+        vector = [round(random.random(), 6) for _ in range(cfg.embed_dim)]
+        self._send_json({
+            "model": model,
+            "embeddings": [vector for _ in inputs],
+            "total_duration": int((time.time() - start) * 1e9),
+            "load_duration": int(load_duration * 1e9),
+            "prompt_eval_count": sum(len(str(i).split()) for i in inputs),
+        })
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config=None):
+        super().__init__(address, FakeOllamaHandler)
+        self.config = config or FakeOllamaConfig()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_fake_server(host="127.0.0.1", port=0, **kwargs):
+    """在后台线程中启动模拟服务器，返回服务器对象"""
+    server = FakeOllamaServer((host, port), FakeOllamaConfig(**kwargs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="本地模拟Ollama服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=0.05, help="首token延迟(秒)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="每秒生成token数")
+    parser.add_argument("--tokens", type=int, default=32, help="默认输出token数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟抖动比例")
+    parser.add_argument("--embed-latency", type=float, default=0.01)
+    parser.add_argument("--embed-dim", type=int, default=768)
+    parser.add_argument("--load-delay", type=float, default=0.0, help="冷加载延迟(秒)")
+    parser.add_argument("--keep-alive", type=float, default=300.0, help="默认模型驻留时间(秒)")
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS))
+    parser.add_argument("--parallel", type=int, default=0, help="同时处理的生成请求数，0表示不限制")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    config = FakeOllamaConfig(
+        ttft=args.ttft,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        jitter=args.jitter,
+        embed_latency=args.embed_latency,
+        embed_dim=args.embed_dim,
+        load_delay=args.load_delay,
+        keep_alive=args.keep_alive,
+        models=[m for m in args.models.split(",") if m],
+        parallel=args.parallel,
+    )
+    server = FakeOllamaServer((args.host, args.port), config)
+    print(f"Fake Ollama listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
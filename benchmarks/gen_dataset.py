@@ -0,0 +1,227 @@
+"""
+合成多月监控数据集生成器
+
+按生产环境相同的表结构和时间戳格式填充 system_metrics、gpu_metrics、
+request_logs 和 models 表，用于评估长期运行后的查询与仪表板性能。
+
+用法:
+    python benchmarks/gen_dataset.py --db /tmp/ollama_30d.db --preset full
+    python benchmarks/gen_dataset.py --db /tmp/ollama_small.db --days 2 --requests 20000
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import common
+
+PRESETS = {
+    # CI环境下几秒内完成
+    "ci": {"days": 2, "interval": 5, "requests": 20000},
+    # 约一个月、5秒采样、100万请求
+    "full": {"days": 30, "interval": 5, "requests": 1000000},
+}
+
+MODELS = [
+    ("llama3.2:3b", "3.2B", "llama", 2019393189),
+    ("qwen2.5:7b", "7.6B", "qwen2", 4683087332),
+    ("mistral:7b", "7.2B", "llama", 4113301824),
+    ("gemma2:9b", "9.2B", "gemma2", 5443152417),
+    ("nomic-embed-text:latest", "137M", "nomic-bert", 274302450),
+]
+# 模型请求占比，近似长尾分布
+MODEL_WEIGHTS = [0.45, 0.25, 0.15, 0.1, 0.05]
+ENDPOINTS = [("/api/chat", 0.6), ("/api/generate", 0.3), ("/api/embed", 0.1)]
+CLIENTS = [f"10.0.{i // 50}.{i % 50 + 10}" for i in range(120)]
+
+
+def diurnal(ts):
+    """返回0~1之间的日内负载系数，下午达到峰值"""
+    hour = ts.hour + ts.minute / 60.0
+    return 0.5 + 0.5 * math.sin((hour - 8) / 24.0 * 2 * math.pi)
+
+
+def iter_ticks(start, days, interval):
+    total = int(days * 86400 / interval)
+    for i in range(total):
+        yield start + timedelta(seconds=i * interval)
+
+
+def system_rows(start, days, interval, rng):
+    sent = recv = 0
+    for ts in iter_ticks(start, days, interval):
+        load = diurnal(ts)
+        sent += int(rng.uniform(2e4, 2e5) * (0.3 + load))
+        recv += int(rng.uniform(5e4, 6e5) * (0.3 + load))
+        yield (
+            ts.isoformat(),
+            1 if rng.random() > 0.001 else 0,
+            round(min(100.0, 10 + 60 * load + rng.gauss(0, 5)), 1),
+            round(min(100.0, 35 + 20 * load + rng.gauss(0, 2)), 1),
+            round(55 + (ts - start).total_seconds() / (days * 86400) * 10, 1),
+            sent,
+            recv,
+            round(max(0.0, 5 + 50 * load + rng.gauss(0, 5)), 1),
+            round(max(0.0, 8 + 10 * load + rng.gauss(0, 1)), 2),
+            rng.randint(0, 12),
+        )
+
+
+def gpu_rows(start, days, interval, rng):
+    for ts in iter_ticks(start, days, interval):
+        load = diurnal(ts)
+        util = max(0.0, min(100.0, 90 * load + rng.gauss(0, 8)))
+        yield (
+            ts.isoformat(),
+            "NVIDIA GeForce RTX 4090",
+            round(util, 1),
+            24564.0,
+            round(8000 + 12000 * load + rng.gauss(0, 300), 0),
+            round(38 + 40 * util / 100 + rng.gauss(0, 1.5), 0),
+            round(30 + 400 * util / 100 + rng.gauss(0, 10), 2),
+            450.0,
+        )
+
+
+def model_rows(start, days, interval, every):
+    for i, ts in enumerate(iter_ticks(start, days, interval)):
+        if i % every:
+            continue
+        stamp = ts.isoformat()
+        for name, params, family, size in MODELS:
+            yield (stamp, name, str(size), params, "2025-01-01T00:00:00Z", family)
+
+
+def request_rows(start, days, count, rng):
+    span = days * 86400
+    # 按日内负载拒绝采样，得到昼夜起伏的到达时间
+    offsets = []
+    while len(offsets) < count:
+        offset = rng.random() * span
+        if rng.random() < 0.2 + 0.8 * diurnal(start + timedelta(seconds=offset)):
+            offsets.append(offset)
+    offsets.sort()
+    model_names = [m[0] for m in MODELS]
+    endpoints = [e[0] for e in ENDPOINTS]
+    endpoint_weights = [e[1] for e in ENDPOINTS]
+    for offset in offsets:
+        model = rng.choices(model_names, MODEL_WEIGHTS)[0]
+        endpoint = "/api/embed" if model.startswith("nomic") else rng.choices(endpoints, endpoint_weights)[0]
+        input_tokens = int(rng.lognormvariate(5, 1))
+        output_tokens = 0 if endpoint == "/api/embed" else int(rng.lognormvariate(5.5, 0.8))
+        response_time = 0.05 + input_tokens / 3000.0 + output_tokens / rng.uniform(30, 120)
+        yield (
+            (start + timedelta(seconds=offset)).isoformat(),
+            rng.choice(CLIENTS),
+            model,
+            input_tokens,
+            output_tokens,
+            round(response_time, 4),
+            200 if rng.random() > 0.01 else rng.choice([400, 404, 500]),
+            endpoint,
+        )
+
+
+def insert(conn, sql, rows, batch):
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch:
+            conn.executemany(sql, chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        conn.executemany(sql, chunk)
+        count += len(chunk)
+    conn.commit()
+    return count
+
+
+def generate(db_file, days, interval, requests_count, model_every=1, seed=42, batch=50000, quiet=False):
+    """生成数据集，返回各表写入的行数"""
+    workdir = tempfile.mkdtemp(prefix="ollama-gen-")
+    monitor_module = common.import_monitor(workdir)
+    # 由OllamaMetricsDB建表，保证与生产结构一致
+    monitor_module.OllamaMetricsDB(db_file)
+
+    rng = random.Random(seed)
+    start = (datetime.now() - timedelta(days=days)).replace(microsecond=0)
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA journal_mode=MEMORY")
+    counts = {}
+    steps = [
+        ("system_metrics", '''
+            INSERT INTO system_metrics (
+                timestamp, server_status, cpu_percent, memory_percent,
+                disk_percent, network_bytes_sent, network_bytes_recv,
+                ollama_cpu_percent, ollama_memory_percent, ollama_connections
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', system_rows(start, days, interval, rng)),
+        ("gpu_metrics", '''
+            INSERT INTO gpu_metrics (
+                timestamp, gpu_name, gpu_utilization, gpu_memory_total, gpu_memory_used,
+                gpu_temperature, gpu_power_draw, gpu_power_limit
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', gpu_rows(start, days, interval, rng)),
+        ("models", '''
+            INSERT INTO models (
+                timestamp, model_name, model_size, parameter_size,
+                modified_at, model_family
+            ) VALUES (?, ?, ?, ?, ?, ?)''', model_rows(start, days, interval, model_every)),
+        ("request_logs", '''
+            INSERT INTO request_logs (
+                timestamp, client_ip, model_name, input_tokens,
+                output_tokens, response_time, status_code, endpoint
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', request_rows(start, days, requests_count, rng)),
+    ]
+    for table, sql, rows in steps:
+        started = time.time()
+        counts[table] = insert(conn, sql, rows, batch)
+        if not quiet:
+            print(f"{table:<16} {counts[table]:>10} rows  {time.time() - started:6.1f}s", flush=True)
+    conn.close()
+    return counts
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="生成合成的Ollama Monitor数据集")
+    parser.add_argument("--db", required=True, help="输出的SQLite文件")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="ci")
+    parser.add_argument("--days", type=float, help="覆盖预设的天数")
+    parser.add_argument("--interval", type=float, help="覆盖预设的采样间隔(秒)")
+    parser.add_argument("--requests", type=int, help="覆盖预设的请求数")
+    parser.add_argument("--model-every", type=int, default=1,
+                        help="每隔多少个采样周期写入一次模型列表(生产环境为1)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="覆盖已存在的数据库")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    preset = PRESETS[args.preset]
+    db_file = os.path.abspath(args.db)
+    if os.path.exists(db_file):
+        if not args.force:
+            print(f"数据库已存在: {db_file} (使用 --force 覆盖)")
+            return 1
+        os.remove(db_file)
+    generate(
+        db_file,
+        days=args.days or preset["days"],
+        interval=args.interval or preset["interval"],
+        requests_count=args.requests or preset["requests"],
+        model_every=args.model_every,
+        seed=args.seed,
+    )
+    print(f"数据集已生成: {db_file} ({os.path.getsize(db_file) / 1024 / 1024:.1f} MiB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+合成Ollama服务日志生成器
+
+按Ollama服务日志的格式(logfmt、GIN访问日志和llama.cpp输出混杂)持续写入日志文件，
+按比例插入模型加载、显存不足、退回CPU、上下文移位和runner崩溃事件，可按行数轮转
+(改名或copytruncate)，用于测试日志跟踪。结束时输出各事件的预期数量；指定 --check
+时从监控的 /api/ollama-log 读取实际识别的数量并比较，不一致时以非零状态退出。
+
+用法:
+    python benchmarks/gen_ollama_log.py --log /tmp/ollama.log --lines 5000 --rate 500
+    python benchmarks/gen_ollama_log.py --log /tmp/ollama.log --rotate-every 1000 --check http://localhost:3010
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import urllib.request
+from datetime import datetime
+
+EVENTS = ["load", "oom", "cpu_fallback", "context_shift", "runner_crash"]
+# 每行插入事件的概率
+EVENT_RATE = 0.02
+
+
+def now():
+    return datetime.now().astimezone().isoformat(timespec="milliseconds")
+
+
+def blob(rng):
+    return "/root/.ollama/models/blobs/sha256-" + "".join(rng.choice("0123456789abcdef") for _ in range(64))
+
+
+def noise_line(rng):
+    """不产生事件的普通日志行"""
+    kind = rng.random()
+    if kind < 0.6:
+        stamp = datetime.now().strftime("%Y/%m/%d - %H:%M:%S")
+        path = rng.choice(["/api/chat", "/api/generate", "/api/embed", "/api/tags"])
+        return (f'[GIN] {stamp} | 200 | {rng.uniform(0.01, 20):>10.6f}s | '
+                f'{rng.choice(["127.0.0.1", "10.0.0.12", "10.0.0.31"]):>15} | POST     "{path}"')
+    if kind < 0.8:
+        return f'time={now()} level=INFO source=sched.go:507 msg="updated VRAM based on existing loaded models" gpu=GPU-0 library=cuda'
+    if kind < 0.9:
+        return f'time={now()} level=DEBUG source=sched.go:575 msg="evaluating already loaded" model={blob(rng)}'
+    return "llama_new_context_with_model: n_ctx      = 8192"
+
+
+def event_lines(event, rng):
+    """返回产生该事件的日志行，以及这些行产生的 {事件: 数量}"""
+    if event == "load":
+        layers = rng.choice([29, 33, 43])
+        # 少数加载只能把部分层放到GPU上，额外产生一个cpu_fallback
+        offloaded = layers if rng.random() < 0.8 else rng.randrange(0, layers)
+        lines = [
+            f'time={now()} level=INFO source=server.go:376 msg="starting llama server" cmd="ollama runner" model={blob(rng)}',
+            f"llm_load_tensors: offloaded {offloaded}/{layers} layers to GPU",
+            f'time={now()} level=INFO source=server.go:601 msg="llama runner started in {rng.uniform(0.5, 30):.2f} seconds"',
+        ]
+        counts = {"load": 1}
+        if offloaded < layers:
+            counts["cpu_fallback"] = 1
+        return lines, counts
+    if event == "oom":
+        return [f"ggml_backend_cuda_buffer_type_alloc_buffer: allocating {rng.uniform(500, 8000):.2f} MiB "
+                f"on device 0: cudaMalloc failed: out of memory"], {"oom": 1}
+    if event == "cpu_fallback":
+        return [f'time={now()} level=INFO source=gpu.go:221 msg="no compatible GPUs were discovered"'], {"cpu_fallback": 1}
+    if event == "context_shift":
+        return [f'time={now()} level=DEBUG source=cache.go:236 msg="context limit hit - shifting" '
+                f'id=0 limit=8192 input=8192 keep=4 discard={rng.randrange(1000, 4000)}'], {"context_shift": 1}
+    return [f'time={now()} level=ERROR source=sched.go:455 msg="error loading llama server" '
+            f'error="llama runner process has terminated: signal: segmentation fault"'], {"runner_crash": 1}
+
+
+def rotate(path, mode):
+    """轮转日志：rename把当前文件改名为.1(下次写入时新建)；truncate先复制再清空原文件"""
+    if mode == "rename":
+        os.replace(path, path + ".1")
+    else:
+        with open(path, "rb") as src, open(path + ".1", "wb") as dst:
+            dst.write(src.read())
+        with open(path, "r+b") as f:
+            f.truncate(0)
+
+
+def write_log(path, lines, rate=0.0, rotate_every=0, rotate_mode="rename", rotate_pause=0.5,
+              partial=True, seed=42):
+    """
+    写入合成日志
+
+    参数:
+        lines: 写入的普通行数(事件行另计)
+        rate: 每秒写入的行数，0表示不限速
+        rotate_every: 每写入多少行轮转一次，0表示不轮转
+        rotate_pause: 轮转前等待的秒数，让跟踪方读完旧文件
+        partial: 是否把部分行分两次写入，检验不完整的行不会被提前解析
+
+    返回:
+        {事件: 预期数量}
+    """
+    rng = random.Random(seed)
+    expected = {event: 0 for event in EVENTS}
+    f = open(path, "a")
+    try:
+        for i in range(lines):
+            if rng.random() < EVENT_RATE:
+                block, counts = event_lines(rng.choice(EVENTS), rng)
+                for event, n in counts.items():
+                    expected[event] += n
+            else:
+                block = [noise_line(rng)]
+            for line in block:
+                if partial and rng.random() < 0.05:
+                    cut = rng.randrange(1, len(line))
+                    f.write(line[:cut])
+                    f.flush()
+                    time.sleep(0.01)
+                    f.write(line[cut:] + "\n")
+                else:
+                    f.write(line + "\n")
+            f.flush()
+            if rate:
+                time.sleep(1.0 / rate)
+            if rotate_every and (i + 1) % rotate_every == 0:
+                time.sleep(rotate_pause)
+                f.close()
+                rotate(path, rotate_mode)
+                f = open(path, "a")
+    finally:
+        f.close()
+    return expected
+
+
+def fetch_status(url):
+    with urllib.request.urlopen(url.rstrip("/") + "/api/ollama-log", timeout=10) as response:
+        return json.load(response)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="生成合成Ollama服务日志")
+    parser.add_argument("--log", required=True, help="写入的日志文件")
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=0.0, help="每秒写入的行数，0表示不限速")
+    parser.add_argument("--rotate-every", type=int, default=0, help="每N行轮转一次")
+    parser.add_argument("--rotate-mode", choices=["rename", "truncate"], default="rename")
+    parser.add_argument("--rotate-pause", type=float, default=0.5,
+                        help="轮转前等待的秒数；跟踪方按间隔轮询时应大于轮询间隔")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--check", help="监控地址，如 http://localhost:3010；比较识别出的事件数量")
+    parser.add_argument("--check-timeout", type=float, default=30.0)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    before = fetch_status(args.check)["events"] if args.check else {}
+    expected = write_log(
+        args.log,
+        args.lines,
+        rate=args.rate,
+        rotate_every=args.rotate_every,
+        rotate_mode=args.rotate_mode,
+        rotate_pause=args.rotate_pause,
+        seed=args.seed,
+    )
+    print(json.dumps({"expected": expected}, ensure_ascii=False))
+    if not args.check:
+        return 0
+    deadline = time.time() + args.check_timeout
+    while True:
+        after = fetch_status(args.check)["events"]
+        actual = {event: after.get(event, 0) - before.get(event, 0) for event in EVENTS}
+        if actual == expected or time.time() > deadline:
+            break
+        time.sleep(0.5)
+    print(json.dumps({"actual": actual}, ensure_ascii=False))
+    if actual != expected:
+        print("识别出的事件数量与预期不一致")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+本地HTTP接收端
+
+记录收到的POST请求正文，用于测试告警webhook等投递；可让前N个请求返回错误，
+以验证重试和退避。
+
+用法:
+    python benchmarks/http_sink.py --port 9000
+    python benchmarks/http_sink.py --port 9000 --fail-first 3 --fail-status 503
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class HttpSinkConfig:
+    def __init__(self, fail_first=0, fail_status=500, delay=0.0, quiet=False):
+        """
+        初始化接收端配置
+
+        参数:
+            fail_first: 前多少个请求返回fail_status
+            fail_status: 失败时返回的状态码
+            delay: 每个请求的响应延迟(秒)
+            quiet: 不打印收到的请求
+        """
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.delay = delay
+        self.quiet = quiet
+        # 成功接收的请求：(接收时间, 路径, 正文)
+        self.received = []
+        self.attempts = 0
+        self.lock = threading.Lock()
+
+
+class HttpSinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "HttpSink/0.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        cfg = self.server.config
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = raw.decode("utf-8", "replace")
+        if cfg.delay:
+            time.sleep(cfg.delay)
+        with cfg.lock:
+            cfg.attempts += 1
+            failed = cfg.attempts <= cfg.fail_first
+            if not failed:
+                cfg.received.append((time.time(), self.path, body))
+        status = cfg.fail_status if failed else 200
+        if not cfg.quiet:
+            print(f"{status} {self.path} {json.dumps(body, ensure_ascii=False)}", flush=True)
+        reply = json.dumps({"ok": not failed}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+
+class HttpSinkServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, HttpSinkHandler)
+        self.config = config or HttpSinkConfig()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def received(self):
+        with self.config.lock:
+            return list(self.config.received)
+
+    def wait_for(self, count, timeout=10.0):
+        """等待至少count个请求被成功接收，返回已接收的请求"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            received = self.received
+            if len(received) >= count:
+                return received
+            time.sleep(0.05)
+        raise TimeoutError(f"{timeout}秒内只收到{len(self.received)}个请求")
+
+
+def start_sink(host="127.0.0.1", port=0, **kwargs):
+    """在后台线程中启动接收端，返回服务器对象"""
+    kwargs.setdefault("quiet", True)
+    server = HttpSinkServer((host, port), HttpSinkConfig(**kwargs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="记录POST请求的本地HTTP接收端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--fail-first", type=int, default=0, help="前N个请求返回错误")
+    parser.add_argument("--fail-status", type=int, default=500)
+    parser.add_argument("--delay", type=float, default=0.0, help="响应延迟(秒)")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    config = HttpSinkConfig(
+        fail_first=args.fail_first,
+        fail_status=args.fail_status,
+        delay=args.delay,
+    )
+    server = HttpSinkServer((args.host, args.port), config)
+    print(f"HTTP sink listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
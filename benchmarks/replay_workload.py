@@ -0,0 +1,274 @@
+"""
+基于request_logs的负载回放
+
+按request_logs中记录的到达时间、模型、端点和token数重建流量：提示词为与输入token数
+相当的合成文本，num_predict限制为记录的输出token数。可按比例压缩时间(--speed)或
+放大流量(--load)，对目标Ollama(或本地模拟服务器)回放，并与原始记录比较吞吐、
+排队和延迟，用于回答"流量翻倍会怎样"之类的容量问题。
+
+用法:
+    python benchmarks/replay_workload.py --db /app/db/ollama_metrics.db --hours 1 --target http://localhost:11434
+    python benchmarks/replay_workload.py --db /tmp/ollama_small.db --hours 1 --speed 60 --load 2 --fake --fake-parallel 4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+import common
+import fake_ollama
+
+WORDS = ["the", "model", "token", "prompt", "server", "metric", "latency", "request", "memory", "queue"]
+
+
+def load_requests(db_file, hours, models=None, endpoints=None, limit=None):
+    """读取时间窗口内的请求日志，按时间顺序返回；监控循环的自测请求不是用户流量，不回放"""
+    monitor_module = common.import_monitor(tempfile.mkdtemp(prefix="ollama-replay-"))
+    logs = monitor_module.OllamaMetricsDB(db_file).get_recent_requests(hours)
+    logs.reverse()
+    logs = [log for log in logs if log["endpoint"] != monitor_module.OllamaMetricsDB.SELF_TEST_ENDPOINT]
+    if models:
+        logs = [log for log in logs if log["model_name"] in models]
+    if endpoints:
+        logs = [log for log in logs if log["endpoint"] in endpoints]
+    if limit:
+        logs = logs[:limit]
+    return logs
+
+
+def build_schedule(logs, speed=1.0, load=1.0, seed=42):
+    """
+    生成回放计划
+
+    参数:
+        speed: 时间压缩倍数，2表示以两倍速度回放
+        load: 流量倍数；整数部分为每条记录的重复次数，小数部分按概率多复制一次，
+              副本的到达时间在相邻两次到达之间随机偏移
+    返回:
+        [(相对开始的秒数, 日志)]，按时间排序
+    """
+    if not logs:
+        return []
+    rng = random.Random(seed)
+    start = datetime.fromisoformat(logs[0]["timestamp"])
+    offsets = [(datetime.fromisoformat(log["timestamp"]) - start).total_seconds() / speed for log in logs]
+    schedule = []
+    for i, log in enumerate(logs):
+        gap = (offsets[i + 1] - offsets[i]) if i + 1 < len(offsets) else 0.0
+        copies = int(load) + (1 if rng.random() < load - int(load) else 0)
+        for n in range(copies):
+            schedule.append((offsets[i] + (rng.random() * gap if n else 0.0), log))
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+
+def synthetic_prompt(tokens, rng):
+    return " ".join(rng.choice(WORDS) for _ in range(max(int(tokens or 0), 1)))
+
+
+def build_payload(log, max_tokens, rng):
+    """按记录的端点、模型和token数构造请求"""
+    endpoint = log["endpoint"] or "/api/generate"
+    prompt = synthetic_prompt(log["input_tokens"], rng)
+    if endpoint.startswith("/api/embed"):
+        return endpoint, {"model": log["model_name"], "input": prompt}
+    num_predict = int(log["output_tokens"] or 0)
+    if max_tokens:
+        num_predict = min(num_predict, max_tokens)
+    payload = {"model": log["model_name"], "stream": True, "options": {"num_predict": max(num_predict, 1)}}
+    if endpoint == "/api/chat":
+        payload["messages"] = [{"role": "user", "content": prompt}]
+    else:
+        endpoint = "/api/generate"
+        payload["prompt"] = prompt
+    return endpoint, payload
+
+
+class Replayer:
+    def __init__(self, target, concurrency, timeout):
+        self.target = target.rstrip("/")
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.timeout = timeout
+        self.results = []
+        self.lock = threading.Lock()
+
+    def send(self, scheduled, endpoint, payload):
+        sent = time.perf_counter()
+        record = {"scheduled": scheduled, "sent": sent, "endpoint": endpoint, "model": payload["model"],
+                  "status": None, "ttft": None, "latency": None, "compute": None, "output_tokens": 0}
+        try:
+            with self.session.post(self.target + endpoint, json=payload, stream=True, timeout=self.timeout) as resp:
+                record["status"] = resp.status_code
+                last = b""
+                for line in resp.iter_lines(chunk_size=None):
+                    if not line:
+                        continue
+                    if record["ttft"] is None:
+                        record["ttft"] = time.perf_counter() - sent
+                    last = line
+                done = time.perf_counter()
+            result = json.loads(last) if last else {}
+            record["latency"] = done - sent
+            record["output_tokens"] = result.get("eval_count", 0) or 0
+            # Ollama实际用于加载和计算的时间，其余部分视为排队与传输开销
+            durations = [result.get(k) for k in ("load_duration", "prompt_eval_duration", "eval_duration")]
+            if any(d is not None for d in durations):
+                record["compute"] = sum(d or 0 for d in durations) / 1e9
+        except (requests.RequestException, ValueError) as e:
+            record["error"] = type(e).__name__
+        with self.lock:
+            self.results.append(record)
+
+    def run(self, schedule, max_tokens, seed=42):
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        for offset, log in schedule:
+            endpoint, payload = build_payload(log, max_tokens, rng)
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.executor.submit(self.send, start + offset, endpoint, payload)
+        self.executor.shutdown(wait=True)
+        return time.perf_counter() - start
+
+
+def summarize_original(logs, speed):
+    if not logs:
+        return {}
+    span = (datetime.fromisoformat(logs[-1]["timestamp"]) - datetime.fromisoformat(logs[0]["timestamp"])).total_seconds()
+    span = max(span / speed, 1e-9)
+    latency = [log["response_time"] for log in logs if log["response_time"] is not None]
+    stats = common.summarize(latency)
+    return {
+        "requests": len(logs),
+        "duration_s": span,
+        "requests_per_s": len(logs) / span,
+        "output_tokens_per_s": sum(log["output_tokens"] or 0 for log in logs) / span,
+        "latency_p50_ms": stats.get("p50_ms"),
+        "latency_p99_ms": stats.get("p99_ms"),
+    }
+
+
+def summarize_replay(results, elapsed):
+    ok = [r for r in results if r["status"] == 200 and r["latency"] is not None]
+    latency = common.summarize([r["latency"] for r in ok])
+    ttft = common.summarize([r["ttft"] for r in ok if r["ttft"] is not None])
+    # 客户端排队：并发数用尽导致的发送延迟；服务端排队：总延迟减去Ollama报告的计算时间
+    send_lag = common.summarize([r["sent"] - r["scheduled"] for r in results])
+    server_queue = common.summarize([max(r["latency"] - r["compute"], 0.0) for r in ok if r["compute"] is not None])
+    elapsed = max(elapsed, 1e-9)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "duration_s": elapsed,
+        "requests_per_s": len(ok) / elapsed,
+        "output_tokens_per_s": sum(r["output_tokens"] for r in ok) / elapsed,
+        "latency_p50_ms": latency.get("p50_ms"),
+        "latency_p99_ms": latency.get("p99_ms"),
+        "ttft_p50_ms": ttft.get("p50_ms"),
+        "ttft_p99_ms": ttft.get("p99_ms"),
+        "send_lag_p99_ms": send_lag.get("p99_ms"),
+        "server_queue_p50_ms": server_queue.get("p50_ms"),
+        "server_queue_p99_ms": server_queue.get("p99_ms"),
+    }
+
+
+def format_value(value):
+    return "-" if value is None else f"{value:.6g}"
+
+
+def print_report(original, replay):
+    print(f"{'':<22} {'original':>14} {'replay':>14}")
+    for key in replay:
+        print(f"{key:<22} {format_value(original.get(key)) if key in original else '':>14} "
+              f"{format_value(replay[key]):>14}")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="按request_logs回放Ollama负载")
+    parser.add_argument("--db", required=True, help="包含request_logs的数据库")
+    parser.add_argument("--hours", type=float, default=1.0, help="回放最近多少小时的记录")
+    parser.add_argument("--models", help="只回放这些模型(逗号分隔)")
+    parser.add_argument("--endpoints", help="只回放这些端点(逗号分隔)，如 /api/chat")
+    parser.add_argument("--limit", type=int, help="最多回放的原始记录数")
+    parser.add_argument("--speed", type=float, default=1.0, help="时间压缩倍数")
+    parser.add_argument("--load", type=float, default=1.0, help="流量倍数，2表示两倍流量")
+    parser.add_argument("--max-tokens", type=int, help="num_predict上限")
+    parser.add_argument("--concurrency", type=int, default=256, help="客户端最大并发请求数")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--target", help="目标Ollama或代理地址，如 http://localhost:11434")
+    parser.add_argument("--fake", action="store_true", help="回放到本地模拟服务器")
+    parser.add_argument("--fake-parallel", type=int, default=4, help="模拟服务器的并行数")
+    parser.add_argument("--fake-token-rate", type=float, default=200.0)
+    parser.add_argument("--fake-ttft", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果JSON路径")
+    parser.add_argument("--compare", help="与之前的结果JSON比较")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if not args.target and not args.fake:
+        print("需要指定 --target 或 --fake")
+        return 2
+    # import_monitor会切换工作目录，先解析为绝对路径
+    db_file = os.path.abspath(args.db)
+    logs = load_requests(
+        db_file, args.hours,
+        models=args.models.split(",") if args.models else None,
+        endpoints=args.endpoints.split(",") if args.endpoints else None,
+        limit=args.limit,
+    )
+    if not logs:
+        print("时间窗口内没有请求记录")
+        return 1
+    schedule = build_schedule(logs, args.speed, args.load, args.seed)
+    print(f"回放 {len(logs)} 条记录 -> {len(schedule)} 个请求，"
+          f"预计 {schedule[-1][0]:.1f} 秒 (speed x{args.speed}, load x{args.load})", flush=True)
+
+    server = None
+    target = args.target
+    if args.fake:
+        server = fake_ollama.start_fake_server(
+            ttft=args.fake_ttft, token_rate=args.fake_token_rate, parallel=args.fake_parallel,
+            models=sorted({log["model_name"] for log in logs}),
+        )
+        target = server.url
+    try:
+        replayer = Replayer(target, args.concurrency, args.timeout)
+        elapsed = replayer.run(schedule, args.max_tokens, args.seed)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    original = summarize_original(logs, args.speed)
+    replay = summarize_replay(replayer.results, elapsed)
+    print_report(original, replay)
+
+    results = {
+        "meta": common.run_metadata("replay", args),
+        "results": {"original": original, "replay": replay},
+    }
+    results["meta"]["target"] = target
+    common.save_results(args.output or common.default_output("replay"), results)
+    if args.compare:
+        with open(args.compare) as f:
+            common.compare_results(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+本地时序数据库接收端
+
+模拟Prometheus remote write和Influx行协议的写入接口：解码snappy+protobuf的
+WriteRequest或(gzip)行协议，记录收到的样本，用于测试指标转发。可让前N个请求
+返回错误，以验证磁盘队列的重试。
+
+用法:
+    python benchmarks/tsdb_sink.py --port 9201
+    python benchmarks/tsdb_sink.py --port 9201 --fail-first 3 --fail-status 503
+"""
+import argparse
+import gzip
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def snappy_decompress(data):
+    """解码snappy块格式(字面量和三种复制)"""
+    length, pos = _varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            n = tag >> 2
+            if n >= 60:
+                extra = n - 59
+                n = int.from_bytes(data[pos:pos + extra], 'little')
+                pos += extra
+            n += 1
+            out += data[pos:pos + n]
+            pos += n
+            continue
+        if kind == 1:
+            n = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        elif kind == 2:
+            n = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 2], 'little')
+            pos += 2
+        else:
+            n = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 4], 'little')
+            pos += 4
+        for _ in range(n):
+            out.append(out[-offset])
+    if len(out) != length:
+        raise ValueError(f"snappy长度不符: {len(out)} != {length}")
+    return bytes(out)
+
+
+def _fields(data):
+    """逐个返回protobuf字段 (字段号, wire type, 值)"""
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(data, pos)
+        elif wire == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire == 2:
+            n, pos = _varint(data, pos)
+            value = data[pos:pos + n]
+            pos += n
+        elif wire == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"不支持的wire type: {wire}")
+        yield field, wire, value
+
+
+def decode_write_request(data):
+    """返回 [(标签字典, [(毫秒时间戳, 值)])]"""
+    series = []
+    for field, _, ts_data in _fields(data):
+        if field != 1:
+            continue
+        labels = {}
+        samples = []
+        for sub, _, value in _fields(ts_data):
+            if sub == 1:
+                label = {f: v.decode() for f, _, v in _fields(value)}
+                labels[label.get(1, '')] = label.get(2, '')
+            elif sub == 2:
+                sample = {f: v for f, _, v in _fields(value)}
+                samples.append((sample.get(2, 0), struct.unpack('<d', sample.get(1, b'\0' * 8))[0]))
+        series.append((labels, samples))
+    return series
+
+
+class TsdbSinkConfig:
+    def __init__(self, fail_first=0, fail_status=503, quiet=False):
+        """
+        初始化接收端配置
+
+        参数:
+            fail_first: 前多少个请求返回fail_status
+            fail_status: 失败时返回的状态码
+            quiet: 不打印收到的批次
+        """
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.quiet = quiet
+        # 成功接收的remote write序列：(标签字典, 毫秒时间戳, 值)
+        self.samples = []
+        # 成功接收的行协议行
+        self.lines = []
+        self.batches = 0
+        self.attempts = 0
+        self.lock = threading.Lock()
+
+
+class TsdbSinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "TsdbSink/0.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        cfg = self.server.config
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        with cfg.lock:
+            cfg.attempts += 1
+            failed = cfg.attempts <= cfg.fail_first
+        if failed:
+            self._reply(cfg.fail_status)
+            return
+        encoding = (self.headers.get("Content-Encoding") or "").lower()
+        try:
+            if encoding == "snappy":
+                series = decode_write_request(snappy_decompress(raw))
+                samples = [(labels, ts, value) for labels, points in series for ts, value in points]
+                lines = []
+            else:
+                text = gzip.decompress(raw) if encoding == "gzip" else raw
+                lines = [line for line in text.decode().split("\n") if line]
+                samples = []
+        except (ValueError, IndexError, OSError) as e:
+            self._reply(400, str(e).encode())
+            return
+        with cfg.lock:
+            cfg.batches += 1
+            cfg.samples.extend(samples)
+            cfg.lines.extend(lines)
+        if not cfg.quiet:
+            print(f"{self.path}: {len(samples)} samples, {len(lines)} lines", flush=True)
+        self._reply(204)
+
+
+class TsdbSinkServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, TsdbSinkHandler)
+        self.config = config or TsdbSinkConfig()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def samples(self):
+        with self.config.lock:
+            return list(self.config.samples)
+
+    @property
+    def lines(self):
+        with self.config.lock:
+            return list(self.config.lines)
+
+    def wait_for_batches(self, count, timeout=10.0):
+        """等待至少count个批次被成功接收"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.config.batches >= count:
+                return self.config.batches
+            time.sleep(0.05)
+        raise TimeoutError(f"{timeout}秒内只收到{self.config.batches}个批次")
+
+
+def start_sink(host="127.0.0.1", port=0, **kwargs):
+    """在后台线程中启动接收端，返回服务器对象"""
+    kwargs.setdefault("quiet", True)
+    server = TsdbSinkServer((host, port), TsdbSinkConfig(**kwargs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="模拟remote write/行协议写入接口的接收端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9201)
+    parser.add_argument("--fail-first", type=int, default=0, help="前N个请求返回错误")
+    parser.add_argument("--fail-status", type=int, default=503)
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    config = TsdbSinkConfig(fail_first=args.fail_first, fail_status=args.fail_status)
+    server = TsdbSinkServer((args.host, args.port), config)
+    print(f"TSDB sink listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -7,37 +7,503 @@ import logging
 import threading
 import sqlite3
 import os
+import sys
+import zlib
+import mmap
+import math
+import glob
+import hashlib
+import queue
+import atexit
+import gzip
+import socketserver
+import argparse
+import random
+import uuid
+import operator
+import csv
+import io
+import struct
+import re
+import select
+import ctypes
+import ctypes.util
+from urllib.request import pathname2url
+from array import array
+from itertools import accumulate, count
+from collections import deque
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from waitress import serve
 from werkzeug.middleware.proxy_fix import ProxyFix
 import subprocess
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='/app/log/ollama_monitor.log'
-)
-logger = logging.getLogger('ollama_monitor')
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # 配置参数
 OLLAMA_HOST = "http://host.docker.internal:11434"
-MONITOR_INTERVAL = 5  # 监控间隔(秒)   HUSK OGSÅ AT OPDATERE I JAVASCRIPT-DELEN setInterval(refreshData, XXXX)
+MONITOR_INTERVAL = 5  # 监控间隔(秒)   HUSK OGSÅ AT OPDATERE I JAVASCRIPT-DELEN REFRESH_INTERVAL = XXXX
 WEB_HOST = "0.0.0.0"
 WEB_PORT = 3010
 DB_FILE = "/app/db/ollama_metrics.db"
+ARCHIVE_DIR = "/app/db/archive"
+ARCHIVE_AFTER_DAYS = None  # 超过该天数的整日指标归档为压缩列式文件，None表示不归档
+DB_PARTITION = None  # 'day' 或 'week'：按时间分区，每个分区一个SQLite文件；None表示单文件
+DB_RETENTION_DAYS = None  # 分区模式下，结束时间早于该天数的分区文件直接删除
+SQLITE_MAX_ATTACHED = 10  # SQLite默认最多同时ATTACH的数据库数
+# 配额：每个客户端(IP或Bearer密钥)在各时间窗口内的上限，None表示不限制
+QUOTA_REQUESTS = {'minute': None, 'hour': None, 'day': None}
+QUOTA_TOKENS = {'minute': None, 'hour': None, 'day': None}
+QUOTA_OVERRIDES = {}  # 按客户端覆盖配额，如 {'10.0.0.5': {'tokens': {'day': 2000000}}}
+USAGE_FLUSH_INTERVAL = 60  # 用量账本写入数据库的间隔(秒)
+LOG_FILE = "/app/log/ollama_monitor.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 日志按大小轮转；0表示每天零点轮转
+LOG_BACKUP_COUNT = 5
+LOG_JSON = False  # 输出每行一个JSON对象的结构化日志
+LOG_COLLAPSE_SECONDS = 60  # 同一条消息在该时间内重复出现时合并为一条并计数
+LOG_QUEUE_SIZE = 10000  # 日志队列上限，写入线程跟不上时丢弃并计数
+API_COMPRESS_MIN_BYTES = 1024  # 超过该大小的API响应按Accept-Encoding压缩
+EXPORT_CHUNK_ROWS = 5000  # 批量导出时每次从游标读取的行数，也是Parquet行组的大小
+HEALTH_INTERVAL = 2.0  # 正常状态下的健康探测间隔(秒)
+HEALTH_FAST_INTERVAL = 0.5  # 降级或离线状态下的探测间隔(秒)
+HEALTH_TIMEOUT = 1.0  # 单次探测超时(秒)
+HEALTH_SLOW_SECONDS = 0.5  # 探测响应慢于该值视为降级
+HEALTH_FAIL_THRESHOLD = 3  # 连续失败达到该次数判定为离线
+HEALTH_RECOVER_THRESHOLD = 3  # 连续正常达到该次数才恢复为在线
+COLLECTOR_HOST = "127.0.0.1"  # 多进程部署时collector接收写入的地址
+COLLECTOR_PORT = 3011
+COLLECTOR_MAX_RETRIES = 8  # 发送到collector失败时同一批写入的重试次数，超过后丢弃并计入dropped
+COLLECTOR_RETRY_MAX_SECONDS = 30  # 发送到collector失败时重试间隔的上限(秒)
+INFLIGHT_PUBLISH_INTERVAL = 1.0  # 拆分部署时proxy进程把在途请求发给collector的间隔(秒)，dashboard合并各进程的快照
+CAPTURE_DIR = "/app/db/capture"
+CAPTURE_RATE = 0.0  # 完整保存请求和响应的采样比例(0~1)，0表示关闭
+CAPTURE_MODELS = None  # 只采样这些模型，如 ['llama3.2:3b']；None表示不限
+CAPTURE_CLIENTS = None  # 只采样这些客户端IP；None表示不限
+CAPTURE_SEGMENT_BYTES = 64 * 1024 * 1024  # 单个段文件的大小上限
+CAPTURE_MAX_BYTES = 1024 * 1024 * 1024  # 采样数据总大小上限，超出时删除最旧的段
+PRELOAD_ENABLED = False  # 按历史请求规律在请求到来前加载模型
+PRELOAD_INTERVAL = 60  # 预测和预加载的间隔(秒)
+PRELOAD_HISTORY_DAYS = 7  # 学习请求规律使用的历史天数
+PRELOAD_HORIZON = 600  # 预测未来多少秒内的请求
+PRELOAD_MIN_PROBABILITY = 0.5  # 预测期内有请求的概率不低于该值时预加载
+KEEP_ALIVE_POLICY = False  # 代理请求未指定keep_alive时按显存预算设置
+KEEP_ALIVE_MIN = 60  # 预算外模型的keep_alive(秒)，尽快释放显存
+KEEP_ALIVE_MAX = 3600  # 预算内模型keep_alive的上限(秒)
+VRAM_BUDGET_MB = None  # 模型可占用的显存(MiB)；None表示最近采样的显存总量的90%
+COLD_LOAD_SECONDS = 0.5  # load_duration超过该值的请求视为冷加载
+ANOMALY_ENABLED = True  # 对延迟、生成速率和GPU指标做流式异常检测
+ANOMALY_ALPHA = 0.02  # EWMA平滑系数，约相当于最近50个样本
+ANOMALY_Z_THRESHOLD = 5.0  # 偏离基线超过该倍标准差视为异常
+ANOMALY_WARMUP = 30  # 每个序列积累该数量的样本后才开始检测
+ANOMALY_COOLDOWN = 300  # 同一序列两次异常事件的最小间隔(秒)
+ALERT_RULES = []  # 告警规则，如 {'name': 'gpu-hot', 'metric': 'gpu_temperature', 'op': '>', 'threshold': 85}
+ALERT_WEBHOOKS = []  # 告警以JSON POST到这些URL
+ALERT_COMMAND = None  # 告警时执行的本地命令(列表形式)，告警JSON从标准输入传入
+ALERT_MAX_ATTEMPTS = 8  # 投递失败时的最大尝试次数，间隔按指数退避
+ALERT_RETRY_MAX_SECONDS = 300  # 重试间隔上限(秒)
+FORWARD_URL = None  # 转发指标的地址，如 'http://victoria:8428/api/v1/write'；None表示不转发
+FORWARD_FORMAT = 'remote_write'  # 'remote_write'(Prometheus protobuf+snappy) 或 'influx'(行协议+gzip)
+FORWARD_HEADERS = {}  # 附加的请求头，如 {'Authorization': 'Bearer ...'}
+FORWARD_LABELS = {}  # 附加到每个序列的标签，如 {'instance': 'gpu-node-1'}
+FORWARD_DIR = "/app/db/forward"  # 待发送批次的磁盘队列
+FORWARD_FLUSH_INTERVAL = 10  # 打包一个批次的间隔(秒)
+FORWARD_MAX_BYTES = 256 * 1024 * 1024  # 磁盘队列大小上限，超出时删除最旧的批次
+FORWARD_RETRY_MAX_SECONDS = 300  # 发送失败时重试间隔的上限(秒)
+TRACE_ENDPOINT = None  # OTLP/HTTP JSON的traces地址，如 'http://otel-collector:4318/v1/traces'；None表示不追踪
+TRACE_SAMPLE_RATE = 0.1  # 没有上游追踪上下文的请求按该比例采样(0~1)
+TRACE_SERVICE_NAME = "ollama-monitor"  # 上报的service.name
+TRACE_HEADERS = {}  # 导出时附加的请求头
+TRACE_BATCH_SIZE = 512  # 每批导出的最大span数
+TRACE_FLUSH_INTERVAL = 5  # 不足一批时的最长导出间隔(秒)
+TRACE_QUEUE_SIZE = 8192  # 待导出span的队列上限，超出时丢弃并计数
+AGENT_AGGREGATOR_URL = None  # agent角色上报的聚合器地址，如 'http://monitor-hub:3010'
+AGENT_HOST_NAME = None  # agent上报时使用的主机名；None表示socket.gethostname()
+AGENT_TOKEN = None  # agent与聚合器之间的共享令牌；聚合器设置后拒绝不带该令牌的上报
+AGENT_BATCH_INTERVAL = 15  # agent打包并上报一个批次的间隔(秒)
+AGENT_MAX_PENDING = 1000  # 聚合器不可用时agent在内存中保留的批次数，超出时丢弃最旧的
+AGENT_RETRY_MAX_SECONDS = 300  # agent上报失败时重试间隔的上限(秒)
+OLLAMA_LOG_FILE = None  # 跟踪的Ollama服务日志文件，如 '/var/log/ollama.log'；None表示不读取
+OLLAMA_LOG_UNIT = None  # 改为跟踪该systemd unit的journald日志，如 'ollama'；优先于OLLAMA_LOG_FILE
+OLLAMA_LOG_STATE_FILE = "/app/db/ollama_log.state"  # 已读取到的位置(文件inode和偏移或journald游标)
+OLLAMA_LOG_POLL_INTERVAL = 1.0  # 不支持inotify时检查日志文件的间隔(秒)
+
+
+class CollapsingFilter(logging.Filter):
+    """
+    合并重复日志
+
+    同一条消息首次出现时立即输出，之后在LOG_COLLAPSE_SECONDS内的重复只计数；
+    窗口过后再次出现时输出一条带"×N"的汇总，例如每个采样周期都出现的GPU错误。
+    重复在窗口内停止时，由后台线程在窗口结束后通过emit输出汇总，计数不会丢失。
+    """
+
+    def __init__(self, window=None, emit=None):
+        super().__init__()
+        self.window = LOG_COLLAPSE_SECONDS if window is None else window
+        self.emit = emit
+        self.seen = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def filter(self, record):
+        if not self.window:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = record.created
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                entry[2] = record
+                self._start_flusher()
+                return False
+            repeats = entry[1] if entry is not None else 0
+            self.seen[key] = [now, 0, None]
+            if len(self.seen) > 1000:
+                self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.window or v[1]}
+        if repeats:
+            record.msg = f"{record.getMessage()} ×{repeats + 1}"
+            record.args = None
+            record.repeats = repeats + 1
+        return True
+
+    def _start_flusher(self):
+        if self._thread is None and self.emit is not None:
+            self._thread = threading.Thread(target=self._flush_loop, name='log-collapse', daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(min(self.window, 1.0))
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self, now=None):
+        """输出窗口已结束但仍有未输出重复计数的汇总，返回输出的条数"""
+        now = time.time() if now is None else now
+        summaries = []
+        with self.lock:
+            for entry in self.seen.values():
+                if entry[1] and now - entry[0] >= self.window:
+                    summary = logging.makeLogRecord(entry[2].__dict__)
+                    summary.msg = f"{entry[2].getMessage()} ×{entry[1]}"
+                    summary.args = None
+                    summary.repeats = entry[1]
+                    summaries.append(summary)
+                    entry[1], entry[2] = 0, None
+        if self.emit is not None:
+            for summary in summaries:
+                self.emit(summary)
+        return len(summaries)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列已满时丢弃日志而不是阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonLogFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，便于日志采集端直接解析"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, 'repeats', None):
+            entry["repeats"] = record.repeats
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(log_file=None):
+    """
+    配置异步日志
+
+    请求线程和监控线程只把日志放入内存队列，由独立的写入线程负责格式化、写文件和轮转，
+    慢速磁盘不会拖慢代理请求。与basicConfig一样，根日志已有处理器时不做任何修改。
+
+    返回:
+        QueueListener，未配置时返回None
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    log_file = log_file or LOG_FILE
+    try:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        if LOG_MAX_BYTES:
+            handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES,
+                                          backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+        else:
+            handler = TimedRotatingFileHandler(log_file, when='midnight',
+                                               backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    except OSError:
+        # 日志目录不可写(如只读文件系统)时输出到标准错误
+        handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter() if LOG_JSON else
+                         logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(CollapsingFilter(emit=queue_handler.emit))
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+
+    listener = QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging()
+logger = logging.getLogger('ollama_monitor')
 
 class OllamaMetricsDB:
-    def __init__(self, db_file=DB_FILE):
-        """初始化数据库连接"""
-        self.db_file = db_file
-        self._create_tables()
+    PARTITION_DAYS = {'day': 1, 'week': 7}
+    # 带host列的表：本机采集的行host为NULL，agent上报的行为其主机名
+    HOST_TABLES = ('system_metrics', 'gpu_metrics', 'request_logs', 'concurrency_metrics')
+    # 监控循环自测生成请求的endpoint，学习请求规律时排除
+    SELF_TEST_ENDPOINT = 'self-test'
+    # 已建表的数据库文件，避免每次实例化都执行建表语句
+    _initialized = set()
+    _init_lock = threading.Lock()
+
+    def __init__(self, db_file=None, host=None):
+        """
+        初始化数据库连接
+
+        参数:
+            db_file: 数据库文件(默认DB_FILE)
+            host: 只读取该主机的数据；''表示本机采集的数据，None表示不区分主机
+        """
+        # 运行时读取DB_FILE，便于基准测试等场景替换数据库路径
+        self.db_file = db_file or DB_FILE
+        self.host = host
+        self._ensure_tables(self._write_path())
+
+    # ---------- 分区 ----------
+
+    def _partition_start(self, day):
+        """返回某日期所在分区的起始日期"""
+        if DB_PARTITION == 'week':
+            return day - timedelta(days=day.weekday())
+        return day
+
+    def partition_path(self, moment):
+        """返回某一时刻所属分区的文件路径"""
+        base, ext = os.path.splitext(self.db_file)
+        start = self._partition_start(moment.date())
+        return f"{base}.{DB_PARTITION}-{start.isoformat()}{ext}"
+
+    def list_partitions(self):
+        """
+        列出所有分区文件
+
+        返回:
+            [(起始日期, 结束日期(不含), 路径)]，按时间排序
+        """
+        base, ext = os.path.splitext(self.db_file)
+        partitions = []
+        for path in glob.glob(f"{glob.escape(base)}.*-*{ext}"):
+            name = path[len(base) + 1:len(path) - len(ext)]
+            kind, _, stamp = name.partition('-')
+            if kind not in self.PARTITION_DAYS:
+                continue
+            try:
+                start = datetime.strptime(stamp, '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            partitions.append((start, start + timedelta(days=self.PARTITION_DAYS[kind]), path))
+        return sorted(partitions)
+
+    def all_db_files(self):
+        """返回全部数据库文件(单文件模式下只有DB_FILE)"""
+        if not DB_PARTITION:
+            return [self.db_file]
+        return [path for _, _, path in self.list_partitions()]
+
+    def drop_expired_partitions(self, retention_days):
+        """删除结束时间早于保留期的分区文件，返回被删除的路径"""
+        cutoff = (datetime.now() - timedelta(days=retention_days)).date()
+        current = self._write_path()
+        dropped = []
+        for _, end, path in self.list_partitions():
+            if end <= cutoff and path != current:
+                for suffix in ('', '-wal', '-shm', '-journal'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                OllamaMetricsDB._initialized.discard(path)
+                dropped.append(path)
+        return dropped
+
+    def _write_path(self):
+        return self.partition_path(datetime.now()) if DB_PARTITION else self.db_file
+
+    def _ensure_tables(self, path):
+        if path in OllamaMetricsDB._initialized and os.path.exists(path):
+            return
+        with OllamaMetricsDB._init_lock:
+            self._create_tables(path)
+            OllamaMetricsDB._initialized.add(path)
+
+    def _connect(self):
+        """打开写入连接：分区模式下写入当前分区"""
+        path = self._write_path()
+        self._ensure_tables(path)
+        # 多个进程角色共享数据库时，短暂的写锁冲突等待而不是立即报错
+        return sqlite3.connect(path, timeout=30)
+
+    @staticmethod
+    def _cutoff(hours):
+        """时间窗口起点，与写入时的本地ISO时间戳格式一致"""
+        return (datetime.now() - timedelta(hours=hours)).isoformat()
+
+    def _window_connections(self, hours):
+        """
+        逐个生成覆盖时间窗口的只读连接
+
+        单文件模式下只有一个连接。分区模式下，窗口覆盖的分区以只读方式ATTACH到
+        内存数据库，并创建与原表同名的临时视图(UNION ALL)，原有SQL无需修改；
+        分区数超过ATTACH上限时按时间顺序分批返回多个连接。
+        """
+        if not DB_PARTITION:
+            conn = sqlite3.connect(self.db_file)
+            if self.host is not None:
+                # temp中的同名视图优先于main中的表，原有SQL只看到该主机的行
+                for table in self.HOST_TABLES:
+                    conn.execute(f"CREATE TEMP VIEW {table} AS SELECT * FROM main.{table} "
+                                 f"WHERE {self._host_condition(self.host)}")
+            yield conn
+            return
+
+        cutoff = (datetime.now() - timedelta(hours=hours)).date() if hours is not None else None
+        paths = [path for _, end, path in self.list_partitions() if cutoff is None or end > cutoff]
+        if not paths:
+            paths = [self._write_path()]
+            self._ensure_tables(paths[0])
+        for i in range(0, len(paths), SQLITE_MAX_ATTACHED):
+            conn = sqlite3.connect(':memory:', uri=True)
+            try:
+                self._attach_partitions(conn, paths[i:i + SQLITE_MAX_ATTACHED], self.host)
+            except Exception:
+                conn.close()
+                raise
+            yield conn
+
+    @staticmethod
+    def _host_condition(host):
+        """host过滤条件；主机名直接写入视图定义，按SQL字符串规则转义"""
+        if not host:
+            return "host IS NULL"
+        return "host = '{}'".format(host.replace("'", "''"))
+
+    @classmethod
+    def _attach_partitions(cls, conn, paths, host=None):
+        # 表名 -> 列名(保持首次出现的顺序)；(表名, schema) -> 该分区中存在的列
+        columns = {}
+        present = {}
+        schemas = []
+        for n, path in enumerate(paths):
+            schema = f"p{n}"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{pathname2url(path)}?mode=ro",))
+            schemas.append(schema)
+            for (table,) in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'"):
+                if table.startswith('sqlite_'):
+                    continue
+                cols = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+                names = columns.setdefault(table, [])
+                names.extend(c for c in cols if c not in names)
+                present[(table, schema)] = set(cols)
+        # 旧分区可能缺少后来新增的列，用NULL补齐
+        condition = cls._host_condition(host) if host is not None else None
+        for table, names in columns.items():
+            selects = []
+            for schema in schemas:
+                cols = present.get((table, schema))
+                if cols is None:
+                    continue
+                fields = ', '.join(c if c in cols else f"NULL AS {c}" for c in names)
+                select = f"SELECT {fields} FROM {schema}.{table}"
+                if condition and table in cls.HOST_TABLES:
+                    if 'host' in cols:
+                        select += f" WHERE {condition}"
+                    elif host:
+                        # 没有host列的旧分区只含本机数据
+                        select += " WHERE 0"
+                selects.append(select)
+            conn.execute(f"CREATE TEMP VIEW {table} AS " + ' UNION ALL '.join(selects))
+
+    def _read(self, hours, sql, params=(), as_dict=False):
+        """
+        在时间窗口覆盖的数据上执行查询
+
+        返回:
+            每批连接的结果列表，按时间从早到晚排列
+        """
+        results = []
+        for conn in self._window_connections(hours):
+            try:
+                if as_dict:
+                    conn.row_factory = sqlite3.Row
+                rows = conn.execute(sql, params).fetchall()
+                results.append([dict(row) for row in rows] if as_dict else rows)
+            finally:
+                conn.close()
+        return results
     
-    def _create_tables(self):
+    def _create_tables(self, db_file=None):
         """创建必要的数据表"""
-        conn = sqlite3.connect(self.db_file)
+        conn = sqlite3.connect(db_file or self.db_file, timeout=30)
         cursor = conn.cursor()
+        # WAL模式下读写互不阻塞，仪表板进程读取时不影响采集进程写入
+        cursor.execute('PRAGMA journal_mode=WAL')
         
         # 系统指标表
         cursor.execute('''
@@ -52,7 +518,8 @@ class OllamaMetricsDB:
             network_bytes_recv INTEGER,
             ollama_cpu_percent REAL,
             ollama_memory_percent REAL,
-            ollama_connections INTEGER
+            ollama_connections INTEGER,
+            host TEXT
         )
         ''')
 
@@ -66,7 +533,8 @@ class OllamaMetricsDB:
             gpu_memory_used REAL,
             gpu_temperature REAL,
             gpu_power_draw REAL,
-            gpu_power_limit REAL
+            gpu_power_limit REAL,
+            host TEXT
         )
         ''')
 
@@ -81,10 +549,12 @@ class OllamaMetricsDB:
             output_tokens INTEGER,
             response_time REAL,
             status_code INTEGER,
-            endpoint TEXT
+            endpoint TEXT,
+            request_uid TEXT,
+            load_duration REAL,
+            host TEXT
         )
         ''')
-        
         # 模型表
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS models (
@@ -97,24 +567,135 @@ class OllamaMetricsDB:
             model_family TEXT
         )
         ''')
+
+        # 健康状态变化事件表
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS health_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            previous_state TEXT,
+            state TEXT,
+            reason TEXT,
+            latency REAL
+        )
+        ''')
+
+        # 并发采样表：每个采样周期每个有活动的模型一行
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS concurrency_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            model_name TEXT,
+            interval REAL,
+            inflight INTEGER,
+            avg_inflight REAL,
+            peak_inflight INTEGER,
+            completed INTEGER,
+            output_tokens INTEGER,
+            latency_seconds REAL,
+            compute_seconds REAL,
+            host TEXT
+        )
+        ''')
+
+        # 告警通知表
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alert_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            rule TEXT,
+            label TEXT,
+            state TEXT,
+            severity TEXT,
+            value REAL,
+            threshold REAL,
+            summary TEXT
+        )
+        ''')
+
+        # 异常检测事件表
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS anomaly_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            metric TEXT,
+            label TEXT,
+            value REAL,
+            baseline REAL,
+            zscore REAL,
+            direction TEXT
+        )
+        ''')
+
+        # 模型预加载事件表
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS preload_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            model_name TEXT,
+            event TEXT,
+            probability REAL,
+            load_duration REAL,
+            detail TEXT
+        )
+        ''')
+
+        # Ollama服务日志事件表：模型加载、显存不足、退回CPU、上下文移位和runner崩溃
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ollama_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            event TEXT,
+            model TEXT,
+            value REAL,
+            level TEXT,
+            message TEXT
+        )
+        ''')
+
+        # 用量账本表：按客户端、模型和分钟聚合
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usage_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_start TEXT,
+            client TEXT,
+            model_name TEXT,
+            requests INTEGER,
+            input_tokens INTEGER,
+            output_tokens INTEGER,
+            UNIQUE (period_start, client, model_name)
+        )
+        ''')
+
+        # 各proxy进程最新的在途请求快照，拆分部署时由dashboard合并
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inflight_snapshots (
+            worker TEXT PRIMARY KEY,
+            timestamp TEXT,
+            requests TEXT
+        )
+        ''')
+        
+        # 旧数据库补充后来新增的列
+        for table, added in (
+            ('request_logs', (('request_uid', 'TEXT'), ('load_duration', 'REAL'), ('host', 'TEXT'))),
+            ('system_metrics', (('host', 'TEXT'),)),
+            ('gpu_metrics', (('host', 'TEXT'),)),
+            ('concurrency_metrics', (('host', 'TEXT'),)),
+        ):
+            columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+            for column, kind in added:
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {kind}')
         
         conn.commit()
         conn.close()
     
-    def save_system_metrics(self, metrics):
-        """保存系统指标"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
+    @staticmethod
+    def system_metrics_row(metrics):
+        """把一次采样转换为system_metrics的一行(列顺序与INSERT一致，agent上报共用)"""
         ollama_process = metrics.get('ollama_process', {})
-        
-        cursor.execute('''
-        INSERT INTO system_metrics (
-            timestamp, server_status, cpu_percent, memory_percent, 
-            disk_percent, network_bytes_sent, network_bytes_recv,
-            ollama_cpu_percent, ollama_memory_percent, ollama_connections
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        return (
             metrics['timestamp'],
             1 if metrics['server_status'] else 0,
             metrics['system']['cpu_percent'],
@@ -125,14 +706,60 @@ class OllamaMetricsDB:
             ollama_process.get('cpu_percent', 0),
             ollama_process.get('memory_percent', 0),
             ollama_process.get('connections', 0)
-        ))
+        )
+
+    @staticmethod
+    def gpu_metrics_row(metrics):
+        """把一次采样转换为gpu_metrics的一行"""
+        return (
+            metrics['timestamp'],
+            metrics['gpu']['gpu_name'],
+            metrics['gpu']['gpu_utilization'],
+            metrics['gpu']['gpu_memory_total'],
+            metrics['gpu']['gpu_memory_used'],
+            metrics['gpu']['gpu_temperature'],
+            metrics['gpu']['gpu_power_draw'],
+            metrics['gpu']['gpu_power_limit']
+        )
+
+    @staticmethod
+    def request_log_row(log_data):
+        """把请求日志转换为request_logs的一行"""
+        return (
+            log_data['timestamp'],
+            log_data['client_ip'],
+            log_data['model_name'],
+            log_data['input_tokens'],
+            log_data['output_tokens'],
+            log_data['response_time'],
+            log_data['status_code'],
+            log_data['endpoint'],
+            log_data.get('request_uid'),
+            log_data.get('load_duration')
+        )
+
+    def save_system_metrics(self, metrics):
+        """保存系统指标"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        INSERT INTO system_metrics (
+            timestamp, server_status, cpu_percent, memory_percent, 
+            disk_percent, network_bytes_sent, network_bytes_recv,
+            ollama_cpu_percent, ollama_memory_percent, ollama_connections
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', self.system_metrics_row(metrics))
         
         conn.commit()
         conn.close()
 
     def save_gpu_metrics(self, metrics):
         """保存GPU指标"""
-        conn = sqlite3.connect(self.db_file)
+        # 没有GPU或nvidia-smi不可用时不写入
+        if not metrics.get('gpu'):
+            return
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -140,23 +767,14 @@ class OllamaMetricsDB:
             timestamp, gpu_name, gpu_utilization, gpu_memory_total, gpu_memory_used,
             gpu_temperature, gpu_power_draw, gpu_power_limit
         ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            metrics['timestamp'],
-            metrics['gpu']['gpu_name'],
-            metrics['gpu']['gpu_utilization'],
-            metrics['gpu']['gpu_memory_total'],
-            metrics['gpu']['gpu_memory_used'],
-            metrics['gpu']['gpu_temperature'],
-            metrics['gpu']['gpu_power_draw'],
-            metrics['gpu']['gpu_power_limit']
-        ))
+        ''', self.gpu_metrics_row(metrics))
 
         conn.commit()
         conn.close()
 
     def save_models(self, timestamp, models):
         """保存模型信息"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         cursor = conn.cursor()
         
         for model in models:
@@ -180,152 +798,1268 @@ class OllamaMetricsDB:
     
     def save_request_log(self, log_data):
         """保存请求日志"""
-        conn = sqlite3.connect(self.db_file)
+        self.save_request_logs([log_data])
+
+    def save_request_logs(self, logs):
+        """在一个事务中批量保存请求日志"""
+        conn = self._connect()
         cursor = conn.cursor()
         
-        cursor.execute('''
+        cursor.executemany('''
         INSERT INTO request_logs (
             timestamp, client_ip, model_name, input_tokens, 
-            output_tokens, response_time, status_code, endpoint
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            log_data['timestamp'],
-            log_data['client_ip'],
-            log_data['model_name'],
-            log_data['input_tokens'],
-            log_data['output_tokens'],
-            log_data['response_time'],
-            log_data['status_code'],
-            log_data['endpoint']
-        ))
+            output_tokens, response_time, status_code, endpoint, request_uid, load_duration
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [self.request_log_row(log_data) for log_data in logs])
         
         conn.commit()
         conn.close()
+
+    def save_host_rows(self, table, host, columns, rows):
+        """
+        批量写入agent上报的行并附加host标签
+
+        参数:
+            table: HOST_TABLES之一
+            columns: 列名列表，须来自AgentWriter.WIRE_TABLES
+            rows: 按columns顺序排列的元组
+        """
+        if table not in self.HOST_TABLES:
+            raise ValueError(f"unknown table: {table}")
+        names = list(columns) + ['host']
+        conn = self._connect()
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            [tuple(row) + (host,) for row in rows]
+        )
+        conn.commit()
+        conn.close()
+
+    def get_hosts(self, hours=24):
+        """返回窗口内有系统指标的主机：{主机名: (最近采样时间, 采样数)}，本机为''"""
+        hosts = {}
+        for chunk in self._read(hours, '''
+        SELECT host, MAX(timestamp), COUNT(*) FROM system_metrics
+        WHERE timestamp > ?
+        GROUP BY host
+        ''', (self._cutoff(hours),)):
+            for host, last, samples in chunk:
+                previous = hosts.get(host or '', (None, 0))
+                hosts[host or ''] = (max(last, previous[0] or last), previous[1] + samples)
+        return hosts
     
-    def get_recent_system_metrics(self, hours=24):
-        """获取最近的系统指标"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT * FROM system_metrics
-        WHERE timestamp > datetime('now', ?)
-        ORDER BY timestamp
-        ''', (f'-{hours} hours',))
-        
-        rows = cursor.fetchall()
-        result = [dict(row) for row in rows]
-        
+    def save_usage(self, rows):
+        """累加写入用量账本，rows为 [(分钟起点, 客户端, 模型, 请求数, 输入token, 输出token)]"""
+        conn = self._connect()
+        conn.executemany('''
+        INSERT INTO usage_ledger (
+            period_start, client, model_name, requests, input_tokens, output_tokens
+        ) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (period_start, client, model_name) DO UPDATE SET
+            requests = requests + excluded.requests,
+            input_tokens = input_tokens + excluded.input_tokens,
+            output_tokens = output_tokens + excluded.output_tokens
+        ''', rows)
+        conn.commit()
         conn.close()
-        return result
 
-    def get_recent_gpu_metrics(self, hours=24):
-        """获取最近的GPU指标"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT * FROM gpu_metrics
-        WHERE timestamp > datetime('now', ?)
-        ORDER BY timestamp
-        ''', (f'-{hours} hours',))
+    def save_inflight_snapshot(self, snapshot):
+        """保存一个proxy进程的在途请求快照，覆盖该进程之前的快照"""
+        conn = self._connect()
+        conn.execute('''
+        INSERT INTO inflight_snapshots (worker, timestamp, requests) VALUES (?, ?, ?)
+        ON CONFLICT (worker) DO UPDATE SET timestamp = excluded.timestamp, requests = excluded.requests
+        ''', (snapshot['worker'], snapshot['timestamp'], json.dumps(snapshot['requests'])))
+        conn.commit()
+        conn.close()
 
-        rows = cursor.fetchall()
-        result = [dict(row) for row in rows]
+    def get_inflight_snapshots(self, seconds):
+        """返回最近seconds秒内更新过的各进程快照，每个进程只取最新的一个"""
+        latest = {}
+        for chunk in self._read(seconds / 3600, '''
+        SELECT worker, timestamp, requests FROM inflight_snapshots
+        WHERE timestamp > ?
+        ''', ((datetime.now() - timedelta(seconds=seconds)).isoformat(),), as_dict=True):
+            for row in chunk:
+                if row['worker'] not in latest or row['timestamp'] > latest[row['worker']]['timestamp']:
+                    latest[row['worker']] = row
+        return list(latest.values())
 
+    def get_usage(self, hours=24, client=None):
+        """获取时间窗口内的用量明细(按分钟)"""
+        sql = '''
+        SELECT period_start, client, model_name, requests, input_tokens, output_tokens
+        FROM usage_ledger
+        WHERE period_start > ?
+        '''
+        params = [self._cutoff(hours)]
+        if client:
+            sql += ' AND client = ?'
+            params.append(client)
+        rows = []
+        for chunk in self._read(hours, sql + ' ORDER BY period_start', params, as_dict=True):
+            rows.extend(chunk)
+        return rows
+
+    def save_health_event(self, event):
+        """保存健康状态变化"""
+        conn = self._connect()
+        conn.execute('''
+        INSERT INTO health_events (timestamp, previous_state, state, reason, latency)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (
+            event['timestamp'],
+            event['previous_state'],
+            event['state'],
+            event['reason'],
+            event['latency']
+        ))
+        conn.commit()
         conn.close()
-        return result
-    
-    def get_recent_requests(self, hours=24):
-        """获取最近的请求日志"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT * FROM request_logs
-        WHERE timestamp > datetime('now', ?)
+
+    def get_health_events(self, hours=24):
+        """获取最近的健康状态变化"""
+        events = []
+        for chunk in self._read(hours, '''
+        SELECT * FROM health_events
+        WHERE timestamp > ?
         ORDER BY timestamp DESC
-        ''', (f'-{hours} hours',))
-        
-        rows = cursor.fetchall()
-        result = [dict(row) for row in rows]
-        
-        conn.close()
-        return result
-    
-    def get_client_ip_stats(self, hours=24):
-        """获取客户端IP统计"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT client_ip, COUNT(*) as request_count 
-        FROM request_logs
-        WHERE timestamp > datetime('now', ?)
-        GROUP BY client_ip
-        ORDER BY request_count DESC
-        ''', (f'-{hours} hours',))
-        
-        result = cursor.fetchall()
+        ''', (self._cutoff(hours),), as_dict=True):
+            events = chunk + events
+        return events
+
+    def save_concurrency_samples(self, rows):
+        """批量保存并发采样"""
+        conn = self._connect()
+        conn.executemany('''
+        INSERT INTO concurrency_metrics (
+            timestamp, model_name, interval, inflight, avg_inflight, peak_inflight,
+            completed, output_tokens, latency_seconds, compute_seconds
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            row['timestamp'],
+            row['model_name'],
+            row['interval'],
+            row['inflight'],
+            row['avg_inflight'],
+            row['peak_inflight'],
+            row['completed'],
+            row['output_tokens'],
+            row['latency_seconds'],
+            row['compute_seconds']
+        ) for row in rows])
+        conn.commit()
         conn.close()
-        return result
-    
-    def get_model_usage_stats(self, hours=24):
-        """获取模型使用统计"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+
+    def get_concurrency_samples(self, hours=24):
+        """获取最近的并发采样，按时间顺序"""
+        rows = []
+        for chunk in self._read(hours, '''
+        SELECT * FROM concurrency_metrics
+        WHERE timestamp > ?
+        ORDER BY timestamp
+        ''', (self._cutoff(hours),), as_dict=True):
+            rows.extend(chunk)
+        return rows
+
+    def save_alert_event(self, event):
+        """保存告警通知"""
+        conn = self._connect()
+        conn.execute('''
+        INSERT INTO alert_events (timestamp, rule, label, state, severity, value, threshold, summary)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            event['timestamp'],
+            event['rule'],
+            event['label'],
+            event['state'],
+            event['severity'],
+            event['value'],
+            event['threshold'],
+            event['summary']
+        ))
+        conn.commit()
+        conn.close()
+
+    def get_alert_events(self, hours=24):
+        """获取最近的告警通知"""
+        events = []
+        for chunk in self._read(hours, '''
+        SELECT * FROM alert_events
+        WHERE timestamp > ?
+        ORDER BY timestamp DESC
+        ''', (self._cutoff(hours),), as_dict=True):
+            events = chunk + events
+        return events
+
+    def save_anomaly_event(self, event):
+        """保存异常检测事件"""
+        conn = self._connect()
+        conn.execute('''
+        INSERT INTO anomaly_events (timestamp, metric, label, value, baseline, zscore, direction)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            event['timestamp'],
+            event['metric'],
+            event['label'],
+            event['value'],
+            event['baseline'],
+            event['zscore'],
+            event['direction']
+        ))
+        conn.commit()
+        conn.close()
+
+    def get_anomaly_events(self, hours=24, metric=None):
+        """获取最近的异常事件，按时间正序"""
+        sql = 'SELECT * FROM anomaly_events WHERE timestamp > ?'
+        params = [self._cutoff(hours)]
+        if metric:
+            sql += ' AND metric = ?'
+            params.append(metric)
+        events = []
+        for chunk in self._read(hours, sql + ' ORDER BY timestamp', params, as_dict=True):
+            events.extend(chunk)
+        return events
+
+    def save_preload_event(self, event):
+        """保存预加载事件"""
+        conn = self._connect()
+        conn.execute('''
+        INSERT INTO preload_events (timestamp, model_name, event, probability, load_duration, detail)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            event['timestamp'],
+            event['model_name'],
+            event['event'],
+            event.get('probability'),
+            event.get('load_duration'),
+            event.get('detail')
+        ))
+        conn.commit()
+        conn.close()
+
+    def get_preload_events(self, hours=24):
+        """获取最近的预加载事件"""
+        events = []
+        for chunk in self._read(hours, '''
+        SELECT * FROM preload_events
+        WHERE timestamp > ?
+        ORDER BY timestamp DESC
+        ''', (self._cutoff(hours),), as_dict=True):
+            events = chunk + events
+        return events
+
+    def save_ollama_events(self, events):
+        """在一个事务中批量保存Ollama日志事件"""
+        conn = self._connect()
+        conn.executemany('''
+        INSERT INTO ollama_events (timestamp, event, model, value, level, message)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(
+            event['timestamp'],
+            event['event'],
+            event.get('model'),
+            event.get('value'),
+            event.get('level'),
+            event.get('message')
+        ) for event in events])
+        conn.commit()
+        conn.close()
+
+    def get_ollama_events(self, hours=24, event=None):
+        """获取最近的Ollama日志事件，按时间正序"""
+        sql = 'SELECT * FROM ollama_events WHERE timestamp > ?'
+        params = [self._cutoff(hours)]
+        if event:
+            sql += ' AND event = ?'
+            params.append(event)
+        events = []
+        for chunk in self._read(hours, sql + ' ORDER BY timestamp', params, as_dict=True):
+            events.extend(chunk)
+        return events
+
+    def get_request_arrivals(self, hours):
+        """按时间顺序返回 (时间戳, 模型) ，用于学习各模型的请求规律；自测请求不计入"""
+        rows = []
+        for chunk in self._read(hours, '''
+        SELECT timestamp, model_name FROM request_logs
+        WHERE timestamp > ? AND model_name != '' AND endpoint IS NOT ?
+        ORDER BY timestamp
+        ''', (self._cutoff(hours), self.SELF_TEST_ENDPOINT)):
+            rows.extend(chunk)
+        return rows
+
+    def get_first_request_after(self, model_name, since):
+        """返回某模型在since之后的第一个请求(不含自测请求)，没有时返回None"""
+        hours = (datetime.now() - datetime.fromisoformat(since)).total_seconds() / 3600 + 1
+        for chunk in self._read(hours, '''
+        SELECT timestamp, load_duration FROM request_logs
+        WHERE model_name = ? AND timestamp > ? AND endpoint IS NOT ?
+        ORDER BY timestamp
+        LIMIT 1
+        ''', (model_name, since, self.SELF_TEST_ENDPOINT), as_dict=True):
+            if chunk:
+                return chunk[0]
+        return None
+
+    def get_cold_load_stats(self, hours=24, threshold=None):
+        """按模型统计请求数、冷加载次数和冷加载总耗时(秒)"""
+        threshold = COLD_LOAD_SECONDS if threshold is None else threshold
+        merged = {}
+        for chunk in self._read(hours, '''
+        SELECT model_name,
+               COUNT(*),
+               SUM(load_duration > ?),
+               SUM(CASE WHEN load_duration > ? THEN load_duration ELSE 0 END)
+        FROM request_logs
+        WHERE timestamp > ?
+        GROUP BY model_name
+        ''', (threshold, threshold, self._cutoff(hours))):
+            for model_name, count, cold, seconds in chunk:
+                entry = merged.setdefault(model_name, [0, 0, 0.0])
+                entry[0] += count
+                entry[1] += cold or 0
+                entry[2] += seconds or 0.0
+        return sorted((
+            {"model_name": name, "requests": e[0], "cold_loads": e[1], "load_seconds": round(e[2], 3)}
+            for name, e in merged.items()
+        ), key=lambda row: row['cold_loads'], reverse=True)
+
+    def get_power_samples(self, hours=24):
+        """按采样时间返回 (时间戳, 各GPU功耗之和(W), 平均利用率(%)) ，时间顺序"""
+        rows = []
+        for chunk in self._read(hours, '''
+        SELECT timestamp, SUM(gpu_power_draw), AVG(gpu_utilization)
+        FROM gpu_metrics
+        WHERE timestamp > ? AND gpu_power_draw IS NOT NULL
+        GROUP BY timestamp
+        ORDER BY timestamp
+        ''', (self._cutoff(hours),)):
+            rows.extend(chunk)
+        return rows
+
+    def get_request_intervals(self, hours=24):
+        """返回成功请求的 (结束时间戳, 耗时, 模型, 客户端IP, 输入token, 输出token) ，时间顺序；自测请求不计入"""
+        rows = []
+        for chunk in self._read(hours, '''
+        SELECT timestamp, response_time, model_name, client_ip, input_tokens, output_tokens
+        FROM request_logs
+        WHERE timestamp > ? AND status_code = 200 AND response_time IS NOT NULL AND endpoint IS NOT ?
+        ORDER BY timestamp
+        ''', (self._cutoff(hours), self.SELF_TEST_ENDPOINT)):
+            rows.extend(chunk)
+        return rows
+
+    def get_recent_system_metrics(self, hours=24):
+        """获取最近的系统指标"""
+        chunks = self._read(hours, '''
+        SELECT * FROM system_metrics
+        WHERE timestamp > ?
+        ORDER BY timestamp
+        ''', (self._cutoff(hours),), as_dict=True)
         
-        cursor.execute('''
+        result = [row for chunk in chunks for row in chunk]
+        return self._archived_rows('system_metrics', hours) + result
+
+    def get_recent_gpu_metrics(self, hours=24):
+        """获取最近的GPU指标"""
+        chunks = self._read(hours, '''
+        SELECT * FROM gpu_metrics
+        WHERE timestamp > ?
+        ORDER BY timestamp
+        ''', (self._cutoff(hours),), as_dict=True)
+
+        result = [row for chunk in chunks for row in chunk]
+        return self._archived_rows('gpu_metrics', hours) + result
+
+    def _archived_rows(self, table, hours):
+        """窗口超出归档界限时，从归档文件中补齐更早的数据"""
+        if ARCHIVE_AFTER_DAYS is None or hours <= ARCHIVE_AFTER_DAYS * 24:
+            return []
+        start = datetime.now() - timedelta(hours=hours)
+        data = MetricsArchive().read_range(table, start)
+        names = list(data)
+        rows = [dict(zip(names, values), id=None) for values in zip(*(data[n] for n in names))]
+        if self.host is not None:
+            rows = [row for row in rows if (row.get('host') or '') == self.host]
+        return rows
+
+    def get_metrics_history(self, table, columns=None, hours=24 * 30, step=None):
+        """
+        获取长期指标历史(归档+SQLite)，以列式结构返回
+
+        参数:
+            table: system_metrics 或 gpu_metrics
+            columns: 需要的列名列表，None表示全部
+            step: 降采样间隔(秒)，按时间桶求平均
+        """
+        known = [c for c, _ in MetricsArchive.TABLES[table] if c != 'host']
+        wanted = ['timestamp'] + [c for c in (columns or known) if c in known and c != 'timestamp']
+        start = datetime.now() - timedelta(hours=hours)
+
+        if ARCHIVE_AFTER_DAYS is not None:
+            data = MetricsArchive().read_range(table, start, columns=wanted + ['host'])
+            hosts = data.pop('host')
+            if self.host is not None:
+                keep = [i for i, host in enumerate(hosts) if (host or '') == self.host]
+                data = {c: [values[i] for i in keep] for c, values in data.items()}
+        else:
+            data = {c: [] for c in wanted}
+        chunks = self._read(
+            hours,
+            f"SELECT {', '.join(wanted)} FROM {table} WHERE timestamp > ? ORDER BY timestamp",
+            (start.isoformat(),)
+        )
+        for chunk in chunks:
+            for row in chunk:
+                for name, value in zip(wanted, row):
+                    data[name].append(value)
+
+        if step:
+            data = self._downsample(data, wanted, step)
+        return data
+
+    @staticmethod
+    def _downsample(data, columns, step):
+        """按step秒的时间桶对数值列求平均"""
+        buckets = {}
+        order = []
+        for i, ts in enumerate(data['timestamp']):
+            moment = datetime.fromisoformat(ts)
+            key = int(moment.timestamp() // step)
+            if key not in buckets:
+                buckets[key] = (moment.replace(microsecond=0).isoformat(), [[] for _ in columns])
+                order.append(key)
+            values = buckets[key][1]
+            for j, name in enumerate(columns):
+                value = data[name][i]
+                if isinstance(value, (int, float)):
+                    values[j].append(value)
+        result = {name: [] for name in columns}
+        for key in order:
+            stamp, values = buckets[key]
+            result['timestamp'].append(stamp)
+            for j, name in enumerate(columns[1:], 1):
+                result[name].append(sum(values[j]) / len(values[j]) if values[j] else None)
+        return result
+    
+    def get_recent_requests(self, hours=24, since=None):
+        """获取最近的请求日志；since为ISO时间时只返回其后的请求"""
+        cutoff = self._cutoff(hours)
+        chunks = self._read(hours, '''
+        SELECT * FROM request_logs
+        WHERE timestamp > ?
+        ORDER BY timestamp DESC
+        ''', (max(cutoff, since) if since else cutoff,), as_dict=True)
+        
+        # 各批内部已倒序，批次本身按时间正序，需反转批次顺序
+        return [row for chunk in reversed(chunks) for row in chunk]
+    
+    def get_request_log(self, log_id):
+        """按id获取单条请求日志"""
+        for chunk in self._read(None, 'SELECT * FROM request_logs WHERE id = ?', (log_id,), as_dict=True):
+            if chunk:
+                return chunk[0]
+        return None
+
+    def get_client_ip_stats(self, hours=24):
+        """获取客户端IP统计"""
+        chunks = self._read(hours, '''
+        SELECT client_ip, COUNT(*) as request_count 
+        FROM request_logs
+        WHERE timestamp > ?
+        GROUP BY client_ip
+        ORDER BY request_count DESC
+        ''', (self._cutoff(hours),))
+        if len(chunks) == 1:
+            return chunks[0]
+
+        # 分批查询时合并各批的计数
+        counts = {}
+        for chunk in chunks:
+            for client_ip, request_count in chunk:
+                counts[client_ip] = counts.get(client_ip, 0) + request_count
+        return sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    
+    def get_model_usage_stats(self, hours=24):
+        """获取模型使用统计"""
+        chunks = self._read(hours, '''
         SELECT model_name, 
                COUNT(*) as request_count,
                SUM(input_tokens) as total_input_tokens,
                SUM(output_tokens) as total_output_tokens,
-               AVG(response_time) as avg_response_time
+               AVG(response_time) as avg_response_time,
+               COUNT(response_time) as timed_count
         FROM request_logs
-        WHERE timestamp > datetime('now', ?)
+        WHERE timestamp > ?
         GROUP BY model_name
         ORDER BY request_count DESC
-        ''', (f'-{hours} hours',))
-        
-        result = cursor.fetchall()
-        conn.close()
-        return result
-    
+        ''', (self._cutoff(hours),))
+        if len(chunks) == 1:
+            return [row[:5] for row in chunks[0]]
+
+        # 分批查询时合并：计数和求和直接相加，平均值按有效样本数加权
+        merged = {}
+        for chunk in chunks:
+            for model_name, count, input_tokens, output_tokens, avg_time, timed in chunk:
+                entry = merged.setdefault(model_name, [0, 0, 0, 0.0, 0])
+                entry[0] += count
+                entry[1] += input_tokens or 0
+                entry[2] += output_tokens or 0
+                entry[3] += (avg_time or 0) * timed
+                entry[4] += timed
+        result = [
+            (name, e[0], e[1], e[2], e[3] / e[4] if e[4] else None)
+            for name, e in merged.items()
+        ]
+        return sorted(result, key=lambda row: row[1], reverse=True)
+
+    # 可导出的表 -> 时间列
+    EXPORT_TABLES = {
+        'request_logs': 'timestamp',
+        'system_metrics': 'timestamp',
+        'gpu_metrics': 'timestamp',
+        'concurrency_metrics': 'timestamp',
+        'usage_ledger': 'period_start',
+        'health_events': 'timestamp',
+        'anomaly_events': 'timestamp',
+        'alert_events': 'timestamp',
+        'preload_events': 'timestamp',
+        'ollama_events': 'timestamp',
+    }
+
+    def export_columns(self, table):
+        """返回可导出表的 [(列名, 声明类型)]，以当前写入库的表结构为准"""
+        if table not in self.EXPORT_TABLES:
+            raise ValueError(f"unknown table: {table}")
+        path = self._write_path()
+        self._ensure_tables(path)
+        conn = sqlite3.connect(path)
+        try:
+            return [(row[1], row[2].upper()) for row in conn.execute(f"PRAGMA table_info({table})")]
+        finally:
+            conn.close()
+
+    def _iter_archived_export(self, table, columns, start, end, chunk_rows):
+        """
+        按天逐个读取窗口内的归档文件，按块返回导出行
+
+        归档中没有的列(如id)为None；每次只解压一天的所需列。
+        """
+        if ARCHIVE_AFTER_DAYS is None or table not in MetricsArchive.TABLES:
+            return
+        archive = MetricsArchive()
+        names = {c for c, _ in MetricsArchive.TABLES[table]}
+        wanted = [c for c in columns if c in names]
+        for name in ('timestamp', 'host'):
+            if name not in wanted:
+                wanted.append(name)
+        first = datetime.fromisoformat(start).date() if start else None
+        last = datetime.fromisoformat(end).date() if end else None
+        for day in archive.list_days(table):
+            if (first and day < first) or (last and day > last):
+                continue
+            data = archive.read(archive._path(table, day), wanted)
+            stamps = data['timestamp']
+            hosts = data.get('host') or [None] * len(stamps)
+            values = [data.get(c) or [None] * len(stamps) for c in columns]
+            rows = [
+                tuple(column[i] for column in values)
+                for i, ts in enumerate(stamps)
+                if (start is None or ts >= start) and (end is None or ts < end)
+                and (self.host is None or (hosts[i] or '') == self.host)
+            ]
+            for i in range(0, len(rows), chunk_rows):
+                yield rows[i:i + chunk_rows]
+
+    def iter_export(self, table, columns, start=None, end=None, chunk_rows=None):
+        """
+        按块逐批返回导出行
+
+        系统和GPU指标先按天返回窗口内已归档的数据，再返回SQLite中的行。SQLite部分直接从
+        服务端游标fetchmany，不在内存中保存完整结果；不排序以免SQLite建立临时排序表，
+        行按写入顺序(分区模式下按分区先后)返回。start/end为不带时区的本地ISO时间字符串。
+        参数在调用时即检查并计算窗口，出错时在开始输出之前抛出异常。
+        """
+        chunk_rows = chunk_rows or EXPORT_CHUNK_ROWS
+        time_column = self.EXPORT_TABLES[table]
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append(f"{time_column} >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append(f"{time_column} < ?")
+            params.append(end)
+        sql = f"SELECT {', '.join(columns)} FROM {table}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        hours = (datetime.now() - datetime.fromisoformat(start)).total_seconds() / 3600 if start else None
+        return self._export_chunks(table, columns, start, end, sql, params, hours, chunk_rows)
+
+    def _export_chunks(self, table, columns, start, end, sql, params, hours, chunk_rows):
+        """iter_export的生成器部分：先返回归档，再从SQLite游标逐块返回"""
+        yield from self._iter_archived_export(table, columns, start, end, chunk_rows)
+        for conn in self._window_connections(hours):
+            try:
+                cursor = conn.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                conn.close()
+
     def get_latest_models(self):
         """获取最新的模型列表"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        # 最新的模型快照位于当前分区或上一个分区
+        hours = self.PARTITION_DAYS.get(DB_PARTITION, 0) * 24 if DB_PARTITION else None
+        chunks = self._read(hours, '''
         SELECT * FROM models
         WHERE timestamp = (SELECT MAX(timestamp) FROM models)
-        ''')
-        
-        rows = cursor.fetchall()
-        result = [dict(row) for row in rows]
-        
-        conn.close()
+        ''', as_dict=True)
+        return chunks[-1] if chunks else []
+
+class MetricsArchive:
+    """
+    指标归档：把已封存的整日数据存为压缩列式文件
+
+    文件格式: b'OMA1' + 4字节头长度 + JSON头 + 各列数据块。
+    每列单独压缩，读取时通过mmap只解压所需的列。
+    时间戳和整数列做差分编码；小数位有限的浮点列先按10^k放大为整数再差分，
+    其余浮点列与前一个值做XOR；所有数值列按字节平面重排后用zlib压缩。
+    """
+
+    MAGIC = b'OMA1'
+    EPOCH = datetime(1970, 1, 1)
+    # 列名 -> 类型: ts 时间戳, int 整数, float 浮点, text 文本
+    TABLES = {
+        'system_metrics': [
+            ('timestamp', 'ts'),
+            ('server_status', 'int'),
+            ('cpu_percent', 'float'),
+            ('memory_percent', 'float'),
+            ('disk_percent', 'float'),
+            ('network_bytes_sent', 'int'),
+            ('network_bytes_recv', 'int'),
+            ('ollama_cpu_percent', 'float'),
+            ('ollama_memory_percent', 'float'),
+            ('ollama_connections', 'int'),
+            ('host', 'text'),
+        ],
+        'gpu_metrics': [
+            ('timestamp', 'ts'),
+            ('gpu_name', 'text'),
+            ('gpu_utilization', 'float'),
+            ('gpu_memory_total', 'float'),
+            ('gpu_memory_used', 'float'),
+            ('gpu_temperature', 'float'),
+            ('gpu_power_draw', 'float'),
+            ('gpu_power_limit', 'float'),
+            ('host', 'text'),
+        ],
+    }
+
+    def __init__(self, archive_dir=None):
+        """初始化归档目录"""
+        self.archive_dir = archive_dir or ARCHIVE_DIR
+
+    # ---------- 编码 ----------
+
+    @staticmethod
+    def _shuffle(raw, width=8):
+        """按字节平面重排，使高位的0字节连续，便于压缩"""
+        return b''.join(raw[i::width] for i in range(width))
+
+    @staticmethod
+    def _unshuffle(data, width=8):
+        n = len(data) // width
+        out = bytearray(len(data))
+        for i in range(width):
+            out[i::width] = data[i * n:(i + 1) * n]
+        return bytes(out)
+
+    def _pack_ints(self, values):
+        # 差分后做zigzag映射，使小的负数也只占低位字节
+        deltas = array('Q', (((b - a) << 1) ^ ((b - a) >> 63) for a, b in zip([0] + values[:-1], values)))
+        return zlib.compress(self._shuffle(deltas.tobytes()), 9)
+
+    def _unpack_ints(self, blob, swap=False):
+        deltas = array('Q')
+        deltas.frombytes(self._unshuffle(zlib.decompress(blob)))
+        if swap:
+            deltas.byteswap()
+        return list(accumulate((z >> 1) ^ -(z & 1) for z in deltas))
+
+    @staticmethod
+    def _decimal_scale(values, max_digits=4):
+        """返回能无损表示全部值的最小小数位数，无法表示时返回None"""
+        for k in range(max_digits + 1):
+            factor = 10 ** k
+            if all(math.isfinite(v) and abs(v) * factor < 2 ** 52 and round(v * factor) / factor == v
+                   for v in values):
+                return k
+        return None
+
+    def _encode_column(self, values, kind):
+        """编码单列，返回(列元数据, 数据块)"""
+        meta = {'encoding': kind}
+        nulls = [v is None for v in values]
+        if any(nulls):
+            meta['nulls'] = zlib.compress(bytes(nulls)).hex()
+
+        if kind == 'ts':
+            micros = [0 if v is None else
+                      (datetime.fromisoformat(v) - self.EPOCH) // timedelta(microseconds=1)
+                      for v in values]
+            return meta, self._pack_ints(micros)
+        if kind == 'int':
+            return meta, self._pack_ints([0 if v is None else int(v) for v in values])
+        if kind == 'text':
+            dictionary = sorted({v for v in values if v is not None})
+            index = {v: i for i, v in enumerate(dictionary)}
+            meta['dict'] = dictionary
+            return meta, self._pack_ints([index.get(v, 0) for v in values])
+
+        floats = [0.0 if v is None else float(v) for v in values]
+        scale = self._decimal_scale(floats)
+        if scale is not None:
+            factor = 10 ** scale
+            meta['encoding'] = 'scaled'
+            meta['scale'] = scale
+            return meta, self._pack_ints([int(round(v * factor)) for v in floats])
+
+        bits = array('Q')
+        bits.frombytes(array('d', floats).tobytes())
+        xored = array('Q', (b ^ a for a, b in zip([0] + bits.tolist()[:-1], bits)))
+        meta['encoding'] = 'xor'
+        return meta, zlib.compress(self._shuffle(xored.tobytes()), 9)
+
+    def _decode_column(self, meta, blob, swap=False):
+        encoding = meta['encoding']
+        if encoding == 'xor':
+            xored = array('Q')
+            xored.frombytes(self._unshuffle(zlib.decompress(blob)))
+            if swap:
+                xored.byteswap()
+            bits = array('Q', accumulate(xored, lambda a, b: a ^ b))
+            values = array('d')
+            values.frombytes(bits.tobytes())
+            values = values.tolist()
+        else:
+            values = self._unpack_ints(blob, swap)
+            if encoding == 'ts':
+                values = [(self.EPOCH + timedelta(microseconds=v)).isoformat() for v in values]
+            elif encoding == 'text':
+                dictionary = meta['dict']
+                values = [dictionary[v] if dictionary else None for v in values]
+            elif encoding == 'scaled':
+                factor = 10 ** meta['scale']
+                values = [v / factor for v in values]
+
+        if 'nulls' in meta:
+            nulls = zlib.decompress(bytes.fromhex(meta['nulls']))
+            values = [None if n else v for v, n in zip(values, nulls)]
+        return values
+
+    # ---------- 文件读写 ----------
+
+    def _path(self, table, day):
+        return os.path.join(self.archive_dir, f"{table}-{day.isoformat()}.oma")
+
+    def encode(self, table, rows, columns=None, **extra):
+        """
+        把行编码为归档格式的字节串(归档文件和agent上报批次共用)
+
+        参数:
+            rows: 按列顺序排列的元组
+            columns: [(列名, 类型)]，默认为TABLES中该表的列
+            extra: 写入文件头的附加字段
+        """
+        columns = columns or self.TABLES[table]
+        header = {'table': table, **extra, 'rows': len(rows),
+                  'byteorder': sys.byteorder, 'columns': {}}
+        blobs = []
+        offset = 0
+        for i, (name, kind) in enumerate(columns):
+            meta, blob = self._encode_column([row[i] for row in rows], kind)
+            meta['offset'] = offset
+            meta['length'] = len(blob)
+            header['columns'][name] = meta
+            blobs.append(blob)
+            offset += len(blob)
+
+        header_bytes = json.dumps(header, separators=(',', ':')).encode()
+        return b''.join([self.MAGIC, len(header_bytes).to_bytes(4, 'little'), header_bytes] + blobs)
+
+    def decode(self, buf, columns=None):
+        """解码归档格式的字节串或mmap，返回 (文件头, {列名: 值列表})"""
+        if buf[:4] != self.MAGIC:
+            raise ValueError("不是有效的归档数据")
+        header_len = int.from_bytes(buf[4:8], 'little')
+        header = json.loads(buf[8:8 + header_len])
+        swap = header.get('byteorder', sys.byteorder) != sys.byteorder
+        base = 8 + header_len
+        result = {}
+        for name in columns or header['columns']:
+            meta = header['columns'].get(name)
+            if meta is None:
+                continue
+            start = base + meta['offset']
+            result[name] = self._decode_column(meta, buf[start:start + meta['length']], swap)
+        return header, result
+
+    def write(self, table, day, rows):
+        """把某一天的行写入归档文件，rows为按列顺序排列的元组"""
+        data = self.encode(table, rows, day=day.isoformat())
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self._path(table, day)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    def read(self, path, columns=None):
+        """通过mmap读取归档文件中的指定列，返回 {列名: 值列表}"""
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                try:
+                    return self.decode(mm, columns)[1]
+                except ValueError:
+                    raise ValueError(f"不是有效的归档文件: {path}")
+
+    def list_days(self, table):
+        """返回已归档的日期列表"""
+        days = []
+        for path in glob.glob(os.path.join(self.archive_dir, f"{table}-*.oma")):
+            stamp = os.path.basename(path)[len(table) + 1:-4]
+            try:
+                days.append(datetime.strptime(stamp, '%Y-%m-%d').date())
+            except ValueError:
+                continue
+        return sorted(days)
+
+    def read_range(self, table, start, end=None, columns=None):
+        """
+        读取[start, end)范围内的归档数据
+
+        参数:
+            start/end: datetime，end为None表示不限
+            columns: 需要的列，时间戳列总会返回
+        返回:
+            {列名: 值列表}，按时间排序
+        """
+        names = [c for c, _ in self.TABLES[table]]
+        wanted = ['timestamp'] + [c for c in (columns or names) if c != 'timestamp' and c in names]
+        result = {c: [] for c in wanted}
+        start_iso = start.isoformat()
+        end_iso = end.isoformat() if end else None
+        for day in self.list_days(table):
+            if day < start.date() or (end and day > end.date()):
+                continue
+            data = self.read(self._path(table, day), wanted)
+            stamps = data['timestamp']
+            keep = [i for i, ts in enumerate(stamps)
+                    if ts > start_iso and (end_iso is None or ts < end_iso)]
+            for c in wanted:
+                column = data.get(c) or [None] * len(stamps)
+                result[c].extend(column[i] for i in keep)
+        return result
+
+    def archive_sealed_days(self, db, older_than_days):
+        """
+        把早于指定天数的整日数据移入归档并从SQLite删除
+
+        返回:
+            归档的(表, 日期, 行数)列表
+        """
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).date()
+        archived = []
+        for table, columns in self.TABLES.items():
+            for db_file in db.all_db_files():
+                archived.extend(self._archive_file(db_file, table, columns, cutoff))
+        return archived
+
+    def _archive_file(self, db_file, table, columns, cutoff):
+        archived = []
+        conn = sqlite3.connect(db_file)
+        try:
+            # 旧分区可能缺少后来新增的列(如host)，用NULL补齐
+            present = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+            names = ', '.join(c if c in present else 'NULL' for c, _ in columns)
+            first = conn.execute(f'SELECT MIN(timestamp) FROM {table}').fetchone()[0]
+            if not first:
+                return archived
+            day = datetime.fromisoformat(first).date()
+            while day < cutoff:
+                lo, hi = day.isoformat(), (day + timedelta(days=1)).isoformat()
+                rows = conn.execute(
+                    f'SELECT {names} FROM {table} WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp',
+                    (lo, hi)
+                ).fetchall()
+                if rows:
+                    if os.path.exists(self._path(table, day)):
+                        # 同一天已有归档(例如迟到的数据)，合并后重写
+                        old = self.read(self._path(table, day))
+                        size = len(old['timestamp'])
+                        rows = sorted(list(zip(*(old.get(c) or [None] * size for c, _ in columns))) + rows,
+                                      key=lambda r: r[0])
+                    self.write(table, day, rows)
+                    conn.execute(f'DELETE FROM {table} WHERE timestamp >= ? AND timestamp < ?', (lo, hi))
+                    conn.commit()
+                    archived.append((table, day.isoformat(), len(rows)))
+                day += timedelta(days=1)
+        finally:
+            conn.close()
+        return archived
+
+class MetricsAnalytics:
+    """
+    基于NumPy的向量化分析：分组百分位、直方图以及按时间桶对齐的相关性
+
+    各表的数值列在内存中缓存为NumPy数组，之后每次查询只增量加载id更大的新行，
+    时间窗口过滤、分组和分桶全部使用数组运算，避免逐行的Python循环。
+    窗口超出归档界限时，已归档日期的列同样加载为数组(按文件修改时间缓存)。
+    """
+
+    # 指标名 -> (表名, 列名)，tokens_per_sec由两列计算得到
+    SERIES = {
+        'response_time': ('request_logs', 'response_time'),
+        'input_tokens': ('request_logs', 'input_tokens'),
+        'output_tokens': ('request_logs', 'output_tokens'),
+        'tokens_per_sec': ('request_logs', None),
+        'gpu_utilization': ('gpu_metrics', 'gpu_utilization'),
+        'gpu_temperature': ('gpu_metrics', 'gpu_temperature'),
+        'gpu_power_draw': ('gpu_metrics', 'gpu_power_draw'),
+        'gpu_memory_used': ('gpu_metrics', 'gpu_memory_used'),
+        'cpu_percent': ('system_metrics', 'cpu_percent'),
+        'memory_percent': ('system_metrics', 'memory_percent'),
+        'ollama_cpu_percent': ('system_metrics', 'ollama_cpu_percent'),
+        'ollama_memory_percent': ('system_metrics', 'ollama_memory_percent'),
+    }
+    # 缓存的列：表名 -> (数值列, 文本列)；host用于按主机过滤(NULL为聚合器本机)
+    COLUMNS = {
+        'request_logs': (['response_time', 'input_tokens', 'output_tokens'],
+                         ['model_name', 'client_ip', 'endpoint', 'host']),
+        'gpu_metrics': (['gpu_utilization', 'gpu_temperature', 'gpu_power_draw', 'gpu_memory_used'], ['host']),
+        'system_metrics': (['cpu_percent', 'memory_percent', 'ollama_cpu_percent', 'ollama_memory_percent'], ['host']),
+    }
+    # 分组字段，只适用于request_logs
+    GROUPS = {'model': 'model_name', 'client_ip': 'client_ip', 'endpoint': 'endpoint'}
+    EPOCH = datetime(1970, 1, 1)
+    MAX_HOURS = 24 * 31  # 缓存保留的最长时间范围
+
+    # (数据库文件, 表名) -> 缓存
+    _cache = {}
+    # 归档文件 -> (修改时间, 缓存)
+    _archive_cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, db=None):
+        if np is None:
+            raise RuntimeError("分析功能需要安装numpy")
+        self.db = db or OllamaMetricsDB()
+
+    def _seconds(self, moment):
+        return (moment - self.EPOCH).total_seconds()
+
+    def _refresh(self, path, table):
+        """增量加载某个数据库文件中某张表的新行"""
+        numeric, text = self.COLUMNS[table]
+        key = (path, table)
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            conn = sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True)
+            try:
+                max_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+                if entry is None or max_id < entry['max_id']:
+                    # 首次加载或数据库被重建
+                    entry = {'max_id': 0, 't': np.empty(0), 'ids': np.empty(0, dtype=np.int64),
+                             'num': {c: np.empty(0) for c in numeric},
+                             'codes': {c: np.empty(0, dtype=np.int64) for c in text},
+                             'names': {c: {} for c in text}}
+                if max_id == entry['max_id']:
+                    self._cache[key] = entry
+                    return entry
+                # julianday把本地ISO时间当作UTC处理，得到的秒数与本地时间对齐，分桶边界落在本地整点
+                floor = self._seconds(datetime.now() - timedelta(hours=self.MAX_HOURS))
+                # 旧分区可能缺少后来新增的列(如host)，用NULL补齐
+                present = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+                names = ', '.join(c if c in present else 'NULL' for c in numeric + text)
+                rows = conn.execute(
+                    f"SELECT id, (julianday(timestamp) - 2440587.5) * 86400.0, {names} "
+                    f"FROM {table} WHERE id > ? AND timestamp > ?",
+                    (entry['max_id'], (datetime.now() - timedelta(hours=self.MAX_HOURS)).isoformat())
+                ).fetchall()
+            finally:
+                conn.close()
+
+            if rows:
+                columns = list(zip(*rows))
+                prev = entry
+                keep = prev['t'] > floor
+                entry = {
+                    'max_id': max_id,
+                    't': np.concatenate([prev['t'][keep], np.array(columns[1], dtype=np.float64)]),
+                    'ids': np.concatenate([prev['ids'][keep], np.array(columns[0], dtype=np.int64)]),
+                    'num': {
+                        c: np.concatenate([prev['num'][c][keep], np.array(columns[2 + i], dtype=np.float64)])
+                        for i, c in enumerate(numeric)
+                    },
+                    'codes': {},
+                    'names': prev['names'],
+                }
+                for i, c in enumerate(text):
+                    names = entry['names'][c]
+                    codes = np.fromiter((names.setdefault(v, len(names)) for v in columns[2 + len(numeric) + i]),
+                                        dtype=np.int64, count=len(rows))
+                    entry['codes'][c] = np.concatenate([prev['codes'][c][keep], codes])
+            else:
+                entry = dict(entry, max_id=max_id)
+            self._cache[key] = entry
+            return entry
+
+    def _archive_entries(self, table, hours):
+        """窗口覆盖的已归档日期，返回与_refresh结构相同的缓存；request_logs不归档"""
+        if ARCHIVE_AFTER_DAYS is None or hours <= ARCHIVE_AFTER_DAYS * 24 or table not in MetricsArchive.TABLES:
+            return []
+        numeric, text = self.COLUMNS[table]
+        archive = MetricsArchive()
+        first_day = (datetime.now() - timedelta(hours=hours)).date()
+        oldest_day = (datetime.now() - timedelta(hours=self.MAX_HOURS)).date()
+        entries = []
+        with self._cache_lock:
+            for day in archive.list_days(table):
+                path = archive._path(table, day)
+                if day < oldest_day:
+                    self._archive_cache.pop(path, None)
+                    continue
+                if day < first_day:
+                    continue
+                mtime = os.stat(path).st_mtime_ns
+                cached = self._archive_cache.get(path)
+                if cached is None or cached[0] != mtime:
+                    data = archive.read(path, ['timestamp'] + numeric + text)
+                    size = len(data['timestamp'])
+                    stamps = np.array(data['timestamp'], dtype='datetime64[us]')
+                    entry = {
+                        # 与julianday相同，把本地时间当作UTC换算为秒数
+                        't': stamps.astype(np.int64) / 1e6,
+                        'num': {c: np.array(data.get(c) or [None] * size, dtype=np.float64) for c in numeric},
+                        'codes': {},
+                        'names': {},
+                    }
+                    for c in text:
+                        names = entry['names'][c] = {}
+                        entry['codes'][c] = np.fromiter(
+                            (names.setdefault(v, len(names)) for v in data.get(c) or [None] * size),
+                            dtype=np.int64, count=size)
+                    cached = self._archive_cache[path] = (mtime, entry)
+                entries.append(cached[1])
+        return entries
+
+    def _files(self, hours):
+        """窗口覆盖的数据库文件"""
+        if not DB_PARTITION:
+            return [self.db.db_file] if os.path.exists(self.db.db_file) else []
+        cutoff = (datetime.now() - timedelta(hours=hours)).date()
+        return [path for _, end, path in self.db.list_partitions() if end > cutoff]
+
+    def _load(self, metric, hours, by=None, model=None):
+        """
+        加载一个指标序列
+
+        返回:
+            (秒数数组, 数值数组, 分组编码数组或None, 分组名称列表)
+        """
+        if metric not in self.SERIES:
+            raise ValueError(f"未知指标: {metric}")
+        table, column = self.SERIES[metric]
+        group = self.GROUPS.get(by) if by else None
+        if by and (group is None or table != 'request_logs'):
+            raise ValueError(f"指标 {metric} 不支持按 {by} 分组")
+        hours = min(hours, self.MAX_HOURS)
+        cutoff = self._seconds(datetime.now() - timedelta(hours=hours))
+
+        times, values, codes = [], [], []
+        names = {}
+        entries = self._archive_entries(table, hours) + [self._refresh(path, table) for path in self._files(hours)]
+        for entry in entries:
+            t = entry['t']
+            if column is None:
+                rt = entry['num']['response_time']
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    v = np.where(rt > 0, entry['num']['output_tokens'] / rt, np.nan)
+            else:
+                v = entry['num'][column]
+            mask = (t > cutoff) & ~np.isnan(v)
+            if self.db.host is not None:
+                # ''表示聚合器本机的行(host为NULL)
+                wanted = [code for name, code in entry['names']['host'].items() if (name or '') == self.db.host]
+                mask &= np.isin(entry['codes']['host'], wanted)
+            if model and table == 'request_logs':
+                code = entry['names']['model_name'].get(model)
+                mask &= entry['codes']['model_name'] == (-1 if code is None else code)
+            times.append(t[mask])
+            values.append(v[mask])
+            if group:
+                # 各文件(及归档日期)的名称编码不同，映射到统一编码
+                local = entry['names'][group]
+                mapping = np.array([names.setdefault(n, len(names)) for n in local] or [0], dtype=np.int64)
+                codes.append(mapping[entry['codes'][group][mask]])
+
+        t = np.concatenate(times) if times else np.empty(0)
+        v = np.concatenate(values) if values else np.empty(0)
+        g = (np.concatenate(codes) if codes else np.empty(0, dtype=np.int64)) if group else None
+        return t, v, g, list(names)
+
+    def _stamp(self, seconds):
+        return (self.EPOCH + timedelta(seconds=float(seconds))).isoformat()
+
+    @staticmethod
+    def _group_percentiles(keys, values, percentiles):
+        """对每个键计算百分位(线性插值)，返回(唯一键, 样本数, {p: 数组})"""
+        order = np.lexsort((values, keys))
+        k = keys[order]
+        v = values[order]
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+        counts = np.diff(np.r_[starts, len(k)])
+        result = {}
+        for p in percentiles:
+            pos = starts + (counts - 1) * (p / 100.0)
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.minimum(lo + 1, starts + counts - 1)
+            result[p] = v[lo] + (v[hi] - v[lo]) * (pos - lo)
+        return k[starts], counts, result
+
+    def percentiles(self, metric, hours=24, by=None, bucket=None, percentiles=(50, 95, 99), model=None):
+        """
+        分组、分时间桶的百分位数，例如"每个模型每小时的p95延迟"
+
+        参数:
+            bucket: 时间桶大小(秒)，None表示整个窗口
+            percentiles: 0到100之间的百分位
+        """
+        bad = [p for p in percentiles if not 0 <= p <= 100]
+        if bad:
+            raise ValueError(f"percentiles must be between 0 and 100: {', '.join(f'{p:g}' for p in bad)}")
+        self._check_bucket(bucket)
+        t, v, g, names = self._load(metric, hours, by, model)
+        if not len(v):
+            return {"metric": metric, "groups": []}
+        buckets = (t // bucket).astype(np.int64) if bucket else np.zeros(len(t), dtype=np.int64)
+        base = buckets.min()
+        span = int(buckets.max() - base) + 1
+        codes = g if g is not None else np.zeros(len(t), dtype=np.int64)
+        keys = codes * span + (buckets - base)
+
+        unique, counts, values = self._group_percentiles(keys, v, percentiles)
+        groups = []
+        for i, key in enumerate(unique.tolist()):
+            code, offset = divmod(key, span)
+            item = {"count": int(counts[i])}
+            if g is not None:
+                item[by] = names[code]
+            if bucket:
+                item["timestamp"] = self._stamp((base + offset) * bucket)
+            item.update({f"p{p:g}": float(values[p][i]) for p in percentiles})
+            groups.append(item)
+        return {"metric": metric, "by": by, "bucket": bucket, "groups": groups}
+
+    def histogram(self, metric, hours=24, bins=50, by=None, log=False, model=None):
+        """数值分布直方图，可按分组分别统计"""
+        t, v, g, names = self._load(metric, hours, by, model)
+        if log:
+            mask = v > 0
+            v = v[mask]
+            if g is not None:
+                g = g[mask]
+        if not len(v):
+            return {"metric": metric, "edges": [], "counts": []}
+        lo, hi = float(v.min()), float(v.max())
+        if hi <= lo:
+            hi = lo + 1.0
+        edges = np.geomspace(lo, hi, bins + 1) if log else np.linspace(lo, hi, bins + 1)
+        index = np.clip(np.searchsorted(edges, v, side='right') - 1, 0, bins - 1)
+        result = {"metric": metric, "edges": edges.tolist()}
+        if g is None:
+            result["counts"] = np.bincount(index, minlength=bins).tolist()
+        else:
+            table = np.bincount(g * bins + index, minlength=len(names) * bins).reshape(len(names), bins)
+            result["by"] = by
+            result["counts"] = {names[i]: table[i].tolist() for i in range(len(names))}
+        return result
+
+    @staticmethod
+    def _average_ranks(values):
+        """秩从0开始，相同的值取平均秩(整数列中大量重复值时不偏向排序的先后)"""
+        order = np.argsort(values, kind='mergesort')
+        ordered = values[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        ends = np.r_[starts[1:], len(values)]
+        ranks = np.empty(len(values))
+        ranks[order] = np.repeat((starts + ends - 1) / 2.0, ends - starts)
+        return ranks
+
+    @staticmethod
+    def _check_bucket(bucket):
+        if bucket is not None and bucket <= 0:
+            raise ValueError("bucket must be a positive number of seconds")
+
+    def _bucket_means(self, t, v, bucket):
+        b = (t // bucket).astype(np.int64)
+        unique, inverse = np.unique(b, return_inverse=True)
+        means = np.bincount(inverse, weights=v) / np.bincount(inverse)
+        return unique, means
+
+    def correlation(self, x, y, hours=24, bucket=60, method='pearson', model=None):
+        """
+        两个指标按时间桶求均值后对齐，计算相关系数
+
+        例如 x=gpu_temperature, y=tokens_per_sec 可回答温度与生成速度的关系。
+        """
+        self._check_bucket(bucket)
+        tx, vx, _, _ = self._load(x, hours, model=model)
+        ty, vy, _, _ = self._load(y, hours, model=model)
+        bx, mx = self._bucket_means(tx, vx, bucket)
+        by_, my = self._bucket_means(ty, vy, bucket)
+        _, ix, iy = np.intersect1d(bx, by_, assume_unique=True, return_indices=True)
+        a, b = mx[ix], my[iy]
+        result = {"x": x, "y": y, "bucket": bucket, "method": method, "samples": int(len(a))}
+        if len(a) < 3 or a.std() == 0 or b.std() == 0:
+            result["coefficient"] = None
+            return result
+        if method == 'spearman':
+            a = self._average_ranks(a)
+            b = self._average_ranks(b)
+        result["coefficient"] = float(np.corrcoef(a, b)[0, 1])
+        slope, intercept = np.polyfit(mx[ix], my[iy], 1)
+        result["slope"] = float(slope)
+        result["intercept"] = float(intercept)
         return result
 
 class OllamaMonitor:
-    def __init__(self, host=OLLAMA_HOST, interval=MONITOR_INTERVAL):
+    def __init__(self, host=None, interval=None, db=None):
         """
         初始化Ollama监控器
         
         参数:
-            host: Ollama服务的URL
-            interval: 检查间隔(秒)
+            host: Ollama服务的URL(默认OLLAMA_HOST)
+            interval: 检查间隔(秒，默认MONITOR_INTERVAL)
+            db: 保存采样的对象(默认OllamaMetricsDB)
         """
-        self.host = host
-        self.interval = interval
-        self.api_endpoint = f"{host}/api"
-        self.db = OllamaMetricsDB()
+        self.host = host or OLLAMA_HOST
+        self.interval = interval or MONITOR_INTERVAL
+        self.api_endpoint = f"{self.host}/api"
+        self.db = db or OllamaMetricsDB()
         self.running = True
         self.default_model = None
+        self.last_maintenance = 0
     
     def get_models(self):
         """获取所有可用的模型"""
@@ -362,7 +2096,7 @@ class OllamaMonitor:
         """检查服务器状态"""
         try:
             # 使用/api/tags接口检查服务状态，更可靠
-            response = requests.get(f"{self.api_endpoint}/tags")
+            response = requests.get(f"{self.api_endpoint}/tags", timeout=HEALTH_TIMEOUT * 5)
             return response.status_code == 200
         except Exception as e:
             logger.error(f"服务器状态检查异常: {str(e)}")
@@ -450,9 +2184,11 @@ class OllamaMonitor:
                     "output_tokens": result.get('eval_count', 0),
                     "response_time": response_time,
                     "status_code": response.status_code,
-                    "endpoint": "/api/generate"
+                    "endpoint": OllamaMetricsDB.SELF_TEST_ENDPOINT,
+                    "load_duration": result.get('load_duration', 0) / 1e9
                 }
                 self.db.save_request_log(log_data)
+                anomaly_detector.observe_inference(model_name, response_time, result)
                 return response_time
             else:
                 logger.error(f"模型生成测试失败: {response.status_code}")
@@ -485,6 +2221,9 @@ class OllamaMonitor:
                 # 保存系统指标
                 self.db.save_system_metrics(metrics)
                 self.db.save_gpu_metrics(metrics)
+                self.detect_anomalies(metrics)
+                self.evaluate_alerts(metrics)
+                metric_forwarder.observe_metrics(metrics)
                 
                 # 如果服务器在线，获取并保存模型列表
                 if server_status:
@@ -494,28 +2233,3179 @@ class OllamaMonitor:
                         
                         # 测试默认模型的生成能力
                         self.test_model_generation()
+
+                self.after_sample()
                 
                 # 等待下一个间隔
                 time.sleep(self.interval)
             except Exception as e:
                 logger.error(f"监控循环异常: {str(e)}")
+                alert_engine.observe('monitor_errors', None, 1)
                 time.sleep(10)  # 发生错误时短暂暂停后重试
     
+    def after_sample(self):
+        """一次采样保存后：通知后台重建仪表板快照，每小时检查一次归档和分区保留期"""
+        dashboard_snapshots.notify()
+        fleet_registry.notify('')
+        if time.time() - self.last_maintenance > 3600:
+            self.last_maintenance = time.time()
+            if ARCHIVE_AFTER_DAYS is not None:
+                self.archive_old_metrics()
+            if DB_PARTITION and DB_RETENTION_DAYS:
+                self.drop_expired_partitions()
+
+    def detect_anomalies(self, metrics):
+        """把本次采样计入异常检测"""
+        gpu = metrics['gpu']
+        if gpu:
+            anomaly_detector.observe('gpu_temperature', gpu['gpu_name'], gpu['gpu_temperature'])
+            anomaly_detector.observe('gpu_power_draw', gpu['gpu_name'], gpu['gpu_power_draw'])
+        anomaly_detector.observe('ollama_memory_percent', None, metrics['ollama_process'].get('memory_percent'))
+
+    def evaluate_alerts(self, metrics):
+        """把本次采样计入告警窗口并评估全部规则"""
+        observe = alert_engine.observe
+        observe('server_status', None, 1 if metrics['server_status'] else 0)
+        for key, value in metrics['system'].items():
+            observe(key, None, value)
+        process = metrics['ollama_process']
+        observe('ollama_cpu_percent', None, process.get('cpu_percent'))
+        observe('ollama_memory_percent', None, process.get('memory_percent'))
+        gpu = metrics['gpu']
+        for key in ('gpu_utilization', 'gpu_temperature', 'gpu_power_draw', 'gpu_memory_used'):
+            if key in gpu:
+                observe(key, gpu['gpu_name'], gpu[key])
+        alert_engine.evaluate()
+
+    def archive_old_metrics(self):
+        """把过期的整日指标移入列式归档"""
+        try:
+            for table, day, rows in MetricsArchive().archive_sealed_days(self.db, ARCHIVE_AFTER_DAYS):
+                logger.info(f"已归档 {table} {day}: {rows} 行")
+        except Exception as e:
+            logger.error(f"指标归档异常: {str(e)}")
+    
+    def drop_expired_partitions(self):
+        """删除超过保留期的分区文件"""
+        try:
+            for path in self.db.drop_expired_partitions(DB_RETENTION_DAYS):
+                logger.info(f"已删除过期分区: {path}")
+        except Exception as e:
+            logger.error(f"删除过期分区异常: {str(e)}")
+    
     def stop(self):
         """停止监控循环"""
         self.running = False
 
+class MetricsWriter:
+    """
+    单一写入线程
+
+    请求日志、用量账本和健康事件等写入先放入队列，由一个线程按类型批量提交，
+    请求线程不等待磁盘，多个来源的写入也不会互相争抢SQLite写锁。
+    """
+
+    # 记住最近写入的agent批次(批次id和表)，经多个dashboard进程转发的重发批次也只写一次
+    RECENT_HOST_BATCHES = 4096
+
+    def __init__(self, db=None, max_batch=500, queue_size=100000):
+        self.db = db
+        self.max_batch = max_batch
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self._recent_host_batches = deque(maxlen=self.RECENT_HOST_BATCHES)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, kind, payload):
+        """
+        提交一次写入；kind为 request_log、usage、concurrency_sample、health_event、preload_event、
+        anomaly_event、alert_event、ollama_event、inflight_snapshot 或 host_rows(聚合器收到的agent上报)
+        """
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait((kind, payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.error(f"批量写入失败({len(batch)}条): {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, batch):
+        db = self.db or OllamaMetricsDB()
+        logs = [payload for kind, payload in batch if kind == 'request_log']
+        usage = [row for kind, payload in batch if kind == 'usage' for row in payload]
+        if logs:
+            db.save_request_logs(logs)
+            self.observe_requests(logs)
+        if usage:
+            db.save_usage(usage)
+        samples = [payload for kind, payload in batch if kind == 'concurrency_sample']
+        if samples:
+            db.save_concurrency_samples(samples)
+        events = [payload for kind, payload in batch if kind == 'ollama_event']
+        if events:
+            db.save_ollama_events(events)
+        for kind, payload in batch:
+            if kind == 'health_event':
+                db.save_health_event(payload)
+            elif kind == 'preload_event':
+                db.save_preload_event(payload)
+            elif kind == 'anomaly_event':
+                db.save_anomaly_event(payload)
+            elif kind == 'alert_event':
+                db.save_alert_event(payload)
+            elif kind == 'inflight_snapshot':
+                db.save_inflight_snapshot(payload)
+            elif kind == 'host_rows':
+                key = (payload.get('batch_id'), payload['table'])
+                if key[0] and key in self._recent_host_batches:
+                    continue
+                db.save_host_rows(payload['table'], payload['host'], payload['columns'], payload['rows'])
+                if key[0]:
+                    self._recent_host_batches.append(key)
+                fleet_registry.notify(payload['host'])
+
+    @staticmethod
+    def observe_requests(logs):
+        # 所有进程的请求日志都经过这里，告警规则和指标转发在此获得请求样本
+        for log in logs:
+            alert_engine.observe('response_time', log['model_name'], log['response_time'])
+            alert_engine.observe('request_error', log['model_name'], 0 if log['status_code'] == 200 else 1)
+            metric_forwarder.observe_request(log)
+
+    def flush(self):
+        """等待队列中已提交的写入全部完成"""
+        if self._thread is not None:
+            self.queue.join()
+
+
+class RemoteWriter(MetricsWriter):
+    """
+    把写入通过TCP转发给collector进程
+
+    proxy和dashboard角色不直接写数据库：每批写入带上批次id，编码为一行JSON发送到
+    collector的接收端口，由collector的MetricsWriter统一落库。collector收下一批后回复
+    确认；没有收到确认时重连并用同一批次id重发，collector按批次id去重，不会重复写入。
+    重试按指数退避，超过COLLECTOR_MAX_RETRIES次后丢弃该批并计入dropped，
+    期间新的写入在队列中等待。
+    """
+
+    def __init__(self, address, **kwargs):
+        super().__init__(**kwargs)
+        self.address = address
+        self.sock = None
+        self.reader = None
+
+    def _close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+            self.reader = None
+
+    def write(self, batch):
+        batch_id = uuid.uuid4().hex
+        data = json.dumps({
+            "batch_id": batch_id,
+            "items": [[kind, payload] for kind, payload in batch],
+        }).encode() + b'\n'
+        for attempt in range(COLLECTOR_MAX_RETRIES + 1):
+            try:
+                if self.sock is None:
+                    self.sock = socket.create_connection(self.address, timeout=10)
+                    self.reader = self.sock.makefile('rb')
+                self.sock.sendall(data)
+                line = self.reader.readline()
+                if not line.endswith(b'\n'):
+                    raise ConnectionError("collector关闭了连接")
+                reply = json.loads(line)
+                if reply.get('error'):
+                    # collector无法解析该批，重发也不会成功
+                    logger.error(f"collector拒绝了{len(batch)}条写入: {reply['error']}")
+                    self.dropped += len(batch)
+                    return
+                if reply.get('ack') != batch_id:
+                    raise ConnectionError("collector确认的批次id不一致")
+                return
+            except (OSError, ValueError) as e:
+                self._close()
+                if attempt == COLLECTOR_MAX_RETRIES:
+                    break
+                delay = min(2 ** attempt, COLLECTOR_RETRY_MAX_SECONDS)
+                logger.error(f"发送到collector失败，{delay}秒后重试: {str(e)}")
+                time.sleep(delay)
+        logger.error(f"发送到collector失败{COLLECTOR_MAX_RETRIES + 1}次，丢弃{len(batch)}条写入")
+        self.dropped += len(batch)
+
+
+class IngestHandler(socketserver.StreamRequestHandler):
+    """
+    collector接收其他进程的写入
+
+    每行是一批写入，提交给本进程的MetricsWriter后回复 {"ack": 批次id}。发送方没收到
+    确认时会重发同一批，最近的批次id用于去重。连接中断时最后不完整的一行直接丢弃，
+    由发送方重发。
+    """
+    RECENT_BATCHES = 4096
+    recent = deque(maxlen=RECENT_BATCHES)
+    lock = threading.Lock()
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.endswith(b'\n'):
+                logger.warning("连接中断，丢弃不完整的写入")
+                break
+            try:
+                batch = json.loads(line)
+                batch_id = batch['batch_id']
+                items = batch['items']
+                with self.lock:
+                    duplicate = batch_id in self.recent
+                    if not duplicate:
+                        self.recent.append(batch_id)
+                if not duplicate:
+                    for kind, payload in items:
+                        metrics_writer.submit(kind, payload)
+                reply = {"ack": batch_id}
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"无效的写入数据: {str(e)}")
+                reply = {"error": str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class IngestServer(socketserver.ThreadingTCPServer):
+    """collector角色接收其他进程写入的端口"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class AgentStore:
+    """agent角色交给监控循环的存储：采样和测试请求不写本地数据库，而是交给AgentWriter"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def save_system_metrics(self, metrics):
+        self.writer.submit('system_metrics', OllamaMetricsDB.system_metrics_row(metrics))
+
+    def save_gpu_metrics(self, metrics):
+        if metrics.get('gpu'):
+            self.writer.submit('gpu_metrics', OllamaMetricsDB.gpu_metrics_row(metrics))
+
+    def save_models(self, timestamp, models):
+        # 模型列表只在本机有意义，不上报
+        pass
+
+    def save_request_log(self, log_data):
+        self.writer.submit('request_log', log_data)
+
+
+class AgentMonitor(OllamaMonitor):
+    """agent角色的监控循环：复用全部采集逻辑，没有本地数据库和仪表板"""
+
+    def __init__(self, writer, **kwargs):
+        super().__init__(db=AgentStore(writer), **kwargs)
+
+    def after_sample(self):
+        pass
+
+
+class AgentWriter(MetricsWriter):
+    """
+    agent角色的写入：按批次编码后POST给中心聚合器
+
+    系统、GPU采样、并发采样和请求日志在内存中攒AGENT_BATCH_INTERVAL秒，每张表用MetricsArchive的
+    列式编码(时间戳和整数差分+zigzag、浮点按小数位放大或XOR、文本字典，字节平面重排后
+    zlib压缩)打包，整批一次POST到聚合器的 /api/ingest。发送失败时保留批次并按指数退避
+    重试，积压超过AGENT_MAX_PENDING个批次时丢弃最旧的。其余写入(用量、健康事件等)只在
+    agent本地有意义，直接丢弃。
+
+    批次格式: b'OMB1' + 4字节头长度 + JSON头(主机名、批次id、健康状态) +
+    若干个 [4字节长度 + 归档格式的表数据]。
+    """
+    MAGIC = b'OMB1'
+    CONTENT_TYPE = 'application/x-ollama-monitor-batch'
+    # 上报的表和列：本机行的列顺序与OllamaMetricsDB的*_row一致，聚合器写入时附加host
+    WIRE_TABLES = {
+        'system_metrics': [c for c in MetricsArchive.TABLES['system_metrics'] if c[0] != 'host'],
+        'gpu_metrics': [c for c in MetricsArchive.TABLES['gpu_metrics'] if c[0] != 'host'],
+        'request_logs': [
+            ('timestamp', 'ts'),
+            ('client_ip', 'text'),
+            ('model_name', 'text'),
+            ('input_tokens', 'int'),
+            ('output_tokens', 'int'),
+            ('response_time', 'float'),
+            ('status_code', 'int'),
+            ('endpoint', 'text'),
+            ('request_uid', 'text'),
+            ('load_duration', 'float'),
+        ],
+        'concurrency_metrics': [
+            ('timestamp', 'ts'),
+            ('model_name', 'text'),
+            ('interval', 'float'),
+            ('inflight', 'int'),
+            ('avg_inflight', 'float'),
+            ('peak_inflight', 'int'),
+            ('completed', 'int'),
+            ('output_tokens', 'int'),
+            ('latency_seconds', 'float'),
+            ('compute_seconds', 'float'),
+        ],
+    }
+
+    def __init__(self, url=None, host_name=None, **kwargs):
+        super().__init__(**kwargs)
+        self.url = (url or AGENT_AGGREGATOR_URL or '').rstrip('/')
+        self.host_name = host_name or AGENT_HOST_NAME or socket.gethostname()
+        self.rows = {table: [] for table in self.WIRE_TABLES}
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.archive = MetricsArchive()
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped_batches = 0
+        self.last_error = None
+        self._sender = None
+
+    def write(self, batch):
+        logs = [payload for kind, payload in batch if kind == 'request_log']
+        with self.lock:
+            for kind, payload in batch:
+                if kind == 'request_log':
+                    self.rows['request_logs'].append(OllamaMetricsDB.request_log_row(payload))
+                elif kind in ('system_metrics', 'gpu_metrics'):
+                    self.rows[kind].append(payload)
+                elif kind == 'concurrency_sample':
+                    self.rows['concurrency_metrics'].append(
+                        tuple(payload[name] for name, _ in self.WIRE_TABLES['concurrency_metrics']))
+        if logs:
+            self.observe_requests(logs)
+
+    def encode(self, tables, status=None):
+        """把 {表名: 行列表} 编码为一个批次"""
+        header = json.dumps({
+            "host": self.host_name,
+            "batch_id": uuid.uuid4().hex,
+            "created": datetime.now().isoformat(),
+            "status": status,
+        }, separators=(',', ':')).encode()
+        parts = [self.MAGIC, len(header).to_bytes(4, 'little'), header]
+        for table, rows in tables.items():
+            if rows:
+                frame = self.archive.encode(table, rows, columns=self.WIRE_TABLES[table])
+                parts += [len(frame).to_bytes(4, 'little'), frame]
+        return b''.join(parts)
+
+    @classmethod
+    def decode(cls, data):
+        """
+        解码批次
+
+        返回:
+            (JSON头, [(表名, 列名列表, 行列表)])；表或列不在WIRE_TABLES中时抛出ValueError
+        """
+        if data[:4] != cls.MAGIC:
+            raise ValueError("不是有效的agent批次")
+        header_len = int.from_bytes(data[4:8], 'little')
+        header = json.loads(data[8:8 + header_len])
+        archive = MetricsArchive()
+        tables = []
+        pos = 8 + header_len
+        while pos < len(data):
+            size = int.from_bytes(data[pos:pos + 4], 'little')
+            frame = data[pos + 4:pos + 4 + size]
+            if len(frame) != size:
+                raise ValueError("批次数据不完整")
+            pos += 4 + size
+            meta, columns = archive.decode(frame)
+            known = [name for name, _ in cls.WIRE_TABLES.get(meta.get('table'), [])]
+            if not known or any(name not in known for name in columns):
+                raise ValueError(f"不支持的表或列: {meta.get('table')}")
+            names = list(columns)
+            tables.append((meta['table'], names, list(zip(*(columns[n] for n in names)))))
+        return header, tables
+
+    def flush_batch(self):
+        """把缓冲的行编码为一个待发送批次"""
+        with self.lock:
+            tables, self.rows = self.rows, {table: [] for table in self.WIRE_TABLES}
+        if not any(tables.values()):
+            return None
+        data = self.encode(tables, health_prober.status())
+        with self.lock:
+            self.pending.append(data)
+            while len(self.pending) > AGENT_MAX_PENDING:
+                self.pending.popleft()
+                self.dropped_batches += 1
+                logger.error("聚合器积压批次超过上限，已丢弃最旧的批次")
+        return data
+
+    def deliver(self, data):
+        """发送一个批次，返回HTTP状态码"""
+        headers = {'Content-Type': self.CONTENT_TYPE}
+        if AGENT_TOKEN:
+            headers['Authorization'] = f'Bearer {AGENT_TOKEN}'
+        return self.session.post(f"{self.url}/api/ingest", data=data, headers=headers, timeout=30).status_code
+
+    def send_pending(self):
+        """按顺序发送积压的批次，遇到可重试的失败时停止并返回False"""
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return True
+                data = self.pending[0]
+            try:
+                status = self.deliver(data)
+                error = None if status < 300 else f"HTTP {status}"
+            except requests.RequestException as e:
+                status, error = None, str(e)
+            # 与指标转发相同：4xx(除408和429)表示批次本身被拒绝，重试也不会成功
+            if status is None or not (status < 300 or (400 <= status < 500 and status not in (408, 429))):
+                self.last_error = error
+                return False
+            with self.lock:
+                if self.pending and self.pending[0] is data:
+                    self.pending.popleft()
+            if status < 300:
+                self.sent += 1
+                self.sent_bytes += len(data)
+            else:
+                self.dropped_batches += 1
+                self.last_error = error
+                logger.error(f"聚合器拒绝了批次，已丢弃: {error}")
+
+    def _send_loop(self):
+        attempt = 0
+        while True:
+            time.sleep(AGENT_BATCH_INTERVAL if attempt == 0 else min(2 ** attempt, AGENT_RETRY_MAX_SECONDS))
+            try:
+                self.flush_batch()
+            except Exception as e:
+                logger.error(f"agent批次编码失败: {str(e)}")
+            if self.send_pending():
+                attempt = 0
+            else:
+                attempt += 1
+                logger.error(f"上报聚合器失败，{min(2 ** attempt, AGENT_RETRY_MAX_SECONDS)}秒后重试: "
+                             f"{self.last_error}")
+
+    def start(self):
+        """启动打包和发送线程"""
+        with self._start_lock:
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._send_loop, daemon=True)
+                self._sender.start()
+
+    def flush(self):
+        """退出前等待写入队列清空，并尝试发送剩余的数据"""
+        super().flush()
+        self.flush_batch()
+        self.send_pending()
+
+    def status(self):
+        with self.lock:
+            buffered = {table: len(rows) for table, rows in self.rows.items()}
+            pending = len(self.pending)
+            pending_bytes = sum(len(data) for data in self.pending)
+        return {
+            "aggregator": self.url,
+            "host": self.host_name,
+            "buffered_rows": buffered,
+            "pending_batches": pending,
+            "pending_bytes": pending_bytes,
+            "sent_batches": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "dropped_batches": self.dropped_batches,
+            "last_error": self.last_error,
+        }
+
+
+class FleetRegistry:
+    """
+    聚合器端的agent登记
+
+    记录每个主机最近一次上报的时间、健康状态和累计的批次、行数与字节数，
+    并按批次id去重(agent在超时后重发已写入的批次时不重复入库)。
+    """
+    RECENT_BATCHES = 256
+
+    def __init__(self):
+        self.hosts = {}
+        # 主机名 -> 该主机的仪表板快照构建器，有人查看时才创建
+        self.builders = {}
+        # dashboard角色中批次由collector写入，本进程收不到写入通知，构建器按该间隔(秒)重建
+        self.rebuild_interval = None
+        self.lock = threading.Lock()
+
+    def accept(self, host, batch_id, size, rows, status, address):
+        """登记一个批次，重复的批次返回False"""
+        with self.lock:
+            entry = self.hosts.setdefault(host, {
+                "batches": 0, "rows": 0, "bytes": 0, "duplicates": 0,
+                "recent": deque(maxlen=self.RECENT_BATCHES),
+            })
+            if batch_id and batch_id in entry['recent']:
+                entry['duplicates'] += 1
+                return False
+            if batch_id:
+                entry['recent'].append(batch_id)
+            entry['batches'] += 1
+            entry['rows'] += rows
+            entry['bytes'] += size
+            entry['status'] = status
+            entry['address'] = address
+            entry['last_seen'] = datetime.now().isoformat()
+        return True
+
+    def notify(self, host):
+        """新数据写入后通知该主机的快照构建器(若有人查看过)"""
+        builder = self.builders.get(host)
+        if builder is not None:
+            builder.notify()
+
+    def snapshots(self, host):
+        """返回某主机的仪表板快照构建器；None表示不区分主机的默认快照"""
+        if host is None:
+            return dashboard_snapshots
+        with self.lock:
+            builder = self.builders.get(host)
+            if builder is None:
+                builder = self.builders[host] = DashboardSnapshotBuilder(host)
+                if self.rebuild_interval:
+                    builder.run_periodic(self.rebuild_interval)
+            return builder
+
+    def status(self, host):
+        """某主机最近一次上报的健康状态，没有上报时返回None"""
+        with self.lock:
+            return self.hosts.get(host, {}).get('status')
+
+    def list(self, db):
+        """合并数据库中窗口内有数据的主机和本进程登记的agent"""
+        stored = db.get_hosts(DashboardSnapshotBuilder.HOURS)
+        with self.lock:
+            names = set(stored) | set(self.hosts)
+            result = []
+            for name in sorted(names):
+                entry = self.hosts.get(name, {})
+                last_sample, samples = stored.get(name, (None, 0))
+                result.append({
+                    "host": name,
+                    "local": name == '',
+                    "last_sample": last_sample,
+                    "samples": samples,
+                    "last_seen": entry.get('last_seen'),
+                    "address": entry.get('address'),
+                    "state": (entry.get('status') or {}).get('state'),
+                    "batches": entry.get('batches', 0),
+                    "rows": entry.get('rows', 0),
+                    "bytes": entry.get('bytes', 0),
+                    "duplicates": entry.get('duplicates', 0),
+                })
+        return result
+
+
+metrics_writer = MetricsWriter()
+fleet_registry = FleetRegistry()
+
+class CaptureStore:
+    """
+    采样流量存储
+
+    按CAPTURE_RATE等条件采样推理请求，把完整的请求和响应体放入队列，由后台线程逐条
+    压缩(有zstandard时用zstd，否则zlib)并追加到段文件，段文件达到CAPTURE_SEGMENT_BYTES
+    后轮转，总大小超过CAPTURE_MAX_BYTES时删除最旧的已关闭段。索引保存在同目录的SQLite中，
+    按request_uid(对应request_logs.request_uid)定位到段文件内的偏移。
+    队列满时直接丢弃，代理请求永远不等待采样写入。
+    """
+    INDEX_FILE = 'index.db'
+
+    def __init__(self, capture_dir=None, queue_size=1000):
+        self.capture_dir = capture_dir
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.segment = None
+        self.segment_size = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._rng = random.Random()
+
+    @property
+    def directory(self):
+        return self.capture_dir or CAPTURE_DIR
+
+    def should_capture(self, model_name, client_ip):
+        if not CAPTURE_RATE:
+            return False
+        if CAPTURE_MODELS is not None and model_name not in CAPTURE_MODELS:
+            return False
+        if CAPTURE_CLIENTS is not None and client_ip not in CAPTURE_CLIENTS:
+            return False
+        return self._rng.random() < CAPTURE_RATE
+
+    def submit(self, record):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, daemon=True)
+                    self._thread.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _connect(self):
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, self.INDEX_FILE), timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS capture_index (
+            request_uid TEXT PRIMARY KEY,
+            timestamp TEXT,
+            segment TEXT,
+            offset INTEGER,
+            length INTEGER,
+            codec TEXT,
+            model_name TEXT,
+            client_ip TEXT,
+            endpoint TEXT
+        )
+        ''')
+        return conn
+
+    @staticmethod
+    def _compress(data):
+        if zstandard is not None:
+            return 'zstd', zstandard.ZstdCompressor(level=3).compress(data)
+        return 'zlib', zlib.compress(data, 6)
+
+    @staticmethod
+    def _decompress(codec, data):
+        if codec == 'zstd':
+            if zstandard is None:
+                raise ValueError("zstandard is required to read this capture")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.error(f"采样数据写入失败: {str(e)}")
+
+    def _new_segment(self):
+        # 文件名带进程号，多个proxy进程可共用同一目录
+        name = f"segment-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}.cap"
+        self.segment = name
+        self.segment_size = 0
+
+    def write(self, records):
+        conn = self._connect()
+        try:
+            rows = []
+            for record in records:
+                if self.segment is None or self.segment_size >= CAPTURE_SEGMENT_BYTES:
+                    self._new_segment()
+                codec, blob = self._compress(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+                with open(os.path.join(self.directory, self.segment), 'ab') as f:
+                    f.write(blob)
+                rows.append((record['request_uid'], record['timestamp'], self.segment, self.segment_size,
+                             len(blob), codec, record['model_name'], record['client_ip'], record['endpoint']))
+                self.segment_size += len(blob)
+            conn.executemany('''
+            INSERT OR REPLACE INTO capture_index (
+                request_uid, timestamp, segment, offset, length, codec, model_name, client_ip, endpoint
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+            self._enforce_cap(conn)
+        finally:
+            conn.close()
+
+    def _enforce_cap(self, conn):
+        """
+        总大小超过CAPTURE_MAX_BYTES时从最旧的段开始删除
+
+        多个proxy进程共用目录时，每个进程号最新的段可能仍在被该进程追加，一律跳过；
+        段可能同时被其他进程删除，文件已不存在时忽略
+        """
+        sizes = {}
+        newest = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, 'segment-*.cap'))):
+            name = os.path.basename(path)
+            try:
+                sizes[name] = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            newest[name.rsplit('-', 1)[-1]] = name
+        live = set(newest.values()) | {self.segment}
+        total = sum(sizes.values())
+        for name, size in sizes.items():
+            if total <= CAPTURE_MAX_BYTES:
+                break
+            if name in live:
+                continue
+            total -= size
+            conn.execute('DELETE FROM capture_index WHERE segment = ?', (name,))
+            conn.commit()
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def get(self, request_uid):
+        """按request_uid读取一条采样记录，不存在(未采样或已轮转删除)时返回None"""
+        if not os.path.exists(os.path.join(self.directory, self.INDEX_FILE)):
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT segment, offset, length, codec FROM capture_index WHERE request_uid = ?',
+                (request_uid,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        segment, offset, length, codec = row
+        try:
+            with open(os.path.join(self.directory, segment), 'rb') as f:
+                f.seek(offset)
+                return json.loads(self._decompress(codec, f.read(length)))
+        except FileNotFoundError:
+            return None
+
+    def list(self, hours=24, limit=100):
+        """列出最近的采样记录索引"""
+        if not os.path.exists(os.path.join(self.directory, self.INDEX_FILE)):
+            return []
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute('''
+            SELECT request_uid, timestamp, model_name, client_ip, endpoint, length
+            FROM capture_index WHERE timestamp > ?
+            ORDER BY timestamp DESC LIMIT ?
+            ''', (OllamaMetricsDB._cutoff(hours), limit)).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+
+capture_store = CaptureStore()
+
+class SlidingWindowCounter:
+    """
+    两桶滑动窗口计数器
+
+    只保存当前桶和上一个桶的累计值，窗口内总量按上一个桶剩余的时间比例加权估算，
+    增加和查询都是O(1)。
+    """
+    __slots__ = ('window', 'start', 'current', 'previous')
+
+    def __init__(self, window):
+        self.window = window
+        self.start = 0.0
+        self.current = 0
+        self.previous = 0
+
+    def _roll(self, now):
+        bucket = now - now % self.window
+        if bucket != self.start:
+            self.previous = self.current if bucket - self.start == self.window else 0
+            self.current = 0
+            self.start = bucket
+
+    def add(self, amount, now, at=None):
+        """计入amount；at为发生时间(默认now)，用于从数据库恢复历史用量"""
+        self._roll(now)
+        at = now if at is None else at
+        if at >= self.start:
+            self.current += amount
+        elif at >= self.start - self.window:
+            self.previous += amount
+
+    def value(self, now):
+        self._roll(now)
+        return self.previous * (1 - (now - self.start) / self.window) + self.current
+
+    def retry_after(self, now, limit):
+        """估算多少秒后窗口内总量会降到limit以下"""
+        self._roll(now)
+        end = self.start + self.window - now
+        if self.current >= limit or not self.previous:
+            return end
+        # previous * (1 - t / window) + current < limit
+        t = self.window * (1 - (limit - self.current) / self.previous)
+        return max(t - (now - self.start), 0.0)
+
+
+class UsageLedger:
+    """
+    实时用量账本
+
+    在内存中按客户端维护分钟、小时、天三个滑动窗口的请求数和token数，用于在代理
+    转发前执行配额检查；按分钟聚合的明细定期批量写入usage_ledger表。
+    """
+    WINDOWS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+    def __init__(self, db=None):
+        self.db = db
+        self.clients = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self._flusher = None
+        self._primed = False
+
+    @staticmethod
+    def client_id(headers, remote_addr):
+        """Bearer密钥优先(只保存哈希)，否则使用客户端IP"""
+        auth = headers.get('Authorization', '')
+        if auth.lower().startswith('bearer ') and auth[7:].strip():
+            return 'key:' + hashlib.sha256(auth[7:].strip().encode()).hexdigest()[:16]
+        return remote_addr
+
+    @staticmethod
+    def enabled():
+        """是否配置了任何配额"""
+        configured = [*QUOTA_REQUESTS.values(), *QUOTA_TOKENS.values()]
+        return any(limit is not None for limit in configured) or bool(QUOTA_OVERRIDES)
+
+    @staticmethod
+    def limits(client):
+        override = QUOTA_OVERRIDES.get(client, {})
+        return {
+            'requests': {**QUOTA_REQUESTS, **override.get('requests', {})},
+            'tokens': {**QUOTA_TOKENS, **override.get('tokens', {})},
+        }
+
+    def _counters(self, client):
+        counters = self.clients.get(client)
+        if counters is None:
+            counters = {
+                (kind, window): SlidingWindowCounter(seconds)
+                for kind in ('requests', 'tokens')
+                for window, seconds in self.WINDOWS.items()
+            }
+            self.clients[client] = counters
+        return counters
+
+    def _prime(self):
+        """启动后首次使用时从数据库恢复最近一天的用量，避免重启即清零配额"""
+        self._primed = True
+        try:
+            rows = (self.db or OllamaMetricsDB()).get_usage(hours=48)
+        except Exception as e:
+            logger.error(f"恢复用量账本失败: {str(e)}")
+            return
+        now = time.time()
+        for row in rows:
+            at = datetime.fromisoformat(row['period_start']).timestamp()
+            counters = self._counters(row['client'])
+            tokens = (row['input_tokens'] or 0) + (row['output_tokens'] or 0)
+            for window in self.WINDOWS:
+                counters[('requests', window)].add(row['requests'] or 0, now, at)
+                counters[('tokens', window)].add(tokens, now, at)
+
+    def admit(self, client):
+        """
+        检查配额，通过时登记一次请求
+
+        返回:
+            (是否允许, 建议重试等待秒数, 拒绝原因)
+        """
+        now = time.time()
+        limits = self.limits(client)
+        with self.lock:
+            if not self._primed:
+                self._prime()
+            counters = self._counters(client)
+            for kind, windows in limits.items():
+                for window, limit in windows.items():
+                    if limit is None:
+                        continue
+                    counter = counters[(kind, window)]
+                    # 请求数按"再加一次"判断；token数在请求结束前未知，只能检查已用量
+                    used = counter.value(now) + (1 if kind == 'requests' else 0)
+                    if used > limit:
+                        return False, math.ceil(counter.retry_after(now, limit)), f"{kind} quota per {window} exceeded"
+            for window in self.WINDOWS:
+                counters[('requests', window)].add(1, now)
+        return True, 0, None
+
+    def record(self, client, model, input_tokens, output_tokens):
+        """请求结束后登记token用量"""
+        now = time.time()
+        period = datetime.fromtimestamp(now - now % 60).isoformat()
+        with self.lock:
+            counters = self._counters(client)
+            for window in self.WINDOWS:
+                counters[('tokens', window)].add(input_tokens + output_tokens, now)
+            entry = self.pending.setdefault((period, client, model or ''), [0, 0, 0])
+            entry[0] += 1
+            entry[1] += input_tokens
+            entry[2] += output_tokens
+        if self._flusher is None:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self.lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(USAGE_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """把待写入的分钟聚合提交给写入线程，并清理已空闲一天的客户端"""
+        now = time.time()
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            idle = [c for c, counters in self.clients.items()
+                    if not counters[('requests', 'day')].value(now) and not counters[('tokens', 'day')].value(now)]
+            for client in idle:
+                del self.clients[client]
+        if pending:
+            metrics_writer.submit('usage', [key + tuple(value) for key, value in pending.items()])
+
+    def snapshot(self):
+        """返回各客户端当前窗口内的用量估算和配额"""
+        now = time.time()
+        with self.lock:
+            if not self._primed:
+                self._prime()
+            result = []
+            for client, counters in self.clients.items():
+                usage = {
+                    kind: {window: round(counters[(kind, window)].value(now), 1) for window in self.WINDOWS}
+                    for kind in ('requests', 'tokens')
+                }
+                result.append({"client": client, "usage": usage, "limits": self.limits(client)})
+        return sorted(result, key=lambda c: c['usage']['tokens']['day'], reverse=True)
+
+
+usage_ledger = UsageLedger()
+
+class InflightRequest:
+    """一个正在代理中的推理请求；计数只由处理该请求的线程修改"""
+    __slots__ = ('uid', 'model', 'client', 'client_ip', 'endpoint', 'started', 'bytes', 'tokens', 'sampled_tokens')
+
+    def __init__(self, uid, model, client, client_ip, endpoint):
+        self.uid = uid
+        self.model = model
+        self.client = client
+        self.client_ip = client_ip
+        self.endpoint = endpoint
+        self.started = time.time()
+        self.bytes = 0
+        self.tokens = 0
+        self.sampled_tokens = 0
+
+    def add_chunk(self, size):
+        """流式响应每转发一行调用一次；Ollama每行输出一个token"""
+        self.bytes += size
+        self.tokens += 1
+
+    def to_dict(self, now):
+        elapsed = now - self.started
+        return {
+            "request_uid": self.uid,
+            "model_name": self.model,
+            "client": self.client,
+            "client_ip": self.client_ip,
+            "endpoint": self.endpoint,
+            "started": datetime.fromtimestamp(self.started).isoformat(),
+            "elapsed": round(elapsed, 3),
+            "bytes": self.bytes,
+            "tokens": self.tokens,
+            "tokens_per_sec": round(self.tokens / elapsed, 2) if elapsed > 0 else None,
+        }
+
+
+class ConcurrencyGauge:
+    """单个模型的并发计量：在途数对时间的积分、峰值以及本采样周期内的完成量"""
+    __slots__ = ('inflight', 'area', 'changed', 'peak', 'completed', 'tokens', 'latency', 'compute')
+
+    def __init__(self, now):
+        self.inflight = 0
+        self.area = 0.0
+        self.changed = now
+        self.peak = 0
+        self.completed = 0
+        self.tokens = 0
+        self.latency = 0.0
+        self.compute = 0.0
+
+    def advance(self, now):
+        self.area += self.inflight * (now - self.changed)
+        self.changed = now
+
+
+class InflightRegistry:
+    """
+    在途请求登记表
+
+    代理在转发推理请求时登记，流式响应逐行更新字节数和token数，/api/inflight 按
+    模型和客户端返回当前在途请求。每个采样周期把各模型的并发量(时间加权平均、峰值、
+    当前值)以及本周期内完成的请求数、输出token数、总耗时和Ollama报告的计算耗时写入
+    concurrency_metrics表，供 concurrency_stats 推算吞吐上限和排队情况。
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.last_sample = time.time()
+        self._thread = None
+
+    def _gauge(self, model, now):
+        gauge = self.gauges.get(model)
+        if gauge is None:
+            gauge = self.gauges[model] = ConcurrencyGauge(now)
+        return gauge
+
+    def begin(self, uid, model, client, client_ip, endpoint):
+        entry = InflightRequest(uid, model or '', client, client_ip, endpoint)
+        with self.lock:
+            gauge = self._gauge(entry.model, entry.started)
+            gauge.advance(entry.started)
+            gauge.inflight += 1
+            gauge.peak = max(gauge.peak, gauge.inflight)
+            self.requests[uid] = entry
+        return entry
+
+    def end(self, entry, result, size=None):
+        """
+        请求结束(成功、失败或客户端断开)时调用
+
+        参数:
+            result: Ollama最后返回的统计字段，失败时为空字典
+            size: 非流式响应的正文字节数
+        """
+        now = time.time()
+        if size is not None:
+            entry.bytes = size
+        if result.get('eval_count') and not entry.tokens:
+            entry.tokens = result['eval_count']
+        with self.lock:
+            if self.requests.pop(entry.uid, None) is None:
+                return
+            gauge = self._gauge(entry.model, now)
+            gauge.advance(now)
+            gauge.inflight -= 1
+            gauge.tokens += entry.tokens - entry.sampled_tokens
+            if result:
+                latency = now - entry.started
+                durations = [result.get(k) for k in ('load_duration', 'prompt_eval_duration', 'eval_duration')]
+                compute = sum(d or 0 for d in durations) / 1e9 if any(d is not None for d in durations) else latency
+                gauge.completed += 1
+                gauge.latency += latency
+                gauge.compute += min(compute, latency)
+
+    def snapshot(self):
+        """返回当前在途请求，以及按模型和客户端的汇总"""
+        now = time.time()
+        with self.lock:
+            entries = [entry.to_dict(now) for entry in self.requests.values()]
+        return self.summarize(entries, now)
+
+    @staticmethod
+    def merged(db, max_age):
+        """
+        合并各proxy进程发来的快照(dashboard角色使用)
+
+        快照之后经过的时间计入各请求的elapsed；max_age秒内没有更新的进程视为已退出。
+        """
+        now = time.time()
+        entries = []
+        for row in db.get_inflight_snapshots(max_age):
+            age = max(now - datetime.fromisoformat(row['timestamp']).timestamp(), 0.0)
+            for entry in json.loads(row['requests']):
+                entry['elapsed'] = round(entry['elapsed'] + age, 3)
+                entries.append(entry)
+        return InflightRegistry.summarize(entries, now)
+
+    @staticmethod
+    def summarize(entries, now):
+        entries.sort(key=lambda e: e['elapsed'], reverse=True)
+        models = {}
+        clients = {}
+        for entry in entries:
+            for groups, key in ((models, entry['model_name']), (clients, entry['client'])):
+                group = groups.setdefault(key, {"inflight": 0, "tokens": 0, "bytes": 0, "oldest": 0.0})
+                group['inflight'] += 1
+                group['tokens'] += entry['tokens']
+                group['bytes'] += entry['bytes']
+                group['oldest'] = max(group['oldest'], entry['elapsed'])
+        return {"timestamp": datetime.fromtimestamp(now).isoformat(), "inflight": len(entries),
+                "models": models, "clients": clients, "requests": entries}
+
+    def sample(self):
+        """结束一个采样周期，返回有活动的模型的计量行并重置周期计数"""
+        now = time.time()
+        rows = []
+        with self.lock:
+            interval = now - self.last_sample
+            self.last_sample = now
+            if interval <= 0:
+                return rows
+            # 在途请求已流出但尚未计入的token归入本周期
+            for entry in self.requests.values():
+                self._gauge(entry.model, now).tokens += entry.tokens - entry.sampled_tokens
+                entry.sampled_tokens = entry.tokens
+            for model, gauge in list(self.gauges.items()):
+                gauge.advance(now)
+                if not (gauge.inflight or gauge.area or gauge.completed or gauge.tokens):
+                    del self.gauges[model]
+                    continue
+                rows.append({
+                    "timestamp": datetime.fromtimestamp(now).isoformat(),
+                    "model_name": model,
+                    "interval": interval,
+                    "inflight": gauge.inflight,
+                    "avg_inflight": gauge.area / interval,
+                    "peak_inflight": gauge.peak,
+                    "completed": gauge.completed,
+                    "output_tokens": gauge.tokens,
+                    "latency_seconds": gauge.latency,
+                    "compute_seconds": gauge.compute,
+                })
+                gauge.area = 0.0
+                gauge.peak = gauge.inflight
+                gauge.completed = gauge.tokens = 0
+                gauge.latency = gauge.compute = 0.0
+        return rows
+
+    def start(self, interval=None):
+        """按采样间隔(默认MONITOR_INTERVAL)把计量行提交给写入线程"""
+        if self._thread is not None:
+            return
+        interval = interval or MONITOR_INTERVAL
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    for row in self.sample():
+                        metrics_writer.submit('concurrency_sample', row)
+                except Exception as e:
+                    logger.error(f"并发采样失败: {str(e)}")
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def publish(self, interval=None):
+        """
+        按间隔(默认INFLIGHT_PUBLISH_INTERVAL)把本进程的在途请求提交给写入线程
+
+        拆分部署时proxy进程调用，快照经collector写入inflight_snapshots，供dashboard合并。
+        没有在途请求时只在刚变空时提交一次。
+        """
+        interval = interval or INFLIGHT_PUBLISH_INTERVAL
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+
+        def loop():
+            published = False
+            while True:
+                time.sleep(interval)
+                try:
+                    now = time.time()
+                    with self.lock:
+                        entries = [entry.to_dict(now) for entry in self.requests.values()]
+                    if entries or published:
+                        metrics_writer.submit('inflight_snapshot', {
+                            "worker": worker,
+                            "timestamp": datetime.fromtimestamp(now).isoformat(),
+                            "requests": entries,
+                        })
+                    published = bool(entries)
+                except Exception as e:
+                    logger.error(f"提交在途请求快照失败: {str(e)}")
+        threading.Thread(target=loop, daemon=True).start()
+
+
+inflight_registry = InflightRegistry()
+
+class RequestTrace:
+    """
+    一个被采样的代理请求的追踪
+
+    各阶段在已知起止时间后直接记录为span，请求结束时一次性交给导出队列。
+    """
+    SERVER, INTERNAL, CLIENT = 2, 1, 3
+
+    def __init__(self, trace_id, parent_id, name, start_ns):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = start_ns
+        self.attributes = {}
+        self.spans = []
+
+    def new_span_id(self):
+        return os.urandom(8).hex()
+
+    def traceparent(self, span_id):
+        """传给上游的W3C traceparent，父span为代理到Ollama的客户端span"""
+        return f"00-{self.trace_id}-{span_id}-01"
+
+    def span(self, name, start_ns, end_ns, parent_id=None, kind=INTERNAL, span_id=None, attributes=None, error=None):
+        self.spans.append({
+            "traceId": self.trace_id,
+            "spanId": span_id or self.new_span_id(),
+            "parentSpanId": parent_id or self.span_id,
+            "name": name,
+            "kind": kind,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(max(end_ns, start_ns)),
+            "attributes": otlp_attributes(attributes or {}),
+            "status": {"code": 2, "message": error} if error else {"code": 0},
+        })
+
+    def ollama_phases(self, result, end_ns, parent_id):
+        """
+        按Ollama返回的load_duration、prompt_eval_duration、eval_duration合成子span
+
+        三个阶段依次执行并在最后一个chunk到达时结束，从结束时间向前排列。
+        """
+        cursor = end_ns
+        for key, name in (('eval_duration', 'ollama.eval'), ('prompt_eval_duration', 'ollama.prompt_eval'),
+                          ('load_duration', 'ollama.load')):
+            duration = result.get(key)
+            if not duration:
+                continue
+            attributes = {}
+            if key == 'eval_duration':
+                attributes['gen_ai.usage.output_tokens'] = result.get('eval_count', 0)
+            elif key == 'prompt_eval_duration':
+                attributes['gen_ai.usage.input_tokens'] = result.get('prompt_eval_count', 0)
+            self.span(name, cursor - int(duration), cursor, parent_id, attributes=attributes)
+            cursor -= int(duration)
+
+    def finish(self, end_ns, status_code):
+        self.attributes['http.response.status_code'] = status_code
+        self.span(self.name, self.start_ns, end_ns, self.parent_id, kind=self.SERVER, span_id=self.span_id,
+                  attributes=self.attributes, error=f"HTTP {status_code}" if status_code >= 500 else None)
+        # 根span的parentSpanId为上游传入的span或空
+        if not self.parent_id:
+            self.spans[-1].pop('parentSpanId')
+        span_exporter.submit(self.spans)
+
+
+def otlp_attributes(attributes):
+    """把字典转换为OTLP JSON的KeyValue列表"""
+    result = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed})
+    return result
+
+
+class SpanExporter:
+    """
+    OTLP/HTTP JSON span导出
+
+    请求结束时span放入有界队列，后台线程攒够TRACE_BATCH_SIZE个或等待
+    TRACE_FLUSH_INTERVAL秒后一次POST到TRACE_ENDPOINT；队列满或导出失败时丢弃并计数，
+    追踪不影响代理请求。
+    """
+    # W3C Trace Context: version-trace_id-parent_id-flags，均为小写十六进制
+    TRACEPARENT_RE = re.compile(r'^[0-9a-f]{2}-[0-9a-f]{32}-[0-9a-f]{16}-[0-9a-f]{2}$')
+
+    def __init__(self):
+        self.queue = queue.Queue(TRACE_QUEUE_SIZE)
+        self.session = requests.Session()
+        self.exported = 0
+        self.dropped = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start_trace(self, headers, name, start_ns=None):
+        """
+        按头部采样决定是否追踪该请求，返回RequestTrace或None
+
+        请求带有合法traceparent时沿用其trace id并遵循其采样标志，否则按TRACE_SAMPLE_RATE采样。
+        格式不符、版本为ff或trace id/parent id全为0的traceparent视为不存在，开始新的trace。
+        """
+        if not TRACE_ENDPOINT:
+            return None
+        parent = headers.get('traceparent', '').strip()
+        if self.TRACEPARENT_RE.match(parent):
+            version, trace_id, parent_id, flags = parent.split('-')
+            if version != 'ff' and trace_id != '0' * 32 and parent_id != '0' * 16:
+                if not int(flags, 16) & 1:
+                    return None
+                return RequestTrace(trace_id, parent_id, name, start_ns or time.time_ns())
+        if random.random() >= TRACE_SAMPLE_RATE:
+            return None
+        return RequestTrace(os.urandom(16).hex(), None, name, start_ns or time.time_ns())
+
+    def submit(self, spans):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, daemon=True)
+                    self._thread.start()
+        for span in spans:
+            try:
+                self.queue.put_nowait(span)
+            except queue.Full:
+                self.dropped += 1
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + TRACE_FLUSH_INTERVAL
+            while len(batch) < TRACE_BATCH_SIZE:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.export(batch)
+
+    def export(self, spans):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({"service.name": TRACE_SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "ollama_monitor"}, "spans": spans}],
+        }]}
+        try:
+            response = self.session.post(TRACE_ENDPOINT, json=payload, headers=TRACE_HEADERS, timeout=10)
+            response.raise_for_status()
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            logger.error(f"span导出失败，已丢弃{len(spans)}个: {str(e)}")
+
+    def stats(self):
+        return {"enabled": bool(TRACE_ENDPOINT), "sample_rate": TRACE_SAMPLE_RATE, "queued": self.queue.qsize(),
+                "exported": self.exported, "dropped": self.dropped}
+
+
+span_exporter = SpanExporter()
+
+class FastJSONProvider(DefaultJSONProvider):
+    """安装了orjson时用它序列化jsonify的结果，遇到不支持的类型时退回标准库"""
+    ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            try:
+                return orjson.dumps(obj, option=self.ORJSON_OPTIONS).decode()
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, option=self.ORJSON_OPTIONS)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class HealthProber:
+    """
+    Ollama健康探测器
+
+    独立线程用轻量的 /api/version 接口和短超时定期探测，维护 up/degraded/down 三种状态：
+    首次失败或响应变慢即进入degraded并切换到快速探测；连续失败HEALTH_FAIL_THRESHOLD次
+    判定为down；连续正常HEALTH_RECOVER_THRESHOLD次才恢复为up，避免状态来回抖动。
+    状态变化写入health_events表，/api/status 和代理直接读取缓存的状态。
+    """
+    UNKNOWN, UP, DEGRADED, DOWN = 'unknown', 'up', 'degraded', 'down'
+
+    def __init__(self, host=None):
+        self.host = host
+        self.state = self.UNKNOWN
+        self.since = time.time()
+        self.last_check = None
+        self.latency = None
+        self.reason = None
+        self.failures = 0
+        self.successes = 0
+        self.session = requests.Session()
+        # 多进程部署时只由collector记录状态变化，避免重复事件
+        self.record_events = True
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"健康探测异常: {str(e)}")
+            time.sleep(HEALTH_INTERVAL if self.state == self.UP else HEALTH_FAST_INTERVAL)
+
+    def probe(self):
+        """
+        执行一次探测
+
+        返回:
+            (结果 'ok'/'slow'/'fail', 耗时秒数, 原因)
+        """
+        start = time.time()
+        try:
+            response = self.session.get(f"{self.host or OLLAMA_HOST}/api/version", timeout=HEALTH_TIMEOUT)
+            latency = time.time() - start
+            if response.status_code != 200:
+                return 'fail', latency, f"HTTP {response.status_code}"
+            if latency > HEALTH_SLOW_SECONDS:
+                return 'slow', latency, f"slow response {latency * 1000:.0f} ms"
+            return 'ok', latency, None
+        except requests.RequestException as e:
+            return 'fail', time.time() - start, type(e).__name__
+
+    def check(self):
+        """探测一次并按滞回规则更新状态"""
+        result, latency, reason = self.probe()
+        self.last_check = time.time()
+        self.latency = latency
+        if result == 'fail':
+            self.failures += 1
+            self.successes = 0
+        elif result == 'slow':
+            self.failures = 0
+            self.successes = 0
+        else:
+            self.failures = 0
+            self.successes += 1
+
+        state = self.state
+        if state == self.UNKNOWN:
+            # 启动时的第一次探测直接确定状态
+            state = {'ok': self.UP, 'slow': self.DEGRADED, 'fail': self.DOWN}[result]
+        elif result == 'fail':
+            if state == self.DOWN or self.failures >= HEALTH_FAIL_THRESHOLD:
+                state = self.DOWN
+            else:
+                state = self.DEGRADED
+        elif result == 'slow':
+            state = self.DEGRADED
+        elif state != self.UP:
+            state = self.UP if self.successes >= HEALTH_RECOVER_THRESHOLD else self.DEGRADED
+        self._transition(state, reason)
+
+    def _transition(self, state, reason):
+        if state == self.state:
+            return
+        previous, self.state = self.state, state
+        self.since = time.time()
+        self.reason = reason
+        logger.info(f"Ollama状态变化: {previous} -> {state}" + (f" ({reason})" if reason else ""))
+        if self.record_events:
+            metrics_writer.submit('health_event', {
+                "timestamp": datetime.now().isoformat(),
+                "previous_state": previous,
+                "state": state,
+                "reason": reason,
+                "latency": self.latency
+            })
+
+    def is_down(self):
+        return self.state == self.DOWN
+
+    def status(self):
+        """返回缓存的健康状态，首次调用时启动探测线程"""
+        self.start()
+        return {
+            "server_status": self.state in (self.UP, self.DEGRADED),
+            "state": self.state,
+            "since": datetime.fromtimestamp(self.since).isoformat(),
+            "last_check": datetime.fromtimestamp(self.last_check).isoformat() if self.last_check else None,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "reason": self.reason,
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+health_prober = HealthProber()
+
+class ModelPreloader:
+    """
+    模型预加载与keep_alive管理
+
+    从request_logs学习各模型按一天中小时分布的到达率和相邻请求的间隔，按泊松近似估计
+    未来PRELOAD_HORIZON秒内至少有一个请求的概率。按预计请求数从高到低在显存预算内
+    依次分配：预算内的模型keep_alive按典型请求间隔延长，预算外的模型缩短以腾出显存；
+    预算内、概率足够高但尚未加载的模型用空提示词提前加载。预加载之后的第一个请求
+    没有冷加载时记为一次避免的冷加载。
+    """
+
+    def __init__(self, host=None):
+        self.host = host
+        self.session = requests.Session()
+        self.plan = {}
+        self.budget_mb = None
+        self.planned_at = None
+        # 已预加载、等待第一个请求验证的模型 -> 预加载事件
+        self.pending = {}
+        self.counts = {}
+        # 多进程部署时只由collector预加载，其他进程只计算keep_alive
+        self.issue_preloads = True
+        # agent没有本地数据库和请求历史，不计划也不调整keep_alive
+        self.enabled = True
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """启动计划线程；预加载和keep_alive策略都未启用时不启动"""
+        if not (self.enabled and (PRELOAD_ENABLED or KEEP_ALIVE_POLICY)):
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"模型预加载异常: {str(e)}")
+            time.sleep(PRELOAD_INTERVAL)
+
+    @staticmethod
+    def expected_requests(hourly, start, seconds):
+        """按各小时的到达率(每小时请求数)累计 [start, start + seconds) 内的预计请求数"""
+        total = 0.0
+        t = start
+        end = start + seconds
+        while t < end:
+            moment = datetime.fromtimestamp(t)
+            hour_end = t + 3600 - (moment.minute * 60 + moment.second + moment.microsecond / 1e6)
+            step = min(hour_end, end) - t
+            total += hourly[moment.hour] * step / 3600
+            t += step
+        return total
+
+    def learn(self, db):
+        """
+        学习各模型的请求规律
+
+        返回:
+            {模型: {"hourly": 24个小时的平均每小时请求数, "gap": 典型请求间隔(秒)}}
+        """
+        rows = db.get_request_arrivals(PRELOAD_HISTORY_DAYS * 24)
+        if not rows:
+            return {}
+        first = datetime.fromisoformat(rows[0][0]).timestamp()
+        days = max((time.time() - first) / 86400, 1.0)
+        counts = {}
+        arrivals = {}
+        for timestamp, model_name in rows:
+            counts.setdefault(model_name, [0] * 24)[int(timestamp[11:13])] += 1
+            arrivals.setdefault(model_name, []).append(datetime.fromisoformat(timestamp).timestamp())
+        profiles = {}
+        for model_name, hourly in counts.items():
+            times = arrivals[model_name]
+            # 超过KEEP_ALIVE_MAX的间隔视为一段使用已经结束，不参与典型间隔的估计
+            gaps = sorted(b - a for a, b in zip(times, times[1:]) if b - a <= KEEP_ALIVE_MAX)
+            profiles[model_name] = {
+                "hourly": [c / days for c in hourly],
+                "gap": gaps[int(len(gaps) * 0.9)] if gaps else None,
+            }
+        return profiles
+
+    def _get(self, path):
+        response = self.session.get(f"{self.host or OLLAMA_HOST}{path}", timeout=HEALTH_TIMEOUT * 5)
+        response.raise_for_status()
+        return response.json().get('models', [])
+
+    def _budget_mb(self, db):
+        if VRAM_BUDGET_MB is not None:
+            return VRAM_BUDGET_MB
+        gpu = db.get_recent_gpu_metrics(1)
+        if gpu and gpu[-1].get('gpu_memory_total'):
+            return gpu[-1]['gpu_memory_total'] * 0.9
+        return None
+
+    def refresh(self, db=None):
+        """
+        重新计算预加载计划
+
+        返回:
+            (计划, 已加载模型 -> 占用显存MiB)
+        """
+        db = db or OllamaMetricsDB()
+        profiles = self.learn(db)
+        loaded = {m['name']: (m.get('size_vram') or m.get('size') or 0) / 2 ** 20 for m in self._get('/api/ps')}
+        sizes = {m['name']: (m.get('size') or 0) / 2 ** 20 for m in self._get('/api/tags')}
+        budget = self._budget_mb(db)
+        now = time.time()
+
+        plan = {}
+        for model_name, profile in profiles.items():
+            expected = self.expected_requests(profile['hourly'], now, PRELOAD_HORIZON)
+            plan[model_name] = {
+                "model_name": model_name,
+                "expected_requests": round(expected, 3),
+                "probability": round(1 - math.exp(-expected), 3),
+                "typical_gap": profile['gap'],
+                "size_mb": round(loaded.get(model_name) or sizes.get(model_name) or 0, 1),
+                "loaded": model_name in loaded,
+                "in_budget": False,
+                "keep_alive": KEEP_ALIVE_MIN,
+            }
+        used = 0.0
+        for entry in sorted(plan.values(), key=lambda e: e['expected_requests'], reverse=True):
+            if entry['expected_requests'] <= 0:
+                break
+            if budget is not None and used + entry['size_mb'] > budget:
+                continue
+            used += entry['size_mb']
+            entry['in_budget'] = True
+            gap = entry['typical_gap'] or KEEP_ALIVE_MIN
+            entry['keep_alive'] = int(min(max(gap * 1.5, KEEP_ALIVE_MIN), KEEP_ALIVE_MAX))
+
+        self.plan = plan
+        self.budget_mb = budget
+        self.planned_at = now
+        return plan, loaded
+
+    def keep_alive_for(self, model_name):
+        """代理请求使用的keep_alive(秒)；未启用或没有该模型的历史时返回None"""
+        if not (KEEP_ALIVE_POLICY and self.enabled):
+            return None
+        if self._thread is None:
+            self.start()
+        entry = self.plan.get(model_name)
+        return entry['keep_alive'] if entry else None
+
+    def tick(self):
+        """更新计划；负责预加载的进程还会验证之前的预加载并加载新的模型"""
+        db = OllamaMetricsDB()
+        plan, loaded = self.refresh(db)
+        if not (PRELOAD_ENABLED and self.issue_preloads):
+            return
+        self.evaluate(db)
+        used = sum(loaded.values())
+        budget = self.budget_mb
+        for entry in sorted(plan.values(), key=lambda e: e['probability'], reverse=True):
+            if (entry['loaded'] or not entry['in_budget'] or entry['model_name'] in self.pending
+                    or entry['probability'] < PRELOAD_MIN_PROBABILITY):
+                continue
+            if budget is not None and used + entry['size_mb'] > budget:
+                continue
+            if self.preload(entry):
+                used += entry['size_mb']
+
+    def preload(self, entry):
+        """用空提示词加载模型，返回是否成功"""
+        model_name = entry['model_name']
+        event = {
+            "timestamp": datetime.now().isoformat(),
+            "model_name": model_name,
+            "probability": entry['probability'],
+        }
+        try:
+            # 空提示词只加载模型不生成；embedding模型不支持generate时改用embed接口
+            payload = {"model": model_name, "prompt": "", "stream": False, "keep_alive": entry['keep_alive']}
+            response = self.session.post(f"{self.host or OLLAMA_HOST}/api/generate", json=payload, timeout=300)
+            if response.status_code == 400:
+                payload = {"model": model_name, "input": "", "keep_alive": entry['keep_alive']}
+                response = self.session.post(f"{self.host or OLLAMA_HOST}/api/embed", json=payload, timeout=300)
+            response.raise_for_status()
+            load_duration = response.json().get('load_duration')
+            event.update(event='preload', load_duration=load_duration / 1e9 if load_duration is not None else None,
+                         detail=f"keep_alive={entry['keep_alive']}s")
+            self.pending[model_name] = event
+            logger.info(f"已预加载模型 {model_name} (预计请求概率 {entry['probability']:.0%})")
+        except (requests.RequestException, ValueError) as e:
+            event.update(event='failed', detail=str(e))
+            logger.error(f"预加载模型 {model_name} 失败: {str(e)}")
+        self._record(event)
+        return event['event'] == 'preload'
+
+    def evaluate(self, db):
+        """检查预加载后的第一个请求：没有冷加载记为avoided，仍然冷加载记为missed，一直没有请求记为unused"""
+        for model_name, preload in list(self.pending.items()):
+            first = db.get_first_request_after(model_name, preload['timestamp'])
+            if first is not None:
+                cold = (first['load_duration'] or 0) > COLD_LOAD_SECONDS
+                event = 'missed' if cold else 'avoided'
+                detail = f"first request at {first['timestamp']}"
+            elif time.time() - datetime.fromisoformat(preload['timestamp']).timestamp() > 2 * PRELOAD_HORIZON:
+                event, detail = 'unused', None
+            else:
+                continue
+            del self.pending[model_name]
+            self._record({
+                "timestamp": datetime.now().isoformat(),
+                "model_name": model_name,
+                "event": event,
+                "probability": preload['probability'],
+                "load_duration": first['load_duration'] if first else None,
+                "detail": detail
+            })
+
+    def _record(self, event):
+        self.counts[event['event']] = self.counts.get(event['event'], 0) + 1
+        metrics_writer.submit('preload_event', event)
+
+    def status(self):
+        """返回当前计划，只读取状态"""
+        return {
+            "preload_enabled": PRELOAD_ENABLED and self.issue_preloads,
+            "keep_alive_policy": KEEP_ALIVE_POLICY,
+            "budget_mb": self.budget_mb,
+            "planned_at": datetime.fromtimestamp(self.planned_at).isoformat() if self.planned_at else None,
+            "models": sorted(self.plan.values(), key=lambda e: e['expected_requests'], reverse=True),
+            "pending": list(self.pending.values()),
+            "counts": dict(self.counts),
+        }
+
+
+model_preloader = ModelPreloader()
+
+class EwmaBaseline:
+    """指数加权的均值和方差，每个样本O(1)更新，不保存历史样本"""
+    __slots__ = ('mean', 'var', 'count')
+
+    def __init__(self):
+        self.mean = None
+        self.var = 0.0
+        self.count = 0
+
+    def std(self, floor=0.0):
+        return max(math.sqrt(self.var), floor)
+
+    def score(self, value, floor=0.0):
+        """返回value相对当前基线的z分数，样本不足时返回None；floor为标准差下限"""
+        std = self.std(floor)
+        if self.count < ANOMALY_WARMUP or std <= 0:
+            return None
+        return (value - self.mean) / std
+
+    def update(self, value, alpha):
+        self.count += 1
+        if self.mean is None:
+            self.mean = value
+            return
+        diff = value - self.mean
+        incr = alpha * diff
+        self.mean += incr
+        self.var = (1 - alpha) * (self.var + diff * incr)
+
+
+class AnomalyDetector:
+    """
+    流式异常检测
+
+    每个序列(指标+模型或GPU名称)维护一个EWMA基线，样本到达时先按z分数判断再更新基线。
+    超过阈值的样本截断到阈值处再计入基线，单个离群点不会把基线拉偏，持续的水平变化
+    仍会被逐步吸收。同一序列在ANOMALY_COOLDOWN秒内只记录一次事件。
+    """
+    # 指标 -> (需要报警的方向, 是否按对数计算, 标准差下限)
+    # 耗时和速率是右偏分布，取对数后更接近正态；标准差下限避免整数读数或长时间不变的
+    # 序列因方差接近0而把微小变化判为异常(对数序列的0.05约为5%)
+    METRICS = {
+        'tokens_per_sec': ('low', True, 0.05),
+        'time_per_token': ('high', True, 0.05),
+        'gpu_temperature': ('high', False, 1.0),
+        'gpu_power_draw': ('both', False, 5.0),
+        'ollama_memory_percent': ('high', False, 0.5),
+    }
+
+    def __init__(self):
+        self.baselines = {}
+        self.last_event = {}
+        self.lock = threading.Lock()
+
+    def observe(self, metric, label, value):
+        """
+        计入一个样本
+
+        返回:
+            检测到异常时返回事件，否则返回None
+        """
+        if not ANOMALY_ENABLED or value is None:
+            return None
+        direction, log, floor = self.METRICS[metric]
+        if log and value <= 0:
+            return None
+        x = math.log(value) if log else float(value)
+        key = (metric, label or '')
+        threshold = ANOMALY_Z_THRESHOLD
+        with self.lock:
+            baseline = self.baselines.get(key)
+            if baseline is None:
+                baseline = self.baselines[key] = EwmaBaseline()
+            z = baseline.score(x, floor)
+            mean = baseline.mean
+            if z is not None and abs(z) > threshold:
+                x = mean + math.copysign(threshold * baseline.std(floor), z)
+            baseline.update(x, ANOMALY_ALPHA)
+            if z is None or abs(z) < threshold or direction == ('low' if z > 0 else 'high'):
+                return None
+            now = time.time()
+            if now - self.last_event.get(key, 0) < ANOMALY_COOLDOWN:
+                return None
+            self.last_event[key] = now
+        event = {
+            "timestamp": datetime.now().isoformat(),
+            "metric": metric,
+            "label": label or '',
+            "value": value,
+            "baseline": math.exp(mean) if log else mean,
+            "zscore": round(z, 2),
+            "direction": 'high' if z > 0 else 'low'
+        }
+        logger.warning(f"检测到异常: {metric}" + (f"[{label}]" if label else "") +
+                       f" = {value:.4g}，基线 {event['baseline']:.4g}，z = {event['zscore']}")
+        metrics_writer.submit('anomaly_event', event)
+        return event
+
+    def observe_inference(self, model_name, response_time, result):
+        """
+        计入一次推理请求的每输出token耗时和生成速率
+
+        总耗时随输出长度变化，长回答会被误判为变慢，因此按输出token数归一化后再建立基线。
+        """
+        eval_count = result.get('eval_count')
+        self.observe('time_per_token', model_name, response_time / max(eval_count or 0, 1))
+        eval_duration = result.get('eval_duration')
+        if eval_count and eval_duration:
+            self.observe('tokens_per_sec', model_name, eval_count / (eval_duration / 1e9))
+
+    def baselines_state(self):
+        """返回各序列当前的基线"""
+        with self.lock:
+            items = list(self.baselines.items())
+        result = []
+        for (metric, label), baseline in items:
+            if baseline.mean is None:
+                continue
+            _, log, floor = self.METRICS[metric]
+            std = baseline.std(floor)
+            result.append({
+                "metric": metric,
+                "label": label,
+                "samples": baseline.count,
+                "baseline": math.exp(baseline.mean) if log else baseline.mean,
+                # 对数序列给出乘性的标准差倍数
+                "spread": math.exp(std) if log else std,
+                "ready": baseline.count >= ANOMALY_WARMUP
+            })
+        return result
+
+
+anomaly_detector = AnomalyDetector()
+
+class SeriesWindow:
+    """
+    单个序列的滑动时间窗口
+
+    按到达顺序保存 (时间, 值)，同时维护有序的值列表和累计和，窗口内的计数、均值、
+    极值和分位数都可以直接读取；过期样本在写入和读取时从队首移除。
+    """
+    __slots__ = ('span', 'samples', 'ordered', 'total')
+
+    def __init__(self, span):
+        self.span = span
+        self.samples = deque()
+        self.ordered = []
+        self.total = 0.0
+
+    def add(self, at, value):
+        self.samples.append((at, value))
+        insort(self.ordered, value)
+        self.total += value
+        self.expire(at)
+
+    def expire(self, now):
+        cutoff = now - self.span
+        while self.samples and self.samples[0][0] <= cutoff:
+            _, value = self.samples.popleft()
+            del self.ordered[bisect_left(self.ordered, value)]
+            self.total -= value
+
+    def stat(self, name):
+        """计算窗口内的统计值(调用前先expire)；窗口为空时count/rate/sum为0，其他统计为None"""
+        n = len(self.ordered)
+        if name == 'count':
+            return n
+        if name == 'rate':
+            return n / self.span
+        if name == 'sum':
+            return self.total
+        if not n:
+            return None
+        if name == 'last':
+            return self.samples[-1][1]
+        if name == 'avg':
+            return self.total / n
+        if name == 'min':
+            return self.ordered[0]
+        if name == 'max':
+            return self.ordered[-1]
+        # pNN：最近秩分位数
+        return self.ordered[max(math.ceil(float(name[1:]) / 100 * n) - 1, 0)]
+
+
+class AlertRule:
+    """
+    一条告警规则
+
+    规则以字典配置，例如:
+        {'name': 'slow-llama', 'metric': 'response_time', 'label': 'llama3.2:3b',
+         'stat': 'p95', 'window': 300, 'op': '>', 'threshold': 10, 'for': 300}
+    label为None时对该指标的每个模型或GPU分别判断。
+    """
+    OPS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+           '==': operator.eq, '!=': operator.ne}
+    STATS = ('last', 'avg', 'min', 'max', 'count', 'rate', 'sum')
+    __slots__ = ('name', 'metric', 'label', 'stat', 'window', 'op', 'compare', 'threshold',
+                 'duration', 'repeat', 'severity')
+
+    def __init__(self, config):
+        self.name = config['name']
+        self.metric = config['metric']
+        self.label = config.get('label')
+        self.stat = config.get('stat', 'last')
+        self.window = float(config.get('window', 60))
+        self.op = config.get('op', '>')
+        self.threshold = float(config['threshold'])
+        self.duration = float(config.get('for', 0))
+        self.repeat = config.get('repeat')
+        self.severity = config.get('severity', 'warning')
+        if self.op not in self.OPS:
+            raise ValueError(f"unknown operator: {self.op}")
+        if self.stat not in self.STATS and not (self.stat.startswith('p') and 0 <= float(self.stat[1:]) <= 100):
+            raise ValueError(f"unknown stat: {self.stat}")
+        if self.window <= 0:
+            raise ValueError("window must be positive")
+        self.compare = self.OPS[self.op]
+
+    def describe(self):
+        return {
+            "name": self.name, "metric": self.metric, "label": self.label, "stat": self.stat,
+            "window": self.window, "op": self.op, "threshold": self.threshold, "for": self.duration,
+            "repeat": self.repeat, "severity": self.severity
+        }
+
+
+class AlertEngine:
+    """
+    告警规则引擎
+
+    样本到达时只写入规则用到的内存窗口(每个指标、标签和窗口长度一个)，评估时直接读取
+    窗口统计，不查询SQLite。条件持续满足for秒后触发(firing)，同一告警在恢复(resolved)
+    之前不重复通知(除非设置了repeat秒)；通知写入alert_events表并交给投递队列。
+    """
+
+    def __init__(self):
+        self.rules = None
+        # 指标 -> 规则用到的窗口长度
+        self.spans = {}
+        # (指标, 窗口长度) -> {标签: SeriesWindow}
+        self.series = {}
+        # 规则名 -> {标签: 告警状态}
+        self.active = {}
+        self.lock = threading.Lock()
+
+    def load_rules(self, configs):
+        """解析规则；无效的规则记录日志后跳过"""
+        rules = []
+        for config in configs:
+            try:
+                rules.append(AlertRule(config))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"无效的告警规则 {config}: {str(e)}")
+        with self.lock:
+            self.rules = rules
+            self.spans = {}
+            for rule in rules:
+                spans = self.spans.setdefault(rule.metric, [])
+                if rule.window not in spans:
+                    spans.append(rule.window)
+            self.series = {key: labels for key, labels in self.series.items() if key[1] in self.spans.get(key[0], ())}
+            self.active = {}
+
+    def _ensure_rules(self):
+        if self.rules is None:
+            self.load_rules(ALERT_RULES)
+
+    def observe(self, metric, label, value, at=None):
+        """计入一个样本；没有规则用到该指标时直接返回"""
+        if self.rules is None:
+            self._ensure_rules()
+        spans = self.spans.get(metric)
+        if not spans or value is None:
+            return
+        at = time.time() if at is None else at
+        value = float(value)
+        with self.lock:
+            for span in spans:
+                labels = self.series.setdefault((metric, span), {})
+                window = labels.get(label or '')
+                if window is None:
+                    window = labels[label or ''] = SeriesWindow(span)
+                window.add(at, value)
+
+    def evaluate(self, now=None):
+        """
+        评估全部规则
+
+        每个窗口先统一移除过期样本，多条规则共用的统计值只计算一次。
+        返回:
+            本次产生的通知(触发、重复或恢复)
+        """
+        self._ensure_rules()
+        now = time.time() if now is None else now
+        notifications = []
+        with self.lock:
+            for labels in self.series.values():
+                for window in labels.values():
+                    window.expire(now)
+            cache = {}
+            for rule in self.rules:
+                labels = self.series.get((rule.metric, rule.window), {})
+                if rule.label is not None:
+                    windows = ((rule.label, labels[rule.label]),) if rule.label in labels else ()
+                else:
+                    windows = labels.items()
+                active = self.active.setdefault(rule.name, {})
+                for label, window in windows:
+                    key = (id(window), rule.stat)
+                    value = cache.get(key, cache)
+                    if value is cache:
+                        value = cache[key] = window.stat(rule.stat)
+                    if value is not None and rule.compare(value, rule.threshold):
+                        self._condition_met(rule, active, label, value, now, notifications)
+                    elif label in active:
+                        self._condition_cleared(rule, active, label, value, now, notifications)
+                # 窗口已经不存在的标签按条件不满足处理
+                if active and len(active) > len(windows):
+                    for label in [label for label in active if label not in labels]:
+                        self._condition_cleared(rule, active, label, None, now, notifications)
+        for event in notifications:
+            self._notify(event)
+        return notifications
+
+    def _condition_met(self, rule, active, label, value, now, notifications):
+        alert = active.get(label)
+        if alert is None:
+            alert = active[label] = {"rule": rule, "label": label, "since": now, "state": 'pending',
+                                     "notified_at": None}
+        alert['value'] = value
+        if alert['state'] == 'pending' and now - alert['since'] >= rule.duration:
+            alert['state'] = 'firing'
+            alert['notified_at'] = now
+            notifications.append(self._event(alert, 'firing', now))
+        elif alert['state'] == 'firing' and rule.repeat and now - alert['notified_at'] >= rule.repeat:
+            alert['notified_at'] = now
+            notifications.append(self._event(alert, 'firing', now))
+
+    def _condition_cleared(self, rule, active, label, value, now, notifications):
+        alert = active.pop(label, None)
+        if alert is not None and alert['state'] == 'firing':
+            alert['value'] = value
+            notifications.append(self._event(alert, 'resolved', now))
+
+    @staticmethod
+    def _event(alert, state, now):
+        rule = alert['rule']
+        value = alert['value']
+        target = rule.metric + (f"[{alert['label']}]" if alert['label'] else '')
+        if state == 'resolved':
+            summary = f"{rule.name} resolved: " + (f"{rule.stat}({target}) = {value:.4g}" if value is not None
+                                                  else f"{target} has no recent samples")
+        else:
+            summary = f"{rule.name}: {rule.stat}({target}) = {value:.4g} {rule.op} {rule.threshold:g}"
+        return {
+            "timestamp": datetime.fromtimestamp(now).isoformat(),
+            "rule": rule.name,
+            "label": alert['label'],
+            "state": state,
+            "severity": rule.severity,
+            "metric": rule.metric,
+            "stat": rule.stat,
+            "value": value,
+            "op": rule.op,
+            "threshold": rule.threshold,
+            "since": datetime.fromtimestamp(alert['since']).isoformat(),
+            "summary": summary
+        }
+
+    def _notify(self, event):
+        logger.warning(f"告警 {event['state']}: {event['summary']}")
+        metrics_writer.submit('alert_event', event)
+        alert_outbox.enqueue(event)
+
+    def status(self):
+        self._ensure_rules()
+        with self.lock:
+            active = [{
+                "rule": alert['rule'].name,
+                "label": alert['label'],
+                "state": alert['state'],
+                "value": alert.get('value'),
+                "since": datetime.fromtimestamp(alert['since']).isoformat()
+            } for alerts in self.active.values() for alert in alerts.values()]
+            rules = [rule.describe() for rule in self.rules]
+        return {"rules": rules, "active": active, "outbox": alert_outbox.stats()}
+
+
+class AlertOutbox:
+    """
+    告警投递队列
+
+    每个目标(每个webhook和本地命令)有自己的先进先出队列，由后台线程依次发送，评估
+    不等待网络。发送失败时该目标按指数退避重试队首的通知，后面的通知排在其后，
+    保证"触发"先于"恢复"送达；超过ALERT_MAX_ATTEMPTS次后放弃该条并记录日志。
+    """
+
+    def __init__(self):
+        # 目标 -> deque([通知, 已尝试次数])
+        self.queues = {}
+        # 目标 -> 下次可以发送的时间
+        self.ready_at = {}
+        self.cond = threading.Condition()
+        self.session = requests.Session()
+        self.delivered = 0
+        self.failed = 0
+        self._thread = None
+
+    @staticmethod
+    def targets():
+        targets = [('webhook', url) for url in ALERT_WEBHOOKS]
+        if ALERT_COMMAND:
+            targets.append(('command', tuple(ALERT_COMMAND)))
+        return targets
+
+    def enqueue(self, event):
+        targets = self.targets()
+        if not targets:
+            return
+        with self.cond:
+            for target in targets:
+                self.queues.setdefault(target, deque()).append([event, 0])
+                self.ready_at.setdefault(target, 0.0)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+            self.cond.notify()
+
+    def deliver(self, target, event):
+        kind, destination = target
+        if kind == 'webhook':
+            response = self.session.post(destination, json=event, timeout=10)
+            response.raise_for_status()
+        else:
+            subprocess.run(list(destination), input=json.dumps(event).encode(), timeout=30, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def _next(self):
+        """等待并返回下一个可以发送的 (目标, 队首项)"""
+        with self.cond:
+            while True:
+                now = time.time()
+                waiting = [(self.ready_at[t], t) for t, q in self.queues.items() if q]
+                if waiting:
+                    ready_at, target = min(waiting)
+                    if ready_at <= now:
+                        return target, self.queues[target][0]
+                    self.cond.wait(ready_at - now)
+                else:
+                    self.cond.wait()
+
+    def _loop(self):
+        while True:
+            target, item = self._next()
+            event, attempt = item
+            try:
+                self.deliver(target, event)
+            except Exception as e:
+                item[1] = attempt = attempt + 1
+                if attempt < ALERT_MAX_ATTEMPTS:
+                    delay = min(2 ** attempt, ALERT_RETRY_MAX_SECONDS)
+                    logger.error(f"告警投递失败，{delay}秒后重试({target[0]} {target[1]}): {str(e)}")
+                    with self.cond:
+                        self.ready_at[target] = time.time() + delay
+                    continue
+                self.failed += 1
+                logger.error(f"告警投递失败，已放弃({target[0]} {target[1]}): {str(e)}")
+            else:
+                self.delivered += 1
+            with self.cond:
+                self.queues[target].popleft()
+                self.ready_at[target] = 0.0
+
+    def stats(self):
+        with self.cond:
+            pending = sum(len(q) for q in self.queues.values())
+        return {"pending": pending, "delivered": self.delivered, "failed": self.failed}
+
+
+alert_outbox = AlertOutbox()
+alert_engine = AlertEngine()
+
+def _pb_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def _pb_bytes(field, data):
+    """protobuf长度分隔字段(wire type 2)"""
+    return _pb_varint(field << 3 | 2) + _pb_varint(len(data)) + data
+
+def encode_remote_write(series):
+    """
+    编码Prometheus remote write的WriteRequest
+
+    参数:
+        series: {(指标名, ((标签名, 值), ...)): [(毫秒时间戳, 值)]}
+    """
+    out = []
+    for (name, labels), samples in series.items():
+        body = [
+            _pb_bytes(1, _pb_bytes(1, key.encode()) + _pb_bytes(2, str(value).encode()))
+            for key, value in sorted((('__name__', name),) + labels)
+        ]
+        for timestamp, value in samples:
+            # Sample: double value = 1 (fixed64), int64 timestamp = 2 (varint)
+            body.append(_pb_bytes(2, b'\x09' + struct.pack('<d', value) + b'\x10' + _pb_varint(timestamp)))
+        out.append(_pb_bytes(1, b''.join(body)))
+    return b''.join(out)
+
+def snappy_compress(data):
+    """
+    snappy块格式压缩
+
+    安装了python-snappy时使用它；否则输出只含字面量的合法snappy块，
+    接收端可以正常解码，只是不压缩。
+    """
+    if snappy is not None:
+        return snappy.compress(data)
+    out = [_pb_varint(len(data))]
+    for i in range(0, len(data), 65536):
+        chunk = data[i:i + 65536]
+        n = len(chunk) - 1
+        if n < 60:
+            out.append(bytes([n << 2]))
+        elif n < 256:
+            out.append(bytes([60 << 2, n]))
+        else:
+            out.append(bytes([61 << 2]) + struct.pack('<H', n))
+        out.append(chunk)
+    return b''.join(out)
+
+def _influx_escape(value, chars=',= '):
+    value = str(value)
+    for ch in '\\' + chars:
+        value = value.replace(ch, '\\' + ch)
+    return value
+
+def encode_line_protocol(points):
+    """把 (测量名, 标签, 字段, 微秒时间戳) 编码为Influx行协议(纳秒精度)"""
+    lines = []
+    for measurement, tags, fields, timestamp in points:
+        fieldset = []
+        for key, value in fields.items():
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif isinstance(value, int):
+                value = f"{value}i"
+            elif isinstance(value, float):
+                value = repr(value)
+            else:
+                value = '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+            fieldset.append(f"{_influx_escape(key)}={value}")
+        if not fieldset:
+            continue
+        series = _influx_escape(measurement, ', ') + ''.join(
+            f",{_influx_escape(k)}={_influx_escape(v)}" for k, v in tags if v not in (None, ''))
+        lines.append(f"{series} {','.join(fieldset)} {timestamp * 1000}")
+    return ('\n'.join(lines) + '\n').encode() if lines else b''
+
+
+class MetricForwarder:
+    """
+    指标转发器
+
+    监控循环的系统、GPU采样和所有进程的请求日志先放入内存缓冲，采集和代理不等待网络。
+    后台线程每FORWARD_FLUSH_INTERVAL秒把缓冲编码为一个批次(remote write或行协议)
+    并写入FORWARD_DIR下的文件，发送线程按顺序逐个POST，成功后删除；接收端不可用时
+    按指数退避重试队首批次，批次留在磁盘上，重启后继续发送。队列超过FORWARD_MAX_BYTES
+    时删除最旧的批次。
+
+    remote write中请求日志转换为按 (模型, 端点, 状态码) 累计的计数器；行协议保留每个请求。
+    """
+    MAX_POINTS = 100000
+    EXTENSIONS = {'remote_write': '.rw', 'influx': '.lp.gz'}
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.points = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # remote write的请求计数器：标签 -> [请求数, 输入token, 输出token, 耗时秒数]
+        self.counters = {}
+        self.session = requests.Session()
+        self.sequence = count()
+        self.sent = 0
+        self.dropped_points = 0
+        self.dropped_batches = 0
+        self.last_error = None
+        self._threads = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self.directory or FORWARD_DIR
+
+    @staticmethod
+    def _micros(timestamp):
+        # 行协议中同一序列、同一时间戳的点会互相覆盖，请求日志保留微秒精度
+        return int(datetime.fromisoformat(timestamp).timestamp() * 1000000)
+
+    def observe_metrics(self, metrics):
+        """监控循环每次采样后调用"""
+        if not FORWARD_URL:
+            return
+        timestamp = self._micros(metrics['timestamp'])
+        points = [('ollama_system', (), dict(metrics['system'], server_status=1 if metrics['server_status'] else 0),
+                   timestamp)]
+        process = metrics['ollama_process']
+        if process:
+            fields = {key: process.get(key) for key in ('cpu_percent', 'memory_percent', 'connections')}
+            points.append(('ollama_process', (), fields, timestamp))
+        gpu = metrics['gpu']
+        if gpu:
+            fields = {key[4:] if key.startswith('gpu_') else key: value
+                      for key, value in gpu.items() if key != 'gpu_name'}
+            points.append(('ollama_gpu', (('gpu', gpu['gpu_name']),), fields, timestamp))
+        self._add(points)
+
+    def observe_request(self, log):
+        """每条请求日志写入数据库时调用"""
+        if not FORWARD_URL:
+            return
+        tags = (('endpoint', log.get('endpoint') or ''), ('model', log.get('model_name') or ''),
+                ('status', str(log.get('status_code'))))
+        fields = {
+            'input_tokens': log.get('input_tokens') or 0,
+            'output_tokens': log.get('output_tokens') or 0,
+            'response_time': log.get('response_time'),
+            'load_duration': log.get('load_duration'),
+        }
+        self._add([('ollama_request', tags, fields, self._micros(log['timestamp']))])
+
+    def _add(self, points):
+        with self.lock:
+            room = max(self.MAX_POINTS - len(self.points), 0)
+            if room < len(points):
+                self.dropped_points += len(points) - room
+                points = points[:room]
+            self.points.extend(points)
+        if self._threads is None:
+            self.start()
+
+    def _labels(self, tags):
+        labels = dict(FORWARD_LABELS)
+        labels.update(tags)
+        return tuple(sorted((k, v) for k, v in labels.items() if v not in (None, '')))
+
+    def encode(self, points, fmt=None):
+        """把一组点编码为待发送的批次内容"""
+        fmt = fmt or FORWARD_FORMAT
+        if fmt == 'influx':
+            data = encode_line_protocol((m, self._labels(tags), fields, ts) for m, tags, fields, ts in points)
+            return gzip.compress(data, compresslevel=6, mtime=0)
+        series = {}
+        for measurement, tags, fields, timestamp in points:
+            labels = self._labels(tags)
+            if measurement == 'ollama_request':
+                entry = self.counters.setdefault(labels, [0, 0, 0, 0.0])
+                entry[0] += 1
+                entry[1] += fields['input_tokens']
+                entry[2] += fields['output_tokens']
+                entry[3] += fields['response_time'] or 0.0
+                continue
+            for field, value in fields.items():
+                if value is not None:
+                    series.setdefault((f"{measurement}_{field}", labels), []).append((timestamp // 1000, float(value)))
+        now = int(time.time() * 1000)
+        for labels, values in self.counters.items():
+            for name, value in zip(('ollama_requests_total', 'ollama_request_input_tokens_total',
+                                    'ollama_request_output_tokens_total', 'ollama_request_duration_seconds_total'),
+                                   values):
+                series[(name, labels)] = [(now, float(value))]
+        return snappy_compress(encode_remote_write(series))
+
+    def flush(self):
+        """把缓冲编码为一个批次文件"""
+        with self.lock:
+            points, self.points = self.points, []
+        if not points:
+            return None
+        fmt = FORWARD_FORMAT
+        data = self.encode(points, fmt)
+        os.makedirs(self.path, exist_ok=True)
+        name = f"{int(time.time() * 1000):015d}-{next(self.sequence) % 1000000:06d}{self.EXTENSIONS[fmt]}"
+        path = os.path.join(self.path, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        self._enforce_limit()
+        self.wakeup.set()
+        return path
+
+    def batches(self):
+        """磁盘队列中待发送的批次，按生成顺序"""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(os.path.join(self.path, n) for n in names if n.endswith(tuple(self.EXTENSIONS.values())))
+
+    def _enforce_limit(self):
+        batches = []
+        for path in self.batches():
+            try:
+                batches.append((path, os.path.getsize(path)))
+            except FileNotFoundError:
+                pass
+        total = sum(size for _, size in batches)
+        for path, size in batches:
+            if total <= FORWARD_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.dropped_batches += 1
+            logger.error(f"转发队列超过上限，已丢弃最旧的批次: {os.path.basename(path)}")
+
+    def deliver(self, path):
+        """发送一个批次，返回HTTP状态码"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        headers = dict(FORWARD_HEADERS)
+        if path.endswith(self.EXTENSIONS['remote_write']):
+            headers.update({
+                'Content-Type': 'application/x-protobuf',
+                'Content-Encoding': 'snappy',
+                'X-Prometheus-Remote-Write-Version': '0.1.0',
+            })
+        else:
+            headers.update({'Content-Type': 'text/plain; charset=utf-8', 'Content-Encoding': 'gzip'})
+        return self.session.post(FORWARD_URL, data=data, headers=headers, timeout=30).status_code
+
+    def _send_loop(self):
+        attempt = 0
+        while True:
+            batches = self.batches()
+            if not batches or not FORWARD_URL:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            path = batches[0]
+            try:
+                status = self.deliver(path)
+                error = None if status < 300 else f"HTTP {status}"
+            except FileNotFoundError:
+                continue
+            except requests.RequestException as e:
+                status, error = None, str(e)
+            # 4xx(除408和429)表示批次本身被拒绝，重试也不会成功
+            if status is not None and (status < 300 or (400 <= status < 500 and status not in (408, 429))):
+                if status < 300:
+                    self.sent += 1
+                else:
+                    self.dropped_batches += 1
+                    self.last_error = error
+                    logger.error(f"转发批次被拒绝，已丢弃({os.path.basename(path)}): {error}")
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                attempt = 0
+                continue
+            attempt += 1
+            delay = min(2 ** attempt, FORWARD_RETRY_MAX_SECONDS)
+            self.last_error = error
+            logger.error(f"转发失败，{delay}秒后重试: {error}")
+            time.sleep(delay)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FORWARD_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"转发批次写入失败: {str(e)}")
+
+    def start(self):
+        """启动打包和发送线程；磁盘上遗留的批次会先被发送"""
+        with self._start_lock:
+            if self._threads is not None:
+                return
+            self._threads = [threading.Thread(target=self._flush_loop, daemon=True),
+                             threading.Thread(target=self._send_loop, daemon=True)]
+            for thread in self._threads:
+                thread.start()
+
+    def status(self):
+        sizes = []
+        for path in self.batches():
+            try:
+                sizes.append(os.path.getsize(path))
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            buffered = len(self.points)
+        return {
+            "enabled": bool(FORWARD_URL),
+            "format": FORWARD_FORMAT,
+            "buffered_points": buffered,
+            "queued_batches": len(sizes),
+            "queued_bytes": sum(sizes),
+            "sent_batches": self.sent,
+            "dropped_points": self.dropped_points,
+            "dropped_batches": self.dropped_batches,
+            "last_error": self.last_error,
+        }
+
+
+metric_forwarder = MetricForwarder()
+
+class InotifyWatch:
+    """
+    用inotify等待目录中的文件变化(仅Linux，通过ctypes调用libc，无需第三方库)
+
+    监视日志所在的目录而不是文件本身，轮转时的改名、删除和新建也能唤醒等待；
+    不支持inotify时available为False，wait退化为按超时休眠，调用方照常轮询。
+    """
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, directory):
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_MOVED_FROM | self.IN_MOVED_TO |
+                self.IN_CREATE | self.IN_DELETE)
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    @property
+    def available(self):
+        return self.fd is not None
+
+    def wait(self, timeout):
+        """等待目录中有变化或超时，返回是否有变化；一次唤醒后丢弃积压的全部通知"""
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class OllamaLogParser:
+    """
+    从Ollama服务日志的行中识别性能事件
+
+    Ollama自身的日志为logfmt格式(time=... level=... msg="...")，其中夹杂着
+    llama.cpp/ggml输出的不带时间的行。不带时间的行使用前一条带时间的行的时间；
+    模型取最近一次日志中出现的 model=<blob路径>。每行最多产生一个事件。
+    """
+    FIELD_RE = re.compile(r'([\w.]+)=("(?:[^"\\]|\\.)*"|\S+)')
+    GOLOG_TIME_RE = re.compile(r'^(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})')
+    OFFLOAD_RE = re.compile(r'offloaded (\d+)/(\d+) layers to GPU')
+    # (事件, 正则)，按顺序匹配；runner崩溃的行常带有显存不足的原因，先按崩溃记录
+    PATTERNS = [
+        ('runner_crash', re.compile(
+            r'runner process (?:has )?(?:terminated|no longer running)|runner exited|'
+            r'signal: (?:segmentation fault|aborted|killed)|SIGSEGV|SIGABRT', re.I)),
+        ('oom', re.compile(r'out of memory|cudaMalloc failed|unable to allocate .*buffer|'
+                           r'requires more system memory', re.I)),
+        ('load', re.compile(r'llama runner started in ([\d.]+) ?s', re.I)),
+        ('cpu_fallback', re.compile(r'no compatible GPUs were discovered', re.I)),
+        ('context_shift', re.compile(r'context limit hit|context shift|shifting context', re.I)),
+    ]
+    EVENTS = [name for name, _ in PATTERNS]
+    MESSAGE_LIMIT = 500
+
+    def __init__(self):
+        self.last_time = None
+        self.model = None
+
+    @staticmethod
+    def _local_time(value):
+        """把带时区的ISO时间转换为本地时间(与其他表的时间戳格式一致)"""
+        try:
+            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if dt.tzinfo is not None:
+            dt = dt.astimezone().replace(tzinfo=None)
+        return dt.isoformat()
+
+    def parse(self, line, timestamp=None):
+        """
+        解析一行日志
+
+        参数:
+            timestamp: 日志来源提供的时间(journald)；None时从行中解析
+
+        返回:
+            事件字典，或None
+        """
+        fields = {}
+        if '=' in line:
+            fields = {key: value.strip('"') for key, value in self.FIELD_RE.findall(line)}
+        if timestamp is None:
+            if 'time' in fields:
+                timestamp = self._local_time(fields['time'])
+            else:
+                match = self.GOLOG_TIME_RE.match(line)
+                if match:
+                    timestamp = datetime.strptime(match.group(1), '%Y/%m/%d %H:%M:%S').isoformat()
+        if timestamp:
+            self.last_time = timestamp
+        if fields.get('model'):
+            self.model = os.path.basename(fields['model'])
+
+        event, value = self._match(line, fields)
+        if event is None:
+            return None
+        return {
+            "timestamp": timestamp or self.last_time or datetime.now().isoformat(),
+            "event": event,
+            "model": self.model,
+            "value": value,
+            "level": fields.get('level'),
+            "message": line[:self.MESSAGE_LIMIT]
+        }
+
+    def _match(self, line, fields):
+        """
+        返回 (事件, 数值)；load的数值为加载秒数，cpu_fallback为放到GPU上的层比例，
+        context_shift为丢弃的token数
+        """
+        for event, pattern in self.PATTERNS:
+            match = pattern.search(line)
+            if match:
+                if match.groups():
+                    return event, float(match.group(1))
+                if event == 'context_shift' and fields.get('discard', '').isdigit():
+                    return event, float(fields['discard'])
+                return event, None
+        # 部分或全部层未放到GPU上：llama.cpp的 "offloaded 20/33 layers to GPU"，
+        # 或较新版本Ollama的 msg=offload ... layers.model=33 layers.offload=20
+        match = self.OFFLOAD_RE.search(line)
+        if match:
+            offloaded, layers = int(match.group(1)), int(match.group(2))
+        elif fields.get('layers.model', '').isdigit() and fields.get('layers.offload', '').isdigit():
+            offloaded, layers = int(fields['layers.offload']), int(fields['layers.model'])
+        elif fields.get('msg') == 'inference compute' and fields.get('library') == 'cpu':
+            return 'cpu_fallback', 0.0
+        else:
+            return None, None
+        if layers and offloaded < layers:
+            return 'cpu_fallback', round(offloaded / layers, 4)
+        return None, None
+
+
+class OllamaLogTailer:
+    """
+    Ollama服务日志跟踪器
+
+    增量读取OLLAMA_LOG_FILE(或OLLAMA_LOG_UNIT的journald日志)，解析出的事件写入
+    ollama_events表。读取位置(文件inode和偏移，或journald游标)保存在OLLAMA_LOG_STATE_FILE，
+    重启后从上次的位置继续，首次运行时从文件开头读取。只读完整的行，未写完的行留到下次。
+    文件模式用inotify等待写入，不支持时按OLLAMA_LOG_POLL_INTERVAL轮询；
+    改名方式的轮转先读完旧文件再从头读新文件，copytruncate方式的轮转(文件变短)从头读。
+    """
+    READ_CHUNK = 1024 * 1024
+    # 有inotify时仍定期检查一次，防止漏掉通知(如网络文件系统)
+    SAFETY_INTERVAL = 30
+    STATE_SAVE_INTERVAL = 1.0
+
+    def __init__(self, path=None, unit=None, state_file=None):
+        self.path = path
+        self.unit = unit
+        self.state_file = state_file
+        self.parser = OllamaLogParser()
+        self.mode = None
+        self.inode = None
+        self.offset = 0
+        self.cursor = None
+        self.lines = 0
+        self.rotations = 0
+        self.events = {}
+        self.last_event = None
+        self.last_error = None
+        self._saved = None
+        self._file = None
+        self._partial = b''
+        self._state = None
+        self._state_saved_at = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def configure(self):
+        """按配置补全来源和状态文件，返回是否需要跟踪"""
+        self.path = self.path or OLLAMA_LOG_FILE
+        self.unit = self.unit or OLLAMA_LOG_UNIT
+        self.state_file = self.state_file or OLLAMA_LOG_STATE_FILE
+        if self._state is None:
+            self._state = self._load_state()
+            self.cursor = self._state.get('cursor')
+        return bool(self.path or self.unit)
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None and self.configure():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._save_state(force=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.unit:
+                    self._follow_journal()
+                else:
+                    self._follow_file()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"读取Ollama日志失败: {str(e)}")
+            self._stop.wait(5)
+
+    # ---- 文件 ----
+
+    def _follow_file(self):
+        watch = InotifyWatch(os.path.dirname(os.path.abspath(self.path)))
+        self.mode = 'inotify' if watch.available else 'poll'
+        logger.info(f"跟踪Ollama日志 {self.path} ({self.mode})")
+        try:
+            while not self._stop.is_set():
+                self.poll()
+                watch.wait(self.SAFETY_INTERVAL if watch.available else OLLAMA_LOG_POLL_INTERVAL)
+        finally:
+            watch.close()
+            self._close()
+
+    def poll(self):
+        """检查轮转并读取新写入的完整行，返回读取的行数"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        count = 0
+        if self._file is not None:
+            if st is None or st.st_ino != self.inode:
+                # 文件被改名或删除：旧文件剩余的部分仍可通过已打开的描述符读完
+                count += self._read_available()
+                self._close()
+                self.rotations += 1
+                # 已在进程内看到轮转，之后出现的文件(即使复用了同一inode)都是新文件，从头读
+                self._state = {}
+                self.offset = 0
+                if st is not None:
+                    self._open(st, 0)
+            elif st.st_size < self.offset:
+                # 文件被截断
+                self._file.seek(0)
+                self.offset = 0
+                self._partial = b''
+                self.rotations += 1
+        elif st is not None:
+            state = self._state or {}
+            resume = state.get('offset', 0) if state.get('inode') == st.st_ino else 0
+            self._open(st, resume if resume <= st.st_size else 0)
+        if self._file is not None:
+            count += self._read_available()
+        self._save_state()
+        return count
+
+    def _open(self, st, offset):
+        self._file = open(self.path, 'rb')
+        self._file.seek(offset)
+        self.inode = st.st_ino
+        self.offset = offset
+        self._partial = b''
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_available(self):
+        count = 0
+        while True:
+            chunk = self._file.read(self.READ_CHUNK)
+            if not chunk:
+                return count
+            lines = (self._partial + chunk).split(b'\n')
+            self._partial = lines.pop()
+            for line in lines:
+                self.handle_line(line.decode('utf-8', 'replace').rstrip('\r'))
+            count += len(lines)
+            # 偏移只推进到最后一个完整行的末尾
+            self.offset = self._file.tell() - len(self._partial)
+
+    # ---- journald ----
+
+    def _follow_journal(self):
+        cmd = ['journalctl', '-u', self.unit, '-f', '-o', 'json', '--no-pager']
+        cmd += ['--after-cursor', self.cursor] if self.cursor else ['-n', 'all']
+        self.mode = 'journald'
+        logger.info(f"跟踪Ollama日志 journald unit {self.unit}")
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for raw in proc.stdout:
+                self.handle_journal_entry(raw)
+                if self._stop.is_set():
+                    break
+        finally:
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+            self._save_state(force=True)
+        if not self._stop.is_set():
+            error = proc.stderr.read().decode('utf-8', 'replace').strip()
+            raise RuntimeError(f"journalctl退出({proc.returncode}): {error}")
+
+    def handle_journal_entry(self, raw):
+        """处理 journalctl -o json 输出的一条记录"""
+        entry = json.loads(raw)
+        message = entry.get('MESSAGE') or ''
+        if isinstance(message, list):
+            # 含非UTF-8字节的消息以字节数组表示
+            message = bytes(message).decode('utf-8', 'replace')
+        timestamp = None
+        if entry.get('__REALTIME_TIMESTAMP'):
+            timestamp = datetime.fromtimestamp(int(entry['__REALTIME_TIMESTAMP']) / 1e6).isoformat()
+        for line in message.splitlines():
+            self.handle_line(line, timestamp)
+        self.cursor = entry.get('__CURSOR', self.cursor)
+        self._save_state()
+
+    # ---- 公共 ----
+
+    def handle_line(self, line, timestamp=None):
+        self.lines += 1
+        event = self.parser.parse(line, timestamp)
+        if event is None:
+            return
+        self.events[event['event']] = self.events.get(event['event'], 0) + 1
+        self.last_event = event
+        if event['event'] in ('oom', 'runner_crash'):
+            logger.warning(f"Ollama日志事件 {event['event']}: {event['message']}")
+        metrics_writer.submit('ollama_event', event)
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # 日志来源变了时不沿用旧的位置
+        if state.get('path') != self.path or state.get('unit') != self.unit:
+            return {}
+        return state
+
+    def _save_state(self, force=False):
+        state = {"path": self.path, "unit": self.unit, "inode": self.inode,
+                 "offset": self.offset, "cursor": self.cursor}
+        now = time.time()
+        if state == self._saved or (not force and now - self._state_saved_at < self.STATE_SAVE_INTERVAL):
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+            tmp = self.state_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_file)
+        except OSError as e:
+            self.last_error = str(e)
+            return
+        self._saved = state
+        self._state = state
+        self._state_saved_at = now
+
+    def status(self):
+        return {
+            "enabled": bool(self.path or self.unit),
+            "mode": self.mode,
+            "path": self.path,
+            "unit": self.unit,
+            "inode": self.inode,
+            "offset": self.offset,
+            "cursor": self.cursor,
+            "lines": self.lines,
+            "rotations": self.rotations,
+            "events": self.events,
+            "last_event": self.last_event,
+            "last_error": self.last_error,
+        }
+
+
+ollama_log_tailer = OllamaLogTailer()
+
+class DashboardSnapshot:
+    """
+    一次构建好的仪表板状态：已序列化并压缩
+
+    完整状态和正文发布后不再修改；只有增量响应的缓存在请求线程中写入，由锁保护。
+    """
+
+    # 每个快照缓存的增量响应数
+    DELTA_CACHE = 8
+
+    def __init__(self, state):
+        self.state = state
+        self.created = time.time()
+        self.body = self._serialize(state)
+        self.gzipped = gzip.compress(self.body, compresslevel=5, mtime=0)
+        self.etag = hashlib.sha256(self.body).hexdigest()[:16]
+        # (系统采样起点, GPU采样起点) -> (正文, gzip正文, ETag)
+        self._deltas = {}
+        self._deltas_lock = threading.Lock()
+
+    @staticmethod
+    def _serialize(state):
+        return orjson.dumps(state, option=FastJSONProvider.ORJSON_OPTIONS) if orjson is not None \
+            else json.dumps(state, separators=(',', ':')).encode()
+
+    def since(self, timestamp):
+        """
+        只含timestamp之后的系统和GPU采样的状态，返回 (正文, gzip正文, ETag)
+
+        已加载过完整快照的仪表板每次只取新增的采样，其余部分(统计、排行等)本身很小，照常返回。
+        结果只取决于两列的切分位置，同一快照上切分位置相同的请求(同时打开的仪表板通常如此)
+        共用一份已序列化并压缩的正文。
+        """
+        keys = ('system', 'gpu')
+        starts = tuple(bisect_right(self.state[key].get('timestamp', []), timestamp) for key in keys)
+        with self._deltas_lock:
+            cached = self._deltas.get(starts)
+        if cached is None:
+            # 序列化和压缩在锁外进行，并发的相同请求最多重复计算一次
+            state = dict(self.state, incremental=True)
+            for key, start in zip(keys, starts):
+                state[key] = {name: values[start:] for name, values in self.state[key].items()}
+            body = self._serialize(state)
+            cached = (body, gzip.compress(body, compresslevel=5, mtime=0),
+                      f"{self.etag}-{starts[0]}-{starts[1]}")
+            with self._deltas_lock:
+                if starts not in self._deltas and len(self._deltas) >= self.DELTA_CACHE:
+                    self._deltas.pop(next(iter(self._deltas)))
+                cached = self._deltas.setdefault(starts, cached)
+        return cached
+
+
+class DashboardSnapshotBuilder:
+    """
+    仪表板快照构建器
+
+    监控循环每完成一次采样就通知构建线程，后台一次性计算仪表板所需的全部数据
+    (状态、系统和GPU指标、请求统计、模型和IP排行、最近请求)并发布为不可变快照，
+    /api/dashboard 直接返回快照字节，查看仪表板的人数不影响数据库负载。
+    聚合器上每个被查看的主机各有一个构建器，只读取该主机的行。
+    """
+    HOURS = 24
+    RECENT_REQUESTS = 20
+
+    # 能耗统计需要扫描整个窗口的请求和功耗采样，按该间隔(秒)重新计算
+    ENERGY_INTERVAL = 60
+
+    def __init__(self, host=None):
+        self.host = host
+        self.snapshot = None
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self._thread = None
+        self._energy = (0.0, None)
+
+    def notify(self):
+        """监控循环完成一次采样后调用"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        self.event.set()
+
+    def run_periodic(self, interval):
+        """没有本进程内的监控循环时(dashboard角色)按固定间隔重建快照"""
+        def tick():
+            while True:
+                self.notify()
+                time.sleep(interval)
+        threading.Thread(target=tick, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(f"仪表板快照构建失败: {str(e)}")
+
+    def build(self):
+        db = OllamaMetricsDB(host=self.host)
+        logs = db.get_recent_requests(self.HOURS)
+        remote = bool(self.host)
+        state = {
+            "status": self._remote_status() if remote else health_prober.status(),
+            "host": self.host,
+            "hours": self.HOURS,
+            "system": to_columns(db.get_recent_system_metrics(self.HOURS)),
+            "gpu": to_columns(db.get_recent_gpu_metrics(self.HOURS)),
+            "request_stats": request_stats(logs),
+            "models": model_stats(db, self.HOURS),
+            "ips": ip_stats(db, self.HOURS),
+            "requests": logs[:self.RECENT_REQUESTS],
+            # 异常检测和日志跟踪在各agent本地进行，聚合器只有本机的事件
+            "anomalies": [] if remote else db.get_anomaly_events(self.HOURS),
+            "ollama_events": [] if remote else db.get_ollama_events(self.HOURS),
+            "energy": self._energy_stats(db),
+        }
+        return DashboardSnapshot(state)
+
+    def _remote_status(self):
+        """agent随批次上报的健康状态；长时间没有上报时视为离线"""
+        status = dict(fleet_registry.status(self.host) or {"server_status": False, "state": "unknown"})
+        last_seen = fleet_registry.hosts.get(self.host, {}).get('last_seen')
+        if last_seen is None or (datetime.now() - datetime.fromisoformat(last_seen)).total_seconds() \
+                > 3 * AGENT_BATCH_INTERVAL + 5:
+            status.update(server_status=False, state='down', reason='agent not reporting')
+        status['last_seen'] = last_seen
+        return status
+
+    def _energy_stats(self, db):
+        computed, stats = self._energy
+        if stats is None or time.time() - computed > self.ENERGY_INTERVAL:
+            stats = energy_stats(db, self.HOURS)
+            self._energy = (time.time(), stats)
+        return stats
+
+    def rebuild(self):
+        with self.lock:
+            self.snapshot = self.build()
+        return self.snapshot
+
+    def get(self):
+        """
+        返回最新快照
+
+        尚无快照，或监控循环停止导致快照过期(超过三个采样周期)时同步重建一次。
+        """
+        snapshot = self.snapshot
+        if snapshot is None or time.time() - snapshot.created > 3 * MONITOR_INTERVAL + 5:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot is None or time.time() - snapshot.created > 3 * MONITOR_INTERVAL + 5:
+                    snapshot = self.snapshot = self.build()
+        return snapshot
+
+
+dashboard_snapshots = DashboardSnapshotBuilder()
+
 # 创建Flask应用
-app = Flask(__name__, static_folder='static')
+app = Flask(__name__, static_folder=None)
+app.json = FastJSONProvider(app)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
-# 确保静态文件夹存在
-if not os.path.exists('static'):
-    os.makedirs('static')
-
-# 创建CSS和JS文件
-with open('static/style.css', 'w') as f:
-    f.write('''
+# 前端资源：以常量形式内置，启动时预先计算哈希和压缩版本，不再写入磁盘
+STYLE_CSS = '''
 body {
     font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
     margin: 0;
@@ -542,6 +5432,18 @@ header h1 {
     padding: 0 20px;
 }
 
+header .container {
+    display: flex;
+    align-items: center;
+    justify-content: space-between;
+}
+
+.host-select {
+    margin: 0 20px;
+    padding: 4px 8px;
+    font-size: 1rem;
+}
+
 .card {
     background-color: white;
     border-radius: 8px;
@@ -582,6 +5484,26 @@ tr:hover {
     background-color: #f5f5f5;
 }
 
+/* 请求日志只渲染可见行：固定高度滚动，行高一致 */
+.virtual-viewport {
+    height: 600px;
+    overflow-y: auto;
+}
+
+.virtual-viewport th {
+    position: sticky;
+    top: 0;
+}
+
+.virtual-viewport td {
+    white-space: nowrap;
+}
+
+.virtual-spacer td {
+    padding: 0;
+    border: none;
+}
+
 .dashboard {
     display: grid;
     grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
@@ -625,6 +5547,10 @@ tr:hover {
     background-color: #e74c3c;
 }
 
+.status-degraded {
+    background-color: #f39c12;
+}
+
 .nav-tabs {
     display: flex;
     border-bottom: 1px solid #ddd;
@@ -667,10 +5593,9 @@ tr:hover {
         padding: 8px 10px;
     }
 }
-''')
+'''
 
-with open('static/script.js', 'w') as f:
-    f.write('''
+SCRIPT_JS = '''
 // 页面加载完成后运行
 document.addEventListener('DOMContentLoaded', function() {
     // 初始化图表
@@ -678,14 +5603,136 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 设置标签页切换
     setupTabs();
+    setupRequestLog();
     
-    // 设置自动刷新
-    setInterval(refreshData, 5000); // 每分钟刷新一次   HUSK OGSÅ AT OPDATERE I PYTHON-DELEN MONITOR_INTERVAL = XXXX
-    
-    // 初始加载数据
-    refreshData();
+    // 设置自动刷新：标签页不可见时暂停，重新可见时立即增量补齐
+    document.addEventListener('visibilitychange', () => {
+        if (document.hidden) {
+            stopPolling();
+        } else {
+            startPolling();
+        }
+    });
+    startPolling();
+
+    // 聚合器上有agent上报时显示主机选择
+    setupHostSelect();
 });
 
+// 刷新间隔(毫秒)   HUSK OGSÅ AT OPDATERE I PYTHON-DELEN MONITOR_INTERVAL = XXXX
+const REFRESH_INTERVAL = 5000;
+const HOSTS_INTERVAL = 60000;
+
+// 轮询代次：重新开始轮询后，旧的轮询链在下一次安排前退出
+let pollGeneration = 0;
+let pollTimer = null;
+let hostsLoadedAt = 0;
+
+function startPolling() {
+    stopPolling();
+    poll(++pollGeneration);
+}
+
+function stopPolling() {
+    pollGeneration++;
+    clearTimeout(pollTimer);
+}
+
+// 上一次刷新完成后才安排下一次，网络慢时请求不会堆积
+function poll(generation) {
+    if (Date.now() - hostsLoadedAt > HOSTS_INTERVAL) {
+        hostsLoadedAt = Date.now();
+        loadHosts();
+    }
+    refreshData().finally(() => {
+        if (generation === pollGeneration && !document.hidden) {
+            pollTimer = setTimeout(() => poll(generation), REFRESH_INTERVAL);
+        }
+    });
+}
+
+// JSON请求和解析在worker线程中进行，主线程只接收解析好的结果
+const dataWorker = new Worker('/static/worker.js');
+const pendingRequests = new Map();
+let nextRequestId = 0;
+
+dataWorker.onmessage = event => {
+    const {id, data, error} = event.data;
+    const pending = pendingRequests.get(id);
+    pendingRequests.delete(id);
+    if (error) {
+        pending.reject(new Error(error));
+    } else {
+        pending.resolve(data);
+    }
+};
+
+// columns: 需要转换为列式数组的字段，'.'表示整个响应
+function fetchData(url, columns) {
+    return new Promise((resolve, reject) => {
+        const id = nextRequestId++;
+        pendingRequests.set(id, {resolve, reject});
+        dataWorker.postMessage({id, url, columns});
+    });
+}
+
+// 与worker中相同的时间换算：本地ISO时间(截到毫秒)转为毫秒时间戳
+function toMillis(timestamp) {
+    return Date.parse(timestamp.slice(0, 23));
+}
+
+function formatTime(ms) {
+    return new Date(ms).toLocaleTimeString([], {hour: '2-digit', minute: '2-digit'});
+}
+
+// 当前查看的主机：null表示不区分主机，''表示本机，其余为agent主机名
+window.selectedHost = null;
+
+// 给按主机过滤的接口附加host参数
+function withHost(url) {
+    if (window.selectedHost === null) {
+        return url;
+    }
+    return url + (url.includes('?') ? '&' : '?') + 'host=' + encodeURIComponent(window.selectedHost);
+}
+
+function setupHostSelect() {
+    document.getElementById('hostSelect').addEventListener('change', event => {
+        window.selectedHost = event.target.value;
+        resetView();
+    });
+}
+
+function loadHosts() {
+    fetch('/api/hosts')
+        .then(response => response.json())
+        .then(renderHostSelect)
+        .catch(error => console.error('获取主机列表失败:', error));
+}
+
+function renderHostSelect(hosts) {
+    const select = document.getElementById('hostSelect');
+    // 只有本机数据时保持原有的单机视图
+    if (!hosts.some(host => !host.local)) {
+        select.style.display = 'none';
+        return;
+    }
+    const names = hosts.map(host => host.host);
+    if (window.selectedHost === null || !names.includes(window.selectedHost)) {
+        window.selectedHost = names[0];
+        resetView();
+    }
+    select.innerHTML = '';
+    hosts.forEach(host => {
+        const option = document.createElement('option');
+        option.value = host.host;
+        option.textContent = (host.local ? 'This server' : host.host) + (host.state ? ' (' + host.state + ')' : '');
+        select.appendChild(option);
+    });
+    select.value = window.selectedHost;
+    select.style.display = '';
+}
+
 // 设置标签页切换
 function setupTabs() {
     const tabs = document.querySelectorAll('.tab');
@@ -706,10 +5753,39 @@ function setupTabs() {
             if (target === 'charts') {
                 window.dispatchEvent(new Event('resize'));
             }
+            if (target === 'requests') {
+                renderRequestLog();
+                refreshRequestLog();
+            }
         });
     });
 }
 
+// 折线图的x轴为毫秒时间戳，点数超过画布宽度的4倍时按像素列保留最小和最大值(不丢失尖峰)
+const DECIMATION = {enabled: true, algorithm: 'min-max'};
+
+function timeAxis() {
+    return {
+        type: 'linear',
+        ticks: {
+            maxTicksLimit: 10,
+            callback: value => formatTime(value)
+        }
+    };
+}
+
+function lineTooltip() {
+    return {
+        mode: 'nearest',
+        axis: 'x',
+        intersect: false,
+        callbacks: {
+            title: items => items.length ? new Date(items[0].parsed.x).toLocaleString() : '',
+            label: anomalyTooltipLabel
+        }
+    };
+}
+
 // 初始化所有图表
 function initCharts() {
     // CPU使用率图表
@@ -734,27 +5810,24 @@ function initCharts() {
                 borderWidth: 2,
                 pointRadius: 0,
                 fill: true
-            }]
+            }, ollamaEventDataset()]
         },
         options: {
             responsive: true,
             maintainAspectRatio: false,
+            animation: false,
+            parsing: false,
+            normalized: true,
             scales: {
-                x: {
-                    ticks: {
-                        maxTicksLimit: 10
-                    }
-                },
+                x: timeAxis(),
                 y: {
                     beginAtZero: true,
                     max: 100
                 }
             },
             plugins: {
-                tooltip: {
-                    mode: 'index',
-                    intersect: false
-                },
+                decimation: DECIMATION,
+                tooltip: lineTooltip(),
                 legend: {
                     position: 'top'
                 }
@@ -784,27 +5857,24 @@ function initCharts() {
                 borderWidth: 2,
                 pointRadius: 0,
                 fill: true
-            }]
+            }, anomalyDataset()]
         },
         options: {
             responsive: true,
             maintainAspectRatio: false,
+            animation: false,
+            parsing: false,
+            normalized: true,
             scales: {
-                x: {
-                    ticks: {
-                        maxTicksLimit: 10
-                    }
-                },
+                x: timeAxis(),
                 y: {
                     beginAtZero: true,
                     max: 100
                 }
             },
             plugins: {
-                tooltip: {
-                    mode: 'index',
-                    intersect: false
-                },
+                decimation: DECIMATION,
+                tooltip: lineTooltip(),
                 legend: {
                     position: 'top'
                 }
@@ -842,27 +5912,24 @@ function initCharts() {
                 borderWidth: 2,
                 pointRadius: 0,
                 fill: true
-            }]
+            }, anomalyDataset(), ollamaEventDataset()]
         },
         options: {
             responsive: true,
             maintainAspectRatio: false,
+            animation: false,
+            parsing: false,
+            normalized: true,
             scales: {
-                x: {
-                    ticks: {
-                        maxTicksLimit: 10
-                    }
-                },
+                x: timeAxis(),
                 y: {
                     beginAtZero: true,
                     max: 100
                 }
             },
             plugins: {
-                tooltip: {
-                    mode: 'index',
-                    intersect: false
-                },
+                decimation: DECIMATION,
+                tooltip: lineTooltip(),
                 legend: {
                     position: 'top'
                 }
@@ -897,21 +5964,18 @@ function initCharts() {
         options: {
             responsive: true,
             maintainAspectRatio: false,
+            animation: false,
+            parsing: false,
+            normalized: true,
             scales: {
-                x: {
-                    ticks: {
-                        maxTicksLimit: 10
-                    }
-                },
+                x: timeAxis(),
                 y: {
                     beginAtZero: true
                 }
             },
             plugins: {
-                tooltip: {
-                    mode: 'index',
-                    intersect: false
-                },
+                decimation: DECIMATION,
+                tooltip: lineTooltip(),
                 legend: {
                     position: 'top'
                 }
@@ -963,23 +6027,191 @@ function initCharts() {
     });
 }
 
-// 刷新所有数据
+// 已加载到的最后一个采样时间(ISO字符串)，之后的刷新只请求这之后的采样
+let loadedUntil = null;
+// 视图代次：切换主机后丢弃旧视图还在途中的响应
+let viewGeneration = 0;
+
+// 切换主机：清空已加载的数据，重新加载完整快照
+function resetView() {
+    viewGeneration++;
+    loadedUntil = null;
+    clearRequestLog();
+    startPolling();
+}
+
+// 刷新所有数据：首次获取服务端预先构建的完整快照，之后只取新增的采样
 function refreshData() {
-    fetchSystemMetrics();
-    fetchGpuMetrics();
+    const generation = viewGeneration;
+    const url = loadedUntil ? '/api/dashboard?since=' + encodeURIComponent(loadedUntil) : '/api/dashboard';
+    return fetchData(withHost(url), ['system', 'gpu'])
+        .then(snapshot => {
+            if (generation !== viewGeneration) {
+                return;
+            }
+            const replace = !snapshot.incremental;
+            window.anomalyEvents = snapshot.anomalies || [];
+            window.ollamaEvents = snapshot.ollama_events || [];
+            appendSeries('system', snapshot.system, replace);
+            appendSeries('gpu', snapshot.gpu, replace);
+            updateCharts();
+            updateSystemStats(snapshot.system);
+            updateGpuStats(snapshot.gpu);
+            renderRequestStats(snapshot.request_stats);
+            renderModelStats(snapshot.models);
+            renderIpStats(snapshot.ips);
+            renderEnergyStats(snapshot.energy);
+            renderServerStatus(snapshot.status);
+            return refreshRequestLog();
+        })
+        .catch(error => {
+            console.error('获取仪表板快照失败:', error);
+            return refreshEach();
+        });
+}
+
+// 快照不可用时逐个接口获取
+function refreshEach() {
+    fetchAnomalies();
+    fetchOllamaEvents();
     fetchRequestStats();
     fetchModelStats();
     fetchIpStats();
-    fetchLatestRequests();
+    fetchEnergyStats();
     updateServerStatus();
+    return Promise.all([fetchSystemMetrics(), fetchGpuMetrics(), refreshRequestLog()]);
+}
+
+// 最近24小时的异常事件，由仪表板快照或 /api/anomalies 更新
+window.anomalyEvents = [];
+
+// 异常指标显示在哪个图表上
+const ANOMALY_CHARTS = {
+    ollama_memory_percent: 'memoryChart',
+    gpu_temperature: 'gpuChart',
+    gpu_power_draw: 'gpuChart',
+    tokens_per_sec: 'gpuChart',
+    time_per_token: 'gpuChart'
+};
+
+// 最近24小时的Ollama日志事件，由仪表板快照或 /api/ollama-log/events 更新
+window.ollamaEvents = [];
+
+// Ollama日志事件显示在哪个图表上
+const OLLAMA_EVENT_CHARTS = {
+    load: 'gpuChart',
+    oom: 'gpuChart',
+    cpu_fallback: 'cpuChart',
+    context_shift: 'cpuChart',
+    runner_crash: 'cpuChart'
+};
+
+// 异常标记数据集：只画点不画线，每个异常事件一个点
+function anomalyDataset() {
+    return {
+        label: 'Anomalies',
+        data: [],
+        anomalies: true,
+        showLine: false,
+        pointStyle: 'triangle',
+        pointRadius: 7,
+        pointHoverRadius: 9,
+        borderColor: '#c0392b',
+        backgroundColor: '#c0392b',
+        fill: false
+    };
+}
+
+// Ollama日志事件数据集：画在异常标记下方，用菱形区分
+function ollamaEventDataset() {
+    return {
+        label: 'Ollama events',
+        data: [],
+        ollamaEvents: true,
+        showLine: false,
+        pointStyle: 'rectRot',
+        pointRadius: 7,
+        pointHoverRadius: 9,
+        borderColor: '#8e44ad',
+        backgroundColor: '#8e44ad',
+        fill: false
+    };
+}
+
+function anomalyTooltipLabel(context) {
+    if (context.dataset.anomalies || context.dataset.ollamaEvents) {
+        return context.raw.note;
+    }
+    return context.dataset.label + ': ' + context.formattedValue;
+}
+
+function describeAnomaly(event) {
+    const name = event.metric + (event.label ? ' [' + event.label + ']' : '');
+    return name + ': ' + Number(event.value).toPrecision(4) + ' (baseline ' +
+        Number(event.baseline).toPrecision(4) + ', z = ' + event.zscore + ')';
+}
+
+// 按事件时间把异常标记在图表顶部，早于图表第一个点的事件不显示
+function markAnomalies(chartName) {
+    const chart = window[chartName];
+    const series = sourceData(chart.data.datasets[0]);
+    const start = series.length ? series[0].x : Infinity;
+    const dataset = chart.data.datasets.find(d => d.anomalies);
+    dataset.data = window.anomalyEvents
+        .filter(event => ANOMALY_CHARTS[event.metric] === chartName)
+        .map(event => ({x: toMillis(event.timestamp), y: 95, note: describeAnomaly(event)}))
+        .filter(point => point.x >= start);
+}
+
+function describeOllamaEvent(event) {
+    let note = event.event;
+    if (event.event === 'load' && event.value !== null) {
+        note += ' ' + event.value.toFixed(2) + 's';
+    } else if (event.event === 'cpu_fallback' && event.value !== null) {
+        note += ' (' + (event.value * 100).toFixed(0) + '% on GPU)';
+    }
+    if (event.model) {
+        note += ' [' + event.model.slice(0, 19) + ']';
+    }
+    return note;
+}
+
+// 按事件时间把Ollama日志事件标记在图表上，早于图表第一个点的事件不显示
+function markOllamaEvents(chartName) {
+    const chart = window[chartName];
+    const series = sourceData(chart.data.datasets[0]);
+    const start = series.length ? series[0].x : Infinity;
+    const dataset = chart.data.datasets.find(d => d.ollamaEvents);
+    dataset.data = window.ollamaEvents
+        .filter(event => OLLAMA_EVENT_CHARTS[event.event] === chartName)
+        .map(event => ({x: toMillis(event.timestamp), y: 85, note: describeOllamaEvent(event)}))
+        .filter(point => point.x >= start);
+}
+
+function fetchOllamaEvents() {
+    fetch('/api/ollama-log/events')
+        .then(response => response.json())
+        .then(data => {
+            window.ollamaEvents = data;
+        })
+        .catch(error => console.error('获取Ollama日志事件失败:', error));
+}
+
+function fetchAnomalies() {
+    fetch('/api/anomalies')
+        .then(response => response.json())
+        .then(data => {
+            window.anomalyEvents = data;
+        })
+        .catch(error => console.error('获取异常事件失败:', error));
 }
 
 // 获取系统指标数据
 function fetchSystemMetrics() {
-    fetch('/api/metrics/system')
-        .then(response => response.json())
+    return fetchData(withHost('/api/metrics/system?format=columns'), ['.'])
         .then(data => {
-            updateSystemCharts(data);
+            appendSeries('system', data, true);
+            updateCharts();
             updateSystemStats(data);
         })
         .catch(error => console.error('获取系统指标失败:', error));
@@ -987,10 +6219,10 @@ function fetchSystemMetrics() {
 
 // Get GPU Metrics Data
 function fetchGpuMetrics() {
-    fetch('/api/metrics/gpu')
-        .then(response => response.json())
+    return fetchData(withHost('/api/metrics/gpu?format=columns'), ['.'])
         .then(data => {
-            updateGpuCharts(data);
+            appendSeries('gpu', data, true);
+            updateCharts();
             updateGpuStats(data);
         })
         .catch(error => console.error('获取系统指标失败:', error));
@@ -998,117 +6230,269 @@ function fetchGpuMetrics() {
 
 // 获取请求统计数据
 function fetchRequestStats() {
-    fetch('/api/stats/requests')
+    fetch(withHost('/api/stats/requests'))
         .then(response => response.json())
-        .then(data => {
-            document.getElementById('totalRequests').innerText = data.total_requests;
-            document.getElementById('avgResponseTime').innerText = data.avg_response_time.toFixed(2) + 's';
-            document.getElementById('totalInputTokens').innerText = data.total_input_tokens.toLocaleString();
-            document.getElementById('totalOutputTokens').innerText = data.total_output_tokens.toLocaleString();
-        })
+        .then(renderRequestStats)
         .catch(error => console.error('获取请求统计失败:', error));
 }
 
+function renderRequestStats(data) {
+    document.getElementById('totalRequests').innerText = data.total_requests;
+    document.getElementById('avgResponseTime').innerText = data.avg_response_time.toFixed(2) + 's';
+    document.getElementById('totalInputTokens').innerText = data.total_input_tokens.toLocaleString();
+    document.getElementById('totalOutputTokens').innerText = data.total_output_tokens.toLocaleString();
+}
+
 // 获取模型统计数据
 function fetchModelStats() {
-    fetch('/api/stats/models')
+    fetch(withHost('/api/stats/models'))
         .then(response => response.json())
-        .then(data => {
-            const tableBody = document.getElementById('modelStatsBody');
-            tableBody.innerHTML = '';
-            
-            // 更新Token使用图表
-            const labels = [];
-            const inputTokens = [];
-            const outputTokens = [];
-            
-            data.forEach(model => {
-                // 添加表格行
-                const row = document.createElement('tr');
-                row.innerHTML = `
-                    <td>${model.model_name}</td>
-                    <td>${model.request_count}</td>
-                    <td>${model.total_input_tokens.toLocaleString()}</td>
-                    <td>${model.total_output_tokens.toLocaleString()}</td>
-                    <td>${model.avg_response_time.toFixed(2)}s</td>
-                `;
-                tableBody.appendChild(row);
-                
-                // 更新图表数据
-                labels.push(model.model_name);
-                inputTokens.push(model.total_input_tokens);
-                outputTokens.push(model.total_output_tokens);
-            });
-            
-            // 更新Token图表
-            window.tokensChart.data.labels = labels;
-            window.tokensChart.data.datasets[0].data = inputTokens;
-            window.tokensChart.data.datasets[1].data = outputTokens;
-            window.tokensChart.update();
-        })
+        .then(renderModelStats)
         .catch(error => console.error('获取模型统计失败:', error));
 }
 
+function renderModelStats(data) {
+    const tableBody = document.getElementById('modelStatsBody');
+    tableBody.innerHTML = '';
+    
+    // 更新Token使用图表
+    const labels = [];
+    const inputTokens = [];
+    const outputTokens = [];
+    
+    data.forEach(model => {
+        // 添加表格行
+        const row = document.createElement('tr');
+        row.innerHTML = `
+            <td>${model.model_name}</td>
+            <td>${model.request_count}</td>
+            <td>${model.total_input_tokens.toLocaleString()}</td>
+            <td>${model.total_output_tokens.toLocaleString()}</td>
+            <td>${model.avg_response_time.toFixed(2)}s</td>
+        `;
+        tableBody.appendChild(row);
+        
+        // 更新图表数据
+        labels.push(model.model_name);
+        inputTokens.push(model.total_input_tokens);
+        outputTokens.push(model.total_output_tokens);
+    });
+    
+    // 更新Token图表
+    window.tokensChart.data.labels = labels;
+    window.tokensChart.data.datasets[0].data = inputTokens;
+    window.tokensChart.data.datasets[1].data = outputTokens;
+    window.tokensChart.update();
+}
+
+// 获取能耗统计
+function fetchEnergyStats() {
+    fetch(withHost('/api/stats/energy'))
+        .then(response => response.json())
+        .then(renderEnergyStats)
+        .catch(error => console.error('获取能耗统计失败:', error));
+}
+
+function formatMetric(value, digits) {
+    return value === null || value === undefined ? '-' : value.toFixed(digits);
+}
+
+function renderEnergyStats(data) {
+    if (!data) {
+        return;
+    }
+    document.getElementById('energySummary').textContent =
+        `Total ${data.total_wh.toFixed(1)} Wh · Attributed ${(data.attributed_joules / 3600).toFixed(1)} Wh · ` +
+        `Idle ${(data.idle_joules / 3600).toFixed(1)} Wh · ${formatMetric(data.wh_per_1k_tokens, 3)} Wh/1k tokens`;
+    const tableBody = document.getElementById('energyStatsBody');
+    tableBody.innerHTML = '';
+
+    data.models.forEach(model => {
+        const row = document.createElement('tr');
+        row.innerHTML = `
+            <td>${model.model_name}</td>
+            <td>${model.requests}</td>
+            <td>${model.wh.toFixed(2)}</td>
+            <td>${formatMetric(model.wh_per_1k_tokens, 3)}</td>
+            <td>${formatMetric(model.wh_per_1k_output_tokens, 3)}</td>
+            <td>${formatMetric(model.avg_power_w, 1)}</td>
+            <td>${formatMetric(model.tokens_per_sec_per_util, 2)}</td>
+        `;
+        tableBody.appendChild(row);
+    });
+}
+
 // 获取IP统计数据
 function fetchIpStats() {
-    fetch('/api/stats/ips')
+    fetch(withHost('/api/stats/ips'))
         .then(response => response.json())
-        .then(data => {
-            const tableBody = document.getElementById('ipStatsBody');
-            tableBody.innerHTML = '';
-            
-            data.forEach(ip => {
-                const row = document.createElement('tr');
-                row.innerHTML = `
-                    <td>${ip.client_ip}</td>
-                    <td>${ip.request_count}</td>
-                `;
-                tableBody.appendChild(row);
-            });
-        })
+        .then(renderIpStats)
         .catch(error => console.error('获取IP统计失败:', error));
 }
 
-// 获取最近请求记录
-function fetchLatestRequests() {
-    fetch('/api/logs/requests')
-        .then(response => response.json())
-        .then(data => {
-            const tableBody = document.getElementById('requestLogsBody');
-            tableBody.innerHTML = '';
-            
-            data.slice(0, 20).forEach(request => {
-                const row = document.createElement('tr');
-                row.innerHTML = `
-                    <td>${request.timestamp}</td>
-                    <td>${request.client_ip}</td>
-                    <td>${request.model_name}</td>
-                    <td>${request.input_tokens}</td>
-                    <td>${request.output_tokens}</td>
-                    <td>${request.response_time.toFixed(2)}s</td>
-                    <td>${request.status_code}</td>
-                    <td>${request.endpoint}</td>
-                `;
-                tableBody.appendChild(row);
+function renderIpStats(data) {
+    const tableBody = document.getElementById('ipStatsBody');
+    tableBody.innerHTML = '';
+    
+    data.forEach(ip => {
+        const row = document.createElement('tr');
+        row.innerHTML = `
+            <td>${ip.client_ip}</td>
+            <td>${ip.request_count}</td>
+        `;
+        tableBody.appendChild(row);
+    });
+}
+
+// 请求日志：按时间正序保存最近24小时的请求(最多REQUEST_LOG_LIMIT条)，表格只渲染可见的行
+const REQUEST_LOG_LIMIT = 100000;
+const REQUEST_LOG_COLUMNS = ['timestamp', 'client_ip', 'model_name', 'input_tokens', 'output_tokens',
+                             'response_time', 'status_code', 'endpoint'];
+const REQUEST_LOG_OVERSCAN = 10;
+const requestLog = {columns: {}, length: 0, until: null};
+// 复用的表格行，数量只取决于可见区域的高度
+const requestRowPool = [];
+let requestRowHeight = 0;
+let requestTopSpacer = null;
+let requestBottomSpacer = null;
+
+function setupRequestLog() {
+    const viewport = document.getElementById('requestLogsViewport');
+    requestTopSpacer = spacerRow();
+    requestBottomSpacer = spacerRow();
+    let scheduled = false;
+    // 滚动时每帧最多重绘一次
+    viewport.addEventListener('scroll', () => {
+        if (!scheduled) {
+            scheduled = true;
+            requestAnimationFrame(() => {
+                scheduled = false;
+                renderRequestLog();
             });
+        }
+    }, {passive: true});
+    window.addEventListener('resize', renderRequestLog);
+    clearRequestLog();
+}
+
+function spacerRow() {
+    const row = document.createElement('tr');
+    row.className = 'virtual-spacer';
+    row.appendChild(document.createElement('td')).colSpan = REQUEST_LOG_COLUMNS.length;
+    return row;
+}
+
+function clearRequestLog() {
+    REQUEST_LOG_COLUMNS.forEach(key => {
+        requestLog.columns[key] = [];
+    });
+    requestLog.length = 0;
+    requestLog.until = null;
+    renderRequestLog();
+}
+
+function requestLogVisible() {
+    return !document.hidden && document.getElementById('requests').classList.contains('active');
+}
+
+// 只在请求日志标签页可见时增量获取新请求
+function refreshRequestLog() {
+    if (!requestLogVisible()) {
+        return Promise.resolve();
+    }
+    const generation = viewGeneration;
+    const url = '/api/logs/requests?format=columns&hours=24' +
+        (requestLog.until ? '&since=' + encodeURIComponent(requestLog.until) : '');
+    return fetchData(withHost(url), ['.'])
+        .then(data => {
+            if (generation === viewGeneration) {
+                appendRequestLog(data);
+            }
         })
         .catch(error => console.error('获取请求日志失败:', error));
 }
 
+function appendRequestLog(data) {
+    const count = data.timestamp ? data.timestamp.length : 0;
+    if (count) {
+        // 接口按时间倒序返回，倒着追加以保持正序
+        REQUEST_LOG_COLUMNS.forEach(key => {
+            const target = requestLog.columns[key];
+            const values = data[key] || [];
+            for (let i = count - 1; i >= 0; i--) {
+                target.push(values[i]);
+            }
+        });
+        requestLog.length += count;
+        requestLog.until = data.timestamp[0];
+    }
+    // 删除超出24小时窗口或数量上限的最旧请求
+    const stamps = requestLog.columns.timestamp;
+    const cutoff = Date.now() - 24 * 3600 * 1000;
+    let drop = Math.max(0, requestLog.length - REQUEST_LOG_LIMIT);
+    while (drop < requestLog.length && toMillis(stamps[drop]) < cutoff) {
+        drop++;
+    }
+    if (drop) {
+        REQUEST_LOG_COLUMNS.forEach(key => requestLog.columns[key].splice(0, drop));
+        requestLog.length -= drop;
+    }
+    document.getElementById('requestLogCount').textContent = requestLog.length.toLocaleString();
+    renderRequestLog();
+}
+
+function formatSeconds(value) {
+    return value === null || value === undefined || Number.isNaN(value) ? '-' : value.toFixed(2) + 's';
+}
+
+// 只渲染可见区域(及上下少量缓冲)的行，上下用占位行撑出滚动高度
+function renderRequestLog() {
+    const viewport = document.getElementById('requestLogsViewport');
+    const body = document.getElementById('requestLogsBody');
+    if (!requestTopSpacer || !viewport.clientHeight) {
+        return;
+    }
+    const total = requestLog.length;
+    if (!total) {
+        body.innerHTML = `<tr><td colspan="${REQUEST_LOG_COLUMNS.length}">No requests</td></tr>`;
+        return;
+    }
+    const rowHeight = requestRowHeight || 41;
+    const first = Math.min(Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - REQUEST_LOG_OVERSCAN), total - 1);
+    const count = Math.min(total - first, Math.ceil(viewport.clientHeight / rowHeight) + 2 * REQUEST_LOG_OVERSCAN);
+    while (requestRowPool.length < count) {
+        const row = document.createElement('tr');
+        REQUEST_LOG_COLUMNS.forEach(() => row.appendChild(document.createElement('td')));
+        requestRowPool.push(row);
+    }
+    const columns = requestLog.columns;
+    const rows = requestRowPool.slice(0, count);
+    rows.forEach((row, j) => {
+        // 最新的请求在最上面
+        const i = total - 1 - (first + j);
+        const cells = row.cells;
+        cells[0].textContent = columns.timestamp[i];
+        cells[1].textContent = columns.client_ip[i];
+        cells[2].textContent = columns.model_name[i];
+        cells[3].textContent = columns.input_tokens[i];
+        cells[4].textContent = columns.output_tokens[i];
+        cells[5].textContent = formatSeconds(columns.response_time[i]);
+        cells[6].textContent = columns.status_code[i];
+        cells[7].textContent = columns.endpoint[i];
+    });
+    requestTopSpacer.style.height = first * rowHeight + 'px';
+    requestBottomSpacer.style.height = (total - first - count) * rowHeight + 'px';
+    body.replaceChildren(requestTopSpacer, ...rows, requestBottomSpacer);
+    if (!requestRowHeight) {
+        requestRowHeight = rows[0].getBoundingClientRect().height;
+    }
+}
+
 // 更新服务器状态
 function updateServerStatus() {
     fetch('/api/status')
         .then(response => response.json())
-        .then(data => {
-            const statusElement = document.getElementById('serverStatus');
-            if (data.server_status) {
-                statusElement.innerHTML = '<span class="status-indicator status-up"></span>Running';
-                statusElement.style.color = '#2ecc71';
-            } else {
-                statusElement.innerHTML = '<span class="status-indicator status-down"></span>Stopped';
-                statusElement.style.color = '#e74c3c';
-            }
-        })
+        .then(renderServerStatus)
         .catch(error => {
             console.error('获取服务器状态失败:', error);
             const statusElement = document.getElementById('serverStatus');
@@ -1117,81 +6501,103 @@ function updateServerStatus() {
         });
 }
 
-// 更新系统图表
-function updateSystemCharts(data) {
-    // 仅保留最近24小时的数据点（假设每分钟1个数据点，最多1440个点）
-    const maxDataPoints = 17280;   // Hvis man opdater hvert 5. sekund, så er det 12 gange i minuttet, 720 gange i timen, 17280 gange på 24 timer.
+function renderServerStatus(data) {
+    const statusElement = document.getElementById('serverStatus');
+    if (data.state === 'degraded') {
+        statusElement.innerHTML = '<span class="status-indicator status-degraded"></span>Degraded';
+        statusElement.style.color = '#f39c12';
+    } else if (data.server_status) {
+        statusElement.innerHTML = '<span class="status-indicator status-up"></span>Running';
+        statusElement.style.color = '#2ecc71';
+    } else {
+        statusElement.innerHTML = '<span class="status-indicator status-down"></span>Stopped';
+        statusElement.style.color = '#e74c3c';
+    }
+}
 
-    // 提取最近的数据点
-    const recentData = data.slice(-maxDataPoints);
-    
-    // 格式化时间标签
-    const timeLabels = recentData.map(d => {
-        const date = new Date(d.timestamp);
-        return date.toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'});
+// 列式数据：把最后一行还原为对象
+function latestRow(data) {
+    const latest = {};
+    Object.keys(data).forEach(key => {
+        latest[key] = data[key][data[key].length - 1];
     });
-    
-    // 提取CPU数据
-    const cpuData = recentData.map(d => d.cpu_percent);
-    const ollamaCpuData = recentData.map(d => d.ollama_cpu_percent);
-    
-    // 提取内存数据
-    const memoryData = recentData.map(d => d.memory_percent);
-    const ollamaMemoryData = recentData.map(d => d.ollama_memory_percent);
-    
-    // 提取网络数据并转换为MB
-    const networkSentData = recentData.map(d => d.network_bytes_sent / (1024 * 1024));
-    const networkRecvData = recentData.map(d => d.network_bytes_recv / (1024 * 1024));
-    
-    // 更新CPU图表
-    window.cpuChart.data.labels = timeLabels;
-    window.cpuChart.data.datasets[0].data = cpuData;
-    window.cpuChart.data.datasets[1].data = ollamaCpuData;
-    window.cpuChart.update();
-    
-    // 更新内存图表
-    window.memoryChart.data.labels = timeLabels;
-    window.memoryChart.data.datasets[0].data = memoryData;
-    window.memoryChart.data.datasets[1].data = ollamaMemoryData;
-    window.memoryChart.update();
-    
-    // 更新网络图表
-    window.networkChart.data.labels = timeLabels;
-    window.networkChart.data.datasets[0].data = networkSentData;
-    window.networkChart.data.datasets[1].data = networkRecvData;
-    window.networkChart.update();
+    return latest;
 }
 
-function updateGpuCharts(data) {
-    // 仅保留最近24小时的数据点（假设每分钟1个数据点，最多1440个点）
-    const maxDataPoints = 1440;
-    
-    // 提取最近的数据点
-    const recentData = data.slice(-maxDataPoints);
-    
-    // 格式化时间标签
-    const timeLabels = recentData.map(d => {
-        const date = new Date(d.timestamp);
-        return date.toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'});
+// 图表数据的时间窗口(毫秒)，超出窗口的点从头部删除，长时间运行时内存不增长
+const CHART_WINDOW = 24 * 3600 * 1000;
+const MB = 1024 * 1024;
+
+function percentOf(value, total) {
+    return value && total ? (value / total) * 100 : 0;
+}
+
+// 各图表数据集的取值：参数为列式数据和行号
+const CHART_SERIES = {
+    system: {
+        cpuChart: [(c, i) => c.cpu_percent[i], (c, i) => c.ollama_cpu_percent[i]],
+        memoryChart: [(c, i) => c.memory_percent[i], (c, i) => c.ollama_memory_percent[i]],
+        networkChart: [(c, i) => c.network_bytes_sent[i] / MB, (c, i) => c.network_bytes_recv[i] / MB]
+    },
+    gpu: {
+        gpuChart: [
+            (c, i) => c.gpu_utilization[i],
+            (c, i) => percentOf(c.gpu_memory_used[i], c.gpu_memory_total[i]),
+            (c, i) => percentOf(c.gpu_power_draw[i], c.gpu_power_limit[i])
+        ]
+    }
+};
+
+// 启用抽稀后Chart.js把原始数据移到_data，dataset.data返回抽稀结果
+function sourceData(dataset) {
+    return dataset._data || dataset.data;
+}
+
+// 把新采样追加到图表数据集；replace为true时先清空(完整快照)
+function appendSeries(source, columns, replace) {
+    const times = columns.time || [];
+    const count = times.length;
+    const last = count ? times[count - 1] : null;
+    Object.keys(CHART_SERIES[source]).forEach(chartName => {
+        const datasets = window[chartName].data.datasets;
+        CHART_SERIES[source][chartName].forEach((value, k) => {
+            if (replace) {
+                datasets[k].data = [];
+            }
+            const points = sourceData(datasets[k]);
+            for (let i = 0; i < count; i++) {
+                points.push({x: times[i], y: value(columns, i)});
+            }
+            if (points.length) {
+                const cutoff = (last === null ? points[points.length - 1].x : last) - CHART_WINDOW;
+                let drop = 0;
+                while (drop < points.length && points[drop].x < cutoff) {
+                    drop++;
+                }
+                if (drop) {
+                    points.splice(0, drop);
+                }
+            }
+        });
     });
-    
-   // GPU
-    const gpuUtilizationData = recentData.map(d => d.gpu_utilization);
-    const gpuMemoryData = recentData.map(d => d.gpu_memory_used && d.gpu_memory_total ? (d.gpu_memory_used / d.gpu_memory_total) * 100 : 0);
-    const gpuPowerData = recentData.map(d => d.gpu_power_draw && d.gpu_power_limit ? (d.gpu_power_draw / d.gpu_power_limit) * 100 : 0);
+    if (count && (loadedUntil === null || columns.timestamp[count - 1] > loadedUntil)) {
+        loadedUntil = columns.timestamp[count - 1];
+    }
+}
 
-    // GPU
-    window.gpuChart.data.labels = timeLabels;
-    window.gpuChart.data.datasets[0].data = gpuUtilizationData;
-    window.gpuChart.data.datasets[1].data = gpuMemoryData;
-    window.gpuChart.data.datasets[2].data = gpuPowerData;
-    window.gpuChart.update();
+// 重绘全部折线图，不做动画
+function updateCharts() {
+    markAnomalies('memoryChart');
+    markAnomalies('gpuChart');
+    markOllamaEvents('cpuChart');
+    markOllamaEvents('gpuChart');
+    ['cpuChart', 'memoryChart', 'networkChart', 'gpuChart'].forEach(name => window[name].update('none'));
 }
 
 // 更新系统统计信息
 function updateSystemStats(data) {
-    if (data.length > 0) {
-        const latest = data[data.length - 1];
+    if (data.timestamp && data.timestamp.length > 0) {
+        const latest = latestRow(data);
         document.getElementById('cpuUsage').innerText = latest.cpu_percent.toFixed(1) + '%';
         document.getElementById('memoryUsage').innerText = latest.memory_percent.toFixed(1) + '%';
         document.getElementById('diskUsage').innerText = latest.disk_percent.toFixed(1) + '%';
@@ -1201,31 +6607,19 @@ function updateSystemStats(data) {
 
 // Update GPU Stats
 function updateGpuStats(data) {
-    if (data.length > 0) {
-        const latest = data[data.length - 1];
+    if (data.timestamp && data.timestamp.length > 0) {
+        const latest = latestRow(data);
         document.getElementById('gpuUsage').innerText = latest.gpu_utilization ? latest.gpu_utilization.toFixed(1) + '%' : 'N/A';
         document.getElementById('gpuName').innerText = latest.gpu_name ? latest.gpu_name : 'N/A';
         document.getElementById('gpuMemoryUsage').innerText = latest.gpu_memory_used && latest.gpu_memory_total ? latest.gpu_memory_used.toFixed(0) + ' MB / ' + latest.gpu_memory_total.toFixed(0) + ' MB' : 'N/A';
         document.getElementById('gpuMemoryPercent').innerText = latest.gpu_memory_used && latest.gpu_memory_total ? ((latest.gpu_memory_used / latest.gpu_memory_total) * 100).toFixed(1) + '%' : 'N/A';
         document.getElementById('gpuPower').innerText = latest.gpu_power_draw && latest.gpu_power_limit ? latest.gpu_power_draw.toFixed(0) + ' W / ' + latest.gpu_power_limit.toFixed(0) + ' W' : 'N/A';
         document.getElementById('gpuPwrPercent').innerText = latest.gpu_power_draw && latest.gpu_power_limit ? ((latest.gpu_power_draw / latest.gpu_power_limit) * 100).toFixed(1) + '% (' + latest.gpu_temperature.toFixed(0) + '°C)' : 'N/A';
-    }
-}
-''')
-
-# 模板渲染
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/static/<path:path>')
-def send_static(path):
-    return send_from_directory('static', path)
+    }
+}
+'''
 
-# 创建模板文件
-@app.route('/templates/index.html')
-def get_index_template():
-    html = '''
+INDEX_HTML = '''
 <!DOCTYPE html>
 <html lang="zh-CN">
 <head>
@@ -1239,6 +6633,7 @@ def get_index_template():
     <header>
         <div class="container">
             <h1>Ollama Monitor Dashboard</h1>
+            <select id="hostSelect" class="host-select" style="display: none"></select>
         </div>
     </header>
     
@@ -1362,6 +6757,29 @@ def get_index_template():
                         </tbody>
                     </table>
                 </div>
+
+                <div class="card">
+                    <h2>Energy Efficiency</h2>
+                    <p id="energySummary"></p>
+                    <table>
+                        <thead>
+                            <tr>
+                                <th>Model Name</th>
+                                <th>Request Count</th>
+                                <th>Energy (Wh)</th>
+                                <th>Wh / 1k Tokens</th>
+                                <th>Wh / 1k Output Tokens</th>
+                                <th>Average Power (W)</th>
+                                <th>Tokens/s per % Util</th>
+                            </tr>
+                        </thead>
+                        <tbody id="energyStatsBody">
+                            <tr>
+                                <td colspan="7">Loading...</td>
+                            </tr>
+                        </tbody>
+                    </table>
+                </div>
             </div>
             
             <div id="clients">
@@ -1385,7 +6803,8 @@ def get_index_template():
             
             <div id="requests">
                 <div class="card">
-                    <h2>Recent Request Logs</h2>
+                    <h2>Recent Request Logs (<span id="requestLogCount">0</span>)</h2>
+                    <div id="requestLogsViewport" class="virtual-viewport">
                     <table>
                         <thead>
                             <tr>
@@ -1405,6 +6824,7 @@ def get_index_template():
                             </tr>
                         </tbody>
                     </table>
+                    </div>
                 </div>
             </div>
         </div>
@@ -1414,102 +6834,882 @@ def get_index_template():
 </body>
 </html>
     '''
-    with open('templates/index.html', 'w') as f:
-        f.write(html)
-    return html
 
-# 确保模板文件夹存在
-if not os.path.exists('templates'):
-    os.makedirs('templates')
-    get_index_template()
+# 数据worker：在后台线程中请求和解析JSON，把数值列转换为Float64Array后
+# 以可转移对象交给主线程，主线程不做解析和类型转换
+WORKER_JS = '''
+// 把列式数据中的数值列转为Float64Array(null为NaN)，并增加毫秒时间戳列time
+function toColumns(data) {
+    const result = {};
+    const buffers = [];
+    Object.keys(data).forEach(key => {
+        const values = data[key];
+        if (Array.isArray(values) && values.some(v => typeof v === 'number')) {
+            const array = new Float64Array(values.length);
+            for (let i = 0; i < values.length; i++) {
+                array[i] = values[i] === null ? NaN : values[i];
+            }
+            result[key] = array;
+            buffers.push(array.buffer);
+        } else {
+            result[key] = values;
+        }
+    });
+    if (Array.isArray(data.timestamp)) {
+        const time = new Float64Array(data.timestamp.length);
+        for (let i = 0; i < time.length; i++) {
+            // 时间戳为本地ISO时间，截到毫秒后Date.parse按本地时区解析
+            time[i] = Date.parse(data.timestamp[i].slice(0, 23));
+        }
+        result.time = time;
+        buffers.push(time.buffer);
+    }
+    return {result, buffers};
+}
+
+self.onmessage = event => {
+    const {id, url, columns} = event.data;
+    fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('HTTP ' + response.status);
+            }
+            return response.json();
+        })
+        .then(data => {
+            let buffers = [];
+            (columns || []).forEach(key => {
+                const source = key === '.' ? data : data[key];
+                if (!source || typeof source !== 'object') {
+                    return;
+                }
+                const converted = toColumns(source);
+                buffers = buffers.concat(converted.buffers);
+                if (key === '.') {
+                    data = converted.result;
+                } else {
+                    data[key] = converted.result;
+                }
+            });
+            self.postMessage({id, data}, buffers);
+        })
+        .catch(error => self.postMessage({id, error: String(error)}));
+};
+'''
+
+class StaticAsset:
+    """预先计算好内容哈希、ETag和压缩版本的不可变前端资源"""
+
+    def __init__(self, name, text, content_type):
+        self.name = name
+        self.content_type = content_type
+        self.body = text.encode('utf-8')
+        digest = hashlib.sha256(self.body).hexdigest()
+        self.etag = digest[:16]
+        base, ext = os.path.splitext(name)
+        self.hashed_name = f"{base}.{digest[:10]}{ext}"
+        # mtime固定为0，相同内容得到相同的gzip字节
+        self.encoded = {'gzip': gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.body, quality=11)
+
+    def response(self, immutable):
+        """按Accept-Encoding和If-None-Match返回资源"""
+        if immutable:
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            # 未带哈希的地址(包括首页)每次重新验证，命中时只返回304
+            cache_control = 'no-cache'
+        headers = {'ETag': f'"{self.etag}"', 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if self.etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+        body = self.body
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encoded and accepted[encoding]:
+                body = self.encoded[encoding]
+                headers['Content-Encoding'] = encoding
+                break
+        return Response(body, headers=headers, content_type=self.content_type)
+
+
+def build_static_assets():
+    """
+    构建前端资源表
+
+    首页中引用的CSS和JS地址(以及脚本中引用的worker地址)替换为带内容哈希的
+    文件名，浏览器可长期缓存；首页本身不带哈希，通过ETag重新验证。
+
+    返回:
+        {访问路径: (资源, 是否不可变)}
+    """
+    style = StaticAsset('style.css', STYLE_CSS, 'text/css; charset=utf-8')
+    worker = StaticAsset('worker.js', WORKER_JS, 'application/javascript; charset=utf-8')
+    script_js = SCRIPT_JS.replace(f'/static/{worker.name}', f'/static/{worker.hashed_name}')
+    script = StaticAsset('script.js', script_js, 'application/javascript; charset=utf-8')
+    html = INDEX_HTML
+    for asset in (style, script):
+        html = html.replace(f'/static/{asset.name}', f'/static/{asset.hashed_name}')
+    index = StaticAsset('index.html', html, 'text/html; charset=utf-8')
+    assets = {'index.html': (index, False)}
+    for asset in (style, worker, script):
+        assets[asset.name] = (asset, False)
+        assets[asset.hashed_name] = (asset, True)
+    return assets
+
+
+STATIC_ASSETS = build_static_assets()
+
+# 首页
+@app.route('/')
+def index():
+    asset, immutable = STATIC_ASSETS['index.html']
+    return asset.response(immutable)
+
+@app.route('/static/<path:path>')
+def send_static(path):
+    if path not in STATIC_ASSETS:
+        return jsonify({"error": "not found"}), 404
+    asset, immutable = STATIC_ASSETS[path]
+    return asset.response(immutable)
+
+@app.route('/templates/index.html')
+def get_index_template():
+    asset, immutable = STATIC_ASSETS['index.html']
+    return asset.response(immutable)
+
+@app.before_request
+def restrict_role_routes():
+    """proxy和agent角色只提供 /ollama/*，dashboard角色不提供代理"""
+    role = app.config.get('ROLE', 'all')
+    is_proxy = request.path.startswith('/ollama/')
+    if (role in ('proxy', 'agent') and not is_proxy) or (role == 'dashboard' and is_proxy):
+        return jsonify({"error": f"not served by the {role} role"}), 404
+
+@app.after_request
+def compress_api_response(response):
+    """按Accept-Encoding压缩较大的API响应，优先zstd，其次gzip"""
+    if (not request.path.startswith('/api/') or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < API_COMPRESS_MIN_BYTES:
+        return response
+    accepted = request.accept_encodings
+    if zstandard is not None and accepted['zstd']:
+        response.set_data(zstandard.ZstdCompressor(level=3).compress(body))
+        response.headers['Content-Encoding'] = 'zstd'
+    elif accepted['gzip']:
+        # 级别1的压缩率与默认级别相差不到一成，耗时约为其四分之一
+        response.set_data(gzip.compress(body, compresslevel=1, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+# 统计汇总，API和仪表板快照共用
+def model_stats(db, hours):
+    result = []
+    for row in db.get_model_usage_stats(hours):
+        result.append({
+            "model_name": row[0],
+            "request_count": row[1],
+            "total_input_tokens": row[2] or 0,
+            "total_output_tokens": row[3] or 0,
+            "avg_response_time": row[4] or 0
+        })
+    return result
+
+def ip_stats(db, hours):
+    result = []
+    for row in db.get_client_ip_stats(hours):
+        result.append({
+            "client_ip": row[0],
+            "request_count": row[1]
+        })
+    return result
+
+def energy_stats(db, hours):
+    """
+    能耗与GPU效率统计
+
+    GPU功耗按采样值阶梯延续到下一次采样(间隔超过两个采样周期时只延续一个周期，
+    其余时间视为缺失)，对时间积分得到焦耳数。每个时间段的能耗由当时正在处理的
+    请求平分(开始时间 = 记录时间 - 响应时间)，没有请求时计为空闲能耗；利用率按
+    同样方式分摊为"利用率·秒"。按模型和客户端IP汇总每千token的Wh以及
+    每%利用率的输出token速率(tokens/s per %util)。
+    """
+    now = time.time()
+    events = []
+    samples = db.get_power_samples(hours)
+    for i, (timestamp, power, util) in enumerate(samples):
+        at = datetime.fromisoformat(timestamp).timestamp()
+        events.append((at, 0, power or 0.0, util or 0.0))
+        following = datetime.fromisoformat(samples[i + 1][0]).timestamp() if i + 1 < len(samples) else None
+        if following is None or following - at > 2 * MONITOR_INTERVAL:
+            events.append((min(at + MONITOR_INTERVAL, max(now, at)), 1, None, None))
+
+    intervals = db.get_request_intervals(hours)
+    for idx, (timestamp, response_time, *_rest) in enumerate(intervals):
+        end = datetime.fromisoformat(timestamp).timestamp()
+        events.append((end - max(response_time, 0.0), 2, idx, None))
+        events.append((end, 3, idx, None))
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    # 累计量：每个在途请求分得的能耗、利用率·秒和有功耗数据的秒数，
+    # 请求的份额 = 结束时的累计值 - 开始时的累计值
+    share_e = share_u = covered = 0.0
+    total_e = idle_e = 0.0
+    power = util = None
+    active = 0
+    started = {}
+    attributed = [None] * len(intervals)
+    last = events[0][0] if events else now
+    for at, kind, value, extra in events:
+        dt = at - last
+        if dt > 0 and power is not None:
+            energy = power * dt
+            total_e += energy
+            covered += dt
+            if active:
+                share_e += energy / active
+                share_u += util * dt / active
+            else:
+                idle_e += energy
+        last = at
+        if kind == 0:
+            power, util = value, extra
+        elif kind == 1:
+            power = util = None
+        elif kind == 2:
+            active += 1
+            started[value] = (share_e, share_u, covered)
+        else:
+            active -= 1
+            e0, u0, c0 = started.pop(value)
+            attributed[value] = (share_e - e0, share_u - u0, covered - c0)
+
+    def summarize(key_index, key_name):
+        groups = {}
+        for row, (joules, util_seconds, seconds) in zip(intervals, attributed):
+            entry = groups.setdefault(row[key_index] or '', [0, 0, 0, 0.0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += row[4] or 0
+            entry[2] += row[5] or 0
+            entry[3] += joules
+            entry[4] += util_seconds
+            entry[5] += seconds
+        result = []
+        for name, (count, input_tokens, output_tokens, joules, util_seconds, seconds) in groups.items():
+            wh = joules / 3600
+            tokens = input_tokens + output_tokens
+            result.append({
+                key_name: name,
+                "requests": count,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "joules": round(joules, 3),
+                "wh": round(wh, 6),
+                "wh_per_1k_tokens": round(wh * 1000 / tokens, 6) if tokens and seconds else None,
+                "wh_per_1k_output_tokens": round(wh * 1000 / output_tokens, 6) if output_tokens and seconds else None,
+                "tokens_per_sec_per_util": round(output_tokens / util_seconds, 4) if util_seconds else None,
+                "avg_power_w": round(joules / seconds, 2) if seconds else None,
+            })
+        return sorted(result, key=lambda row: row['joules'], reverse=True)
+
+    tokens = sum((row[4] or 0) + (row[5] or 0) for row in intervals)
+    attributed_e = total_e - idle_e
+    return {
+        "hours": hours,
+        "total_joules": round(total_e, 3),
+        "attributed_joules": round(attributed_e, 3),
+        "idle_joules": round(idle_e, 3),
+        "total_wh": round(total_e / 3600, 6),
+        "covered_seconds": round(covered, 1),
+        "wh_per_1k_tokens": round(attributed_e / 3.6 / tokens, 6) if tokens and attributed_e else None,
+        "models": summarize(2, "model_name"),
+        "clients": summarize(3, "client_ip"),
+    }
+
+def concurrency_stats(db, hours, saturation=0.9, min_samples=3):
+    """
+    并发、饱和与排队统计
+
+    多个代理进程的并发采样按采样周期对齐后相加。按平均并发数分档统计输出token速率，
+    样本数不少于min_samples的档位中速率最高者为吞吐上限，达到上限saturation比例的
+    最小并发数即饱和点。排队按Little定律估算：到达率 x 平均耗时 = 平均在途数，
+    其中Ollama报告的计算耗时部分对应占用的并行槽位，其余为排队。
+    """
+    grid = MONITOR_INTERVAL
+    buckets = {}
+    for row in db.get_concurrency_samples(hours):
+        at = datetime.fromisoformat(row['timestamp']).timestamp()
+        entry = buckets.setdefault((row['model_name'], int(at // grid)), [0.0, 0.0, 0, 0, 0, 0.0, 0.0])
+        entry[0] = max(entry[0], row['interval'] or 0.0)
+        entry[1] += row['avg_inflight'] or 0.0
+        entry[2] += row['peak_inflight'] or 0
+        entry[3] += row['completed'] or 0
+        entry[4] += row['output_tokens'] or 0
+        entry[5] += row['latency_seconds'] or 0.0
+        entry[6] += row['compute_seconds'] or 0.0
+
+    models = {}
+    for (model_name, _), (interval, avg_inflight, peak, completed, tokens, latency, compute) in buckets.items():
+        stats = models.setdefault(model_name, {"seconds": 0.0, "area": 0.0, "peak": 0, "completed": 0,
+                                               "tokens": 0, "latency": 0.0, "compute": 0.0, "levels": {}})
+        stats['seconds'] += interval
+        stats['area'] += avg_inflight * interval
+        stats['peak'] = max(stats['peak'], peak)
+        stats['completed'] += completed
+        stats['tokens'] += tokens
+        stats['latency'] += latency
+        stats['compute'] += compute
+        level = stats['levels'].setdefault(round(avg_inflight), [0, 0.0, 0])
+        level[0] += 1
+        level[1] += interval
+        level[2] += tokens
+
+    result = []
+    for model_name, stats in models.items():
+        seconds = stats['seconds']
+        completed = stats['completed']
+        arrival_rate = completed / seconds if seconds else 0.0
+        latency = stats['latency'] / completed if completed else None
+        service = stats['compute'] / completed if completed else None
+        levels = [
+            {"concurrency": level, "samples": n, "seconds": round(secs, 1),
+             "tokens_per_sec": round(tokens / secs, 2) if secs else 0.0}
+            for level, (n, secs, tokens) in sorted(stats['levels'].items())
+        ]
+        eligible = [lv for lv in levels if lv['samples'] >= min_samples and lv['concurrency'] > 0]
+        ceiling = max((lv['tokens_per_sec'] for lv in eligible), default=None)
+        saturation_level = next((lv['concurrency'] for lv in eligible
+                                 if ceiling and lv['tokens_per_sec'] >= saturation * ceiling), None)
+        tokens_per_sec = stats['tokens'] / seconds if seconds else 0.0
+        result.append({
+            "model_name": model_name,
+            "active_seconds": round(seconds, 1),
+            "avg_concurrency": round(stats['area'] / seconds, 3) if seconds else 0.0,
+            "peak_concurrency": stats['peak'],
+            "completed": completed,
+            "arrival_rate": round(arrival_rate, 4),
+            "avg_latency": round(latency, 3) if latency is not None else None,
+            "avg_service_time": round(service, 3) if service is not None else None,
+            "avg_queue_wait": round(latency - service, 3) if completed else None,
+            "littles_law_concurrency": round(arrival_rate * latency, 3) if completed else None,
+            "busy_slots": round(arrival_rate * service, 3) if completed else None,
+            "queued": round(arrival_rate * (latency - service), 3) if completed else None,
+            "tokens_per_sec": round(tokens_per_sec, 2),
+            "ceiling_tokens_per_sec": ceiling,
+            "saturation_concurrency": saturation_level,
+            "utilization": round(tokens_per_sec / ceiling, 3) if ceiling else None,
+            "by_concurrency": levels,
+        })
+    return {"hours": hours, "models": sorted(result, key=lambda row: row['active_seconds'], reverse=True)}
+
+def request_stats(logs):
+    total_requests = len(logs)
+    total_input_tokens = sum(log['input_tokens'] or 0 for log in logs)
+    total_output_tokens = sum(log['output_tokens'] or 0 for log in logs)
+    
+    # 计算平均响应时间
+    response_times = [log['response_time'] for log in logs if log['response_time'] is not None]
+    avg_response_time = sum(response_times) / len(response_times) if response_times else 0
+    
+    return {
+        "total_requests": total_requests,
+        "total_input_tokens": total_input_tokens,
+        "total_output_tokens": total_output_tokens,
+        "avg_response_time": avg_response_time
+    }
+
+def to_columns(rows):
+    """把对象数组转换为列式结构 {"列名": [...]}"""
+    keys = list(rows[0]) if rows else []
+    return {key: [row.get(key) for row in rows] for key in keys}
+
+def rows_response(rows):
+    """
+    返回查询结果
+
+    默认是对象数组；format=columns 时返回列式结构 {"列名": [...]}，
+    省去每行重复的键名，也便于前端直接作为图表数据使用。
+    """
+    if request.args.get('format') == 'columns':
+        return jsonify(to_columns(rows))
+    return jsonify(rows)
+
+# 批量导出：逐块编码，内存占用与导出范围无关
+def export_csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def export_ndjson(columns, chunks):
+    for rows in chunks:
+        if orjson is not None:
+            yield b''.join(orjson.dumps(dict(zip(columns, row))) + b'\n' for row in rows)
+        else:
+            yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows).encode()
+
+
+class ExportSink:
+    """供ParquetWriter写入的输出流：已写入的字节由生成器取走，只记录累计位置"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def export_parquet(columns, types, chunks, compression='snappy'):
+    """每块写成一个行组并立即输出；列类型按SQLite声明类型映射"""
+    mapping = {'INTEGER': pa.int64(), 'REAL': pa.float64()}
+    schema = pa.schema([(name, mapping.get(types[name], pa.string())) for name in columns])
+    sink = ExportSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    for rows in chunks:
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)],
+            schema=schema,
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+def gzip_stream(parts, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for part in parts:
+        data = compressor.compress(part)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _export_time(value):
+    """解析导出时间参数，带时区的值(Z或+02:00)换算为本地时间并去掉时区"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+@app.route('/api/export/<table>')
+def api_export(table):
+    """
+    流式导出一张表
+
+    参数: format=csv|ndjson|parquet，start/end(ISO本地时间，end不含)或hours，
+    columns=逗号分隔的列名，gzip=1压缩输出(Parquet使用文件内gzip编码)
+    """
+    db = OllamaMetricsDB(host=request.args.get('host'))
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson', 'parquet'):
+        return jsonify({"error": f"unsupported format: {fmt}"}), 400
+    if fmt == 'parquet' and pq is None:
+        return jsonify({"error": "parquet export requires pyarrow"}), 501
+    try:
+        available = dict(db.export_columns(table))
+        start = _export_time(request.args.get('start'))
+        end = _export_time(request.args.get('end'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    hours = request.args.get('hours', type=float)
+    if start is None and hours is not None:
+        start = (datetime.now() - timedelta(hours=hours)).isoformat()
+    columns = [c for c in request.args.get('columns', '').split(',') if c] or list(available)
+    unknown = [c for c in columns if c not in available]
+    if unknown:
+        return jsonify({"error": f"unknown columns: {', '.join(unknown)}"}), 400
+
+    compress = request.args.get('gzip') in ('1', 'true')
+    chunks = db.iter_export(table, columns, start, end)
+    filename = table
+    if fmt == 'csv':
+        body, mimetype = export_csv(columns, chunks), 'text/csv'
+    elif fmt == 'ndjson':
+        body, mimetype = export_ndjson(columns, chunks), 'application/x-ndjson'
+    else:
+        body = export_parquet(columns, available, chunks, 'gzip' if compress else 'snappy')
+        mimetype = 'application/vnd.apache.parquet'
+        compress = False
+    filename += f".{fmt}"
+    if compress:
+        body, mimetype = gzip_stream(body), 'application/gzip'
+        filename += ".gz"
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 # API路由
 @app.route('/api/status')
 def api_status():
-    monitor = app.config['MONITOR']
-    return jsonify({
-        "server_status": monitor.get_server_status(),
-        "timestamp": datetime.now().isoformat()
-    })
+    return jsonify(health_prober.status())
+
+@app.route('/api/health/events')
+def api_health_events():
+    db = OllamaMetricsDB()
+    hours = request.args.get('hours', 24, type=int)
+    return jsonify(db.get_health_events(hours))
+
+@app.route('/api/tracing')
+def api_tracing():
+    return jsonify(span_exporter.stats())
+
+@app.route('/api/forward')
+def api_forward():
+    return jsonify(metric_forwarder.status())
+
+@app.route('/api/alerts')
+def api_alerts():
+    return jsonify(alert_engine.status())
+
+@app.route('/api/alerts/events')
+def api_alert_events():
+    db = OllamaMetricsDB()
+    hours = request.args.get('hours', 24, type=int)
+    return jsonify(db.get_alert_events(hours))
+
+@app.route('/api/anomalies')
+def api_anomalies():
+    db = OllamaMetricsDB()
+    hours = request.args.get('hours', 24, type=int)
+    return jsonify(db.get_anomaly_events(hours, request.args.get('metric')))
+
+@app.route('/api/anomalies/baselines')
+def api_anomaly_baselines():
+    return jsonify(anomaly_detector.baselines_state())
+
+@app.route('/api/preload')
+def api_preload():
+    db = OllamaMetricsDB()
+    hours = request.args.get('hours', 24, type=int)
+    result = model_preloader.status()
+    events = {}
+    for event in db.get_preload_events(hours):
+        events[event['event']] = events.get(event['event'], 0) + 1
+    result['events'] = events
+    result['cold_loads'] = db.get_cold_load_stats(hours)
+    return jsonify(result)
+
+@app.route('/api/preload/events')
+def api_preload_events():
+    db = OllamaMetricsDB()
+    hours = request.args.get('hours', 24, type=int)
+    return jsonify(db.get_preload_events(hours))
+
+@app.route('/api/ollama-log')
+def api_ollama_log():
+    db = OllamaMetricsDB()
+    hours = request.args.get('hours', 24, type=int)
+    result = ollama_log_tailer.status()
+    counts = {}
+    for event in db.get_ollama_events(hours):
+        counts[event['event']] = counts.get(event['event'], 0) + 1
+    result['recent'] = counts
+    return jsonify(result)
+
+@app.route('/api/ollama-log/events')
+def api_ollama_log_events():
+    db = OllamaMetricsDB()
+    hours = request.args.get('hours', 24, type=int)
+    return jsonify(db.get_ollama_events(hours, request.args.get('event')))
 
 @app.route('/api/metrics/system')
 def api_system_metrics():
-    db = OllamaMetricsDB()
+    db = OllamaMetricsDB(host=request.args.get('host'))
     hours = request.args.get('hours', 24, type=int)
     metrics = db.get_recent_system_metrics(hours)
-    return jsonify(metrics)
+    return rows_response(metrics)
 
 @app.route('/api/metrics/gpu')
 def api_gpu_metrics():
-    db = OllamaMetricsDB()
+    db = OllamaMetricsDB(host=request.args.get('host'))
     hours = request.args.get('hours', 24, type=int)
     metrics = db.get_recent_gpu_metrics(hours)
-    return jsonify(metrics)
+    return rows_response(metrics)
+
+@app.route('/api/metrics/history')
+def api_metrics_history():
+    db = OllamaMetricsDB(host=request.args.get('host'))
+    table = {'system': 'system_metrics', 'gpu': 'gpu_metrics'}.get(request.args.get('table', 'system'))
+    if table is None:
+        return jsonify({"error": "table must be 'system' or 'gpu'"}), 400
+    columns = [c for c in request.args.get('columns', '').split(',') if c] or None
+    hours = request.args.get('hours', 24 * 30, type=int)
+    step = request.args.get('step', None, type=int)
+    return jsonify(db.get_metrics_history(table, columns, hours, step))
+
+@app.route('/api/analytics/<kind>')
+def api_analytics(kind):
+    if np is None:
+        return jsonify({"error": "numpy is required for analytics"}), 501
+    analytics = MetricsAnalytics(OllamaMetricsDB(host=request.args.get('host')))
+    hours = request.args.get('hours', 24, type=int)
+    model = request.args.get('model')
+    try:
+        if kind == 'percentiles':
+            percentiles = [float(p) for p in request.args.get('p', '50,95,99').split(',') if p]
+            result = analytics.percentiles(
+                request.args.get('metric', 'response_time'), hours,
+                by=request.args.get('by'),
+                bucket=request.args.get('bucket', None, type=int),
+                percentiles=percentiles,
+                model=model
+            )
+        elif kind == 'histogram':
+            result = analytics.histogram(
+                request.args.get('metric', 'response_time'), hours,
+                bins=request.args.get('bins', 50, type=int),
+                by=request.args.get('by'),
+                log=request.args.get('log', '0') in ('1', 'true'),
+                model=model
+            )
+        elif kind == 'correlation':
+            result = analytics.correlation(
+                request.args.get('x', 'gpu_temperature'),
+                request.args.get('y', 'tokens_per_sec'),
+                hours,
+                bucket=request.args.get('bucket', 60, type=int),
+                method=request.args.get('method', 'pearson'),
+                model=model
+            )
+        else:
+            return jsonify({"error": f"unknown analytics kind: {kind}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
 
 @app.route('/api/logs/requests')
 def api_request_logs():
-    db = OllamaMetricsDB()
+    db = OllamaMetricsDB(host=request.args.get('host'))
     hours = request.args.get('hours', 24, type=int)
-    logs = db.get_recent_requests(hours)
-    return jsonify(logs)
+    logs = db.get_recent_requests(hours, since=request.args.get('since'))
+    return rows_response(logs)
 
 @app.route('/api/stats/models')
 def api_model_stats():
-    db = OllamaMetricsDB()
+    db = OllamaMetricsDB(host=request.args.get('host'))
     hours = request.args.get('hours', 24, type=int)
-    stats = db.get_model_usage_stats(hours)
-    result = []
-    for row in stats:
-        result.append({
-            "model_name": row[0],
-            "request_count": row[1],
-            "total_input_tokens": row[2] or 0,
-            "total_output_tokens": row[3] or 0,
-            "avg_response_time": row[4] or 0
-        })
-    return jsonify(result)
+    return jsonify(model_stats(db, hours))
 
 @app.route('/api/stats/ips')
 def api_ip_stats():
-    db = OllamaMetricsDB()
+    db = OllamaMetricsDB(host=request.args.get('host'))
     hours = request.args.get('hours', 24, type=int)
-    stats = db.get_client_ip_stats(hours)
-    result = []
-    for row in stats:
-        result.append({
-            "client_ip": row[0],
-            "request_count": row[1]
-        })
-    return jsonify(result)
+    return jsonify(ip_stats(db, hours))
+
+@app.route('/api/stats/energy')
+def api_energy_stats():
+    db = OllamaMetricsDB(host=request.args.get('host'))
+    hours = request.args.get('hours', 24, type=int)
+    return jsonify(energy_stats(db, hours))
+
+@app.route('/api/stats/concurrency')
+def api_concurrency_stats():
+    db = OllamaMetricsDB(host=request.args.get('host'))
+    hours = request.args.get('hours', 24, type=int)
+    return jsonify(concurrency_stats(db, hours))
+
+@app.route('/api/inflight')
+def api_inflight():
+    if app.config.get('ROLE') == 'dashboard':
+        # 代理请求由proxy进程处理，合并它们经collector写入的快照
+        return jsonify(InflightRegistry.merged(OllamaMetricsDB(), 3 * INFLIGHT_PUBLISH_INTERVAL + 1))
+    return jsonify(inflight_registry.snapshot())
 
 @app.route('/api/stats/requests')
 def api_request_stats():
+    db = OllamaMetricsDB(host=request.args.get('host'))
+    hours = request.args.get('hours', 24, type=int)
+    return jsonify(request_stats(db.get_recent_requests(hours)))
+
+@app.route('/api/dashboard')
+def api_dashboard():
+    snapshot = fleet_registry.snapshots(request.args.get('host')).get()
+    since = request.args.get('since')
+    if since:
+        body, gzipped, etag = snapshot.since(since)
+    else:
+        body, gzipped, etag = snapshot.body, snapshot.gzipped, snapshot.etag
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    if request.accept_encodings['gzip']:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(gzipped, headers=headers, mimetype='application/json')
+    return Response(body, headers=headers, mimetype='application/json')
+
+@app.route('/api/hosts')
+def api_hosts():
+    return jsonify(fleet_registry.list(OllamaMetricsDB()))
+
+@app.route('/api/ingest', methods=['POST'])
+def api_ingest():
+    """接收agent上报的批次，附加host标签后交给写入线程"""
+    if AGENT_TOKEN and request.headers.get('Authorization') != f'Bearer {AGENT_TOKEN}':
+        return jsonify({"error": "invalid agent token"}), 401
+    data = request.get_data()
+    try:
+        header, tables = AgentWriter.decode(data)
+        host = str(header['host'])
+    except (ValueError, KeyError, TypeError, IndexError, zlib.error) as e:
+        return jsonify({"error": f"invalid batch: {str(e)}"}), 400
+    if not host:
+        return jsonify({"error": "invalid batch: empty host"}), 400
+    rows = sum(len(table_rows) for _, _, table_rows in tables)
+    if not fleet_registry.accept(host, header.get('batch_id'), len(data), rows,
+                                 header.get('status'), request.remote_addr):
+        return jsonify({"accepted": 0, "duplicate": True}), 200
+    for table, columns, table_rows in tables:
+        metrics_writer.submit('host_rows', {"table": table, "host": host, "columns": columns, "rows": table_rows,
+                                            "batch_id": header.get('batch_id')})
+    return jsonify({"accepted": rows}), 202
+
+@app.route('/api/usage')
+def api_usage():
     db = OllamaMetricsDB()
     hours = request.args.get('hours', 24, type=int)
-    logs = db.get_recent_requests(hours)
-    
-    total_requests = len(logs)
-    total_input_tokens = sum(log['input_tokens'] for log in logs)
-    total_output_tokens = sum(log['output_tokens'] for log in logs)
-    
-    # 计算平均响应时间
-    response_times = [log['response_time'] for log in logs if log['response_time'] is not None]
-    avg_response_time = sum(response_times) / len(response_times) if response_times else 0
-    
+    client = request.args.get('client')
+    totals = {}
+    for row in db.get_usage(hours, client):
+        entry = totals.setdefault(row['client'], {
+            "client": row['client'], "requests": 0, "input_tokens": 0, "output_tokens": 0
+        })
+        entry['requests'] += row['requests'] or 0
+        entry['input_tokens'] += row['input_tokens'] or 0
+        entry['output_tokens'] += row['output_tokens'] or 0
+    live = usage_ledger.snapshot()
+    if client:
+        live = [c for c in live if c['client'] == client]
     return jsonify({
-        "total_requests": total_requests,
-        "total_input_tokens": total_input_tokens,
-        "total_output_tokens": total_output_tokens,
-        "avg_response_time": avg_response_time
+        "live": live,
+        "totals": sorted(totals.values(), key=lambda c: c['input_tokens'] + c['output_tokens'], reverse=True)
+    })
+
+@app.route('/api/capture')
+def api_capture_list():
+    hours = request.args.get('hours', 24, type=int)
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify(capture_store.list(hours, limit))
+
+@app.route('/api/capture/<int:log_id>')
+def api_capture_by_log(log_id):
+    log = OllamaMetricsDB().get_request_log(log_id)
+    if log is None or not log.get('request_uid'):
+        return jsonify({"error": "request log not found"}), 404
+    return api_capture_by_uid(log['request_uid'])
+
+@app.route('/api/capture/uid/<request_uid>')
+def api_capture_by_uid(request_uid):
+    try:
+        record = capture_store.get(request_uid)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 501
+    if record is None:
+        return jsonify({"error": "request was not captured"}), 404
+    return jsonify(record)
+
+# 逐跳头部不能原样转发，内容长度和编码由本端重新决定
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+    'trailers', 'transfer-encoding', 'upgrade', 'content-length', 'content-encoding'
+}
+# 计入用量和配额的推理接口
+INFERENCE_PATHS = ('api/generate', 'api/chat', 'api/embed', 'api/embeddings')
+
+def _response_headers(resp):
+    return [(name, value) for (name, value) in resp.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS]
+
+def _log_inference(client, client_ip, model_name, path, start_time, status_code, result, request_uid=None):
+    """记录推理请求日志并登记到用量账本"""
+    input_tokens = result.get('prompt_eval_count', 0) or 0
+    output_tokens = result.get('eval_count', 0) or 0
+    load_duration = result.get('load_duration')
+    response_time = time.time() - start_time
+    usage_ledger.record(client, model_name, input_tokens, output_tokens)
+    if status_code == 200:
+        anomaly_detector.observe_inference(model_name, response_time, result)
+    metrics_writer.submit('request_log', {
+        "timestamp": datetime.now().isoformat(),
+        "client_ip": client_ip,
+        "model_name": model_name,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "response_time": response_time,
+        "status_code": status_code,
+        "endpoint": f"/{path}",
+        "request_uid": request_uid,
+        "load_duration": load_duration / 1e9 if load_duration is not None else None
     })
 
+def _relay_stream(resp, on_done, keep_body=False, on_chunk=None):
+    """
+    逐行转发NDJSON流
+
+    只保留最后一行，结束时解析其中的token统计，不对中间的每个chunk做JSON解析；
+    keep_body为True(该请求被采样)时保留全部行，on_chunk以每行字节数调用。
+    客户端提前断开时同样关闭上游连接并记录。
+    """
+    last = b''
+    lines = []
+    try:
+        for line in resp.iter_lines(chunk_size=None):
+            if line:
+                last = line
+                if on_chunk is not None:
+                    on_chunk(len(line) + 1)
+                if keep_body:
+                    lines.append(line)
+                yield line + b'\n'
+    finally:
+        resp.close()
+        try:
+            result = json.loads(last) if last else {}
+        except ValueError:
+            result = {}
+        on_done(result if isinstance(result, dict) and result.get('done') else {},
+                b'\n'.join(lines) if keep_body else None)
+
 # Ollama API代理
 @app.route('/ollama/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def proxy_ollama(path):
-    db = OllamaMetricsDB()
     start_time = time.time()
     client_ip = request.remote_addr
     
+    # 后端已判定离线时直接返回503，不占用线程等待超时
+    if health_prober.is_down():
+        response = jsonify({"error": "Ollama is unavailable", "state": health_prober.state})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(math.ceil(HEALTH_FAST_INTERVAL))
+        return response
+
     url = f"{OLLAMA_HOST}/{path}"
     headers = {key: value for (key, value) in request.headers if key != 'Host'}
     
@@ -1518,33 +7718,94 @@ def proxy_ollama(path):
             resp = requests.get(url, headers=headers, params=request.args)
         elif request.method == 'POST':
             json_data = request.get_json(silent=True)
+            parsed_ns = time.time_ns()
             if json_data:
-                # 对于API请求，记录输入输出token
-                if path == 'api/generate' or path == 'api/chat':
+                # 对于推理请求，检查配额并记录输入输出token
+                if path in INFERENCE_PATHS:
+                    trace = span_exporter.start_trace(request.headers, f"POST /{path}", int(start_time * 1e9))
+                    client = UsageLedger.client_id(request.headers, client_ip)
+                    allowed, retry_after, reason = usage_ledger.admit(client)
+                    if trace is not None:
+                        trace.span('proxy.parse', trace.start_ns, parsed_ns)
+                        trace.span('proxy.admit', parsed_ns, time.time_ns(), attributes={"client": client})
+                    if not allowed:
+                        if trace is not None:
+                            trace.finish(time.time_ns(), 429)
+                        response = jsonify({"error": reason})
+                        response.status_code = 429
+                        response.headers['Retry-After'] = str(retry_after)
+                        return response
+
                     model_name = json_data.get('model', '')
-                    stream = json_data.get('stream', False)
-                    
-                    resp = requests.post(url, headers=headers, json=json_data)
-                    response_time = time.time() - start_time
-                    
-                    # 提取token信息
-                    if resp.status_code == 200 and not stream:
-                        result = resp.json()
-                        input_tokens = result.get('prompt_eval_count', 0)
-                        output_tokens = result.get('eval_count', 0)
-                        
-                        # 保存请求日志
-                        log_data = {
-                            "timestamp": datetime.now().isoformat(),
-                            "client_ip": client_ip,
-                            "model_name": model_name,
-                            "input_tokens": input_tokens,
-                            "output_tokens": output_tokens,
-                            "response_time": response_time,
-                            "status_code": resp.status_code,
-                            "endpoint": f"/{path}"
-                        }
-                        db.save_request_log(log_data)
+                    if 'keep_alive' not in json_data:
+                        keep_alive = model_preloader.keep_alive_for(model_name)
+                        if keep_alive is not None:
+                            json_data['keep_alive'] = keep_alive
+                    request_uid = uuid.uuid4().hex
+                    capture = capture_store.should_capture(model_name, client_ip)
+                    # 与Ollama一致，generate/chat未指定stream时默认流式
+                    stream = path in ('api/generate', 'api/chat') and json_data.get('stream', True)
+                    entry = inflight_registry.begin(request_uid, model_name, client, client_ip, f"/{path}")
+                    if trace is not None:
+                        # 上游Ollama收到的traceparent指向代理的客户端span
+                        upstream_id = trace.new_span_id()
+                        headers = {k: v for k, v in headers.items() if k.lower() != 'traceparent'}
+                        headers['traceparent'] = trace.traceparent(upstream_id)
+                        trace.attributes.update({"url.path": f"/{path}", "client.address": client_ip,
+                                                 "gen_ai.request.model": model_name, "ollama.request_uid": request_uid})
+                    upstream_ns = time.time_ns()
+                    try:
+                        resp = requests.post(url, headers=headers, json=json_data, stream=stream)
+                    except Exception as e:
+                        inflight_registry.end(entry, {})
+                        if trace is not None:
+                            trace.span('upstream', upstream_ns, time.time_ns(), kind=RequestTrace.CLIENT,
+                                       span_id=upstream_id, error=str(e))
+                            trace.finish(time.time_ns(), 500)
+                        raise
+                    headers_ns = time.time_ns()
+                    response_headers = _response_headers(resp) + [('X-Request-Id', request_uid)]
+
+                    def on_done(result, body=None, size=None, status_code=resp.status_code):
+                        done_ns = time.time_ns()
+                        inflight_registry.end(entry, result, size)
+                        _log_inference(client, client_ip, model_name, path, start_time, status_code, result, request_uid)
+                        if capture:
+                            capture_store.submit({
+                                "request_uid": request_uid,
+                                "timestamp": datetime.fromtimestamp(start_time).isoformat(),
+                                "client_ip": client_ip,
+                                "model_name": model_name,
+                                "endpoint": f"/{path}",
+                                "status_code": status_code,
+                                "response_time": time.time() - start_time,
+                                "stream": bool(stream),
+                                "request": json_data,
+                                "response": body.decode('utf-8', 'replace') if body is not None else None
+                            })
+                        if trace is not None:
+                            trace.span('upstream', upstream_ns, done_ns, kind=RequestTrace.CLIENT, span_id=upstream_id,
+                                       attributes={"server.address": OLLAMA_HOST, "http.response.status_code": status_code})
+                            trace.span('upstream.headers', upstream_ns, headers_ns, upstream_id)
+                            if stream:
+                                trace.span('proxy.relay', headers_ns, done_ns,
+                                           attributes={"bytes": entry.bytes, "chunks": entry.tokens})
+                            trace.ollama_phases(result, done_ns, upstream_id)
+                            trace.span('monitor.log_request', done_ns, time.time_ns())
+                            trace.attributes.update({"gen_ai.usage.input_tokens": result.get('prompt_eval_count'),
+                                                     "gen_ai.usage.output_tokens": result.get('eval_count')})
+                            trace.finish(time.time_ns(), status_code)
+
+                    if stream:
+                        return Response(_relay_stream(resp, on_done, keep_body=capture, on_chunk=entry.add_chunk),
+                                        resp.status_code, response_headers)
+                    try:
+                        result = resp.json() if resp.status_code == 200 else {}
+                    except ValueError:
+                        result = {}
+                    on_done(result if isinstance(result, dict) else {}, resp.content if capture else None,
+                            len(resp.content))
+                    return resp.content, resp.status_code, response_headers
                 else:
                     resp = requests.post(url, headers=headers, json=json_data)
             else:
@@ -1556,8 +7817,7 @@ def proxy_ollama(path):
         else:
             return jsonify({"error": "Method not allowed"}), 405
         
-        response_headers = [(name, value) for (name, value) in resp.raw.headers.items()]
-        return resp.content, resp.status_code, response_headers
+        return resp.content, resp.status_code, _response_headers(resp)
     except Exception as e:
         logger.error(f"代理请求异常: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -1565,14 +7825,154 @@ def proxy_ollama(path):
 def run_monitor():
     """运行监控线程"""
     monitor = OllamaMonitor()
+    health_prober.start()
+    ollama_log_tailer.start()
+    if PRELOAD_ENABLED:
+        model_preloader.start()
     threading.Thread(target=monitor.run, daemon=True).start()
     return monitor
 
-def run_web_server(monitor):
+def run_web_server(monitor, host=None, port=None, threads=10, reuse_port=False):
     """运行Web服务器"""
     app.config['MONITOR'] = monitor
-    logger.info(f"Web服务器正在启动，地址为 http://{WEB_HOST}:{WEB_PORT}")
-    serve(app, host=WEB_HOST, port=WEB_PORT, threads=10)
+    host = host or WEB_HOST
+    port = port or WEB_PORT
+    logger.info(f"Web服务器正在启动，地址为 http://{host}:{port}")
+    if not reuse_port:
+        serve(app, host=host, port=port, threads=threads)
+        return
+    # 多个worker进程以SO_REUSEPORT绑定同一端口，由内核分发连接
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    serve(app, sockets=[sock], threads=threads)
+
+def run_collector(address):
+    """运行collector角色：采集指标，并接收其他进程转发的写入"""
+    monitor = run_monitor()
+    server = IngestServer(address, IngestHandler)
+    logger.info(f"collector正在接收写入，地址为 {address[0]}:{address[1]}")
+    try:
+        server.serve_forever()
+    finally:
+        monitor.stop()
+        ollama_log_tailer.stop()
+        metrics_writer.flush()
+
+def run_agent(aggregator):
+    """运行agent角色：采集本机指标并按批次上报给聚合器，不写本地数据库"""
+    global metrics_writer
+    if not aggregator:
+        raise SystemExit("agent角色需要 --aggregator 或 AGENT_AGGREGATOR_URL")
+    metrics_writer = AgentWriter(aggregator)
+    metrics_writer.start()
+    # 预加载和keep_alive策略依赖本地的请求历史，agent上不启用；配额只按本进程启动后的用量计算
+    model_preloader.enabled = False
+    model_preloader.issue_preloads = False
+    usage_ledger._primed = True
+    monitor = AgentMonitor(metrics_writer)
+    health_prober.start()
+    # 代理请求的并发采样随批次上报，聚合器按主机查看
+    inflight_registry.start()
+    threading.Thread(target=monitor.run, daemon=True).start()
+    logger.info(f"agent {metrics_writer.host_name} 正在上报到 {metrics_writer.url}")
+    return monitor
+
+def spawn_workers(argv, workers):
+    """以相同参数(去掉--workers)启动多个worker进程并等待它们退出"""
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == '--workers':
+            skip = True
+        elif not arg.startswith('--workers='):
+            args.append(arg)
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__)] + args + ['--reuse-port'])
+             for _ in range(workers)]
+    try:
+        for proc in procs:
+            proc.wait()
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Ollama Monitor")
+    parser.add_argument('--role', choices=['all', 'proxy', 'collector', 'dashboard', 'agent'], default='all',
+                        help="all: 单进程运行全部功能; collector: 采集指标并统一写库; "
+                             "proxy: 只提供 /ollama/* 代理; dashboard: 只提供仪表板和 /api/*; "
+                             "agent: 采集本机指标并上报给聚合器，同时提供 /ollama/* 代理")
+    parser.add_argument('--host', help=f"监听地址(默认 {WEB_HOST})")
+    parser.add_argument('--port', type=int, help=f"监听端口(默认 {WEB_PORT})")
+    parser.add_argument('--threads', type=int, default=10, help="每个进程的waitress线程数")
+    parser.add_argument('--workers', type=int, default=1, help="proxy/dashboard角色的进程数，共享同一端口")
+    parser.add_argument('--collector', help=f"collector地址 host:port(默认 {COLLECTOR_HOST}:{COLLECTOR_PORT})")
+    parser.add_argument('--aggregator', help="agent角色上报的聚合器地址(默认 AGENT_AGGREGATOR_URL)")
+    parser.add_argument('--reuse-port', action='store_true', help=argparse.SUPPRESS)
+    return parser
+
+def main(argv=None):
+    global metrics_writer
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_arg_parser().parse_args(argv)
+    if args.collector:
+        host, _, port = args.collector.rpartition(':')
+        collector = (host or COLLECTOR_HOST, int(port))
+    else:
+        collector = (COLLECTOR_HOST, COLLECTOR_PORT)
+
+    if args.workers > 1:
+        if args.role not in ('proxy', 'dashboard'):
+            raise SystemExit("--workers 只适用于 proxy 和 dashboard 角色")
+        if args.role == 'proxy' and UsageLedger.enabled():
+            # 配额计数保存在各进程内存中，N个worker时实际上限会变为配置值的N倍
+            raise SystemExit("配置了 QUOTA_* 时 proxy 角色不能使用 --workers，各进程的配额计数不共享")
+        spawn_workers(argv, args.workers)
+        return
+
+    app.config['ROLE'] = args.role
+    if args.role == 'collector':
+        run_collector(collector)
+        return
+
+    monitor = None
+    if args.role in ('all', 'proxy'):
+        inflight_registry.start()
+    if args.role == 'agent':
+        monitor = run_agent(args.aggregator or AGENT_AGGREGATOR_URL)
+    elif args.role == 'all':
+        # 启动监控
+        monitor = run_monitor()
+    else:
+        # 状态变化由collector记录，这里只用于快速失败和状态显示
+        health_prober.record_events = False
+        health_prober.start()
+        model_preloader.issue_preloads = False
+        # 只有collector写数据库：代理的请求日志和dashboard收到的agent批次都转发给它
+        metrics_writer = RemoteWriter(collector)
+        if args.role == 'proxy':
+            inflight_registry.publish()
+        if args.role == 'dashboard':
+            dashboard_snapshots.run_periodic(MONITOR_INTERVAL)
+            fleet_registry.rebuild_interval = MONITOR_INTERVAL
+
+    try:
+        # 启动Web服务器
+        run_web_server(monitor, args.host, args.port, args.threads, args.reuse_port)
+    except KeyboardInterrupt:
+        logger.info("接收到中断信号，正在关闭...")
+    except Exception as e:
+        logger.error(f"程序异常: {str(e)}")
+    finally:
+        if monitor is not None:
+            monitor.stop()
+        ollama_log_tailer.stop()
+        metrics_writer.flush()
 
 # 增加系统监控守护进程功能
 def write_systemd_service():
@@ -1604,26 +8004,9 @@ WantedBy=multi-user.target
     print("sudo systemctl start ollama-monitor")
 
 if __name__ == "__main__":
-    # 确保必要的目录存在
-    if not os.path.exists('templates'):
-        os.makedirs('templates')
-    if not os.path.exists('static'):
-        os.makedirs('static')
-    
     # 生成系统服务文件
     # if '--install' in sys.argv:
     #     write_systemd_service()
     #     sys.exit(0)
     
-    # 启动监控
-    monitor = run_monitor()
-    
-    try:
-        # 启动Web服务器
-        run_web_server(monitor)
-    except KeyboardInterrupt:
-        logger.info("接收到中断信号，正在关闭...")
-        monitor.stop()
-    except Exception as e:
-        logger.error(f"程序异常: {str(e)}")
-        monitor.stop()
\ No newline at end of file
+    main()
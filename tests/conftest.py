@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import common  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def monitor(tmp_path_factory):
+    """在临时目录中导入ollama_monitor，数据库和归档都写到该目录"""
+    workdir = tmp_path_factory.mktemp("monitor")
+    m = common.import_monitor(str(workdir))
+    m.DB_FILE = str(workdir / "ollama_metrics.db")
+    m.ARCHIVE_DIR = str(workdir / "archive")
+    return m
+
+
+@pytest.fixture
+def submitted(monitor, monkeypatch):
+    """把提交给metrics_writer的写入记录到列表中，代替落库"""
+    items = []
+
+    class Recorder(monitor.MetricsWriter):
+        def submit(self, kind, payload):
+            items.append((kind, payload))
+
+    monkeypatch.setattr(monitor, "metrics_writer", Recorder())
+    return items
@@ -0,0 +1,33 @@
+import pytest
+
+
+def test_agent_batch_round_trip(monitor):
+    writer = monitor.AgentWriter("http://aggregator", host_name="gpu-a")
+    concurrency = {
+        "timestamp": "2025-01-01T00:00:00", "model_name": "llama3.2:3b", "interval": 5.0, "inflight": 2,
+        "avg_inflight": 1.5, "peak_inflight": 3, "completed": 4, "output_tokens": 100,
+        "latency_seconds": 2.5, "compute_seconds": 3.0,
+    }
+    log = {
+        "timestamp": "2025-01-01T00:00:01", "client_ip": "10.0.0.5", "model_name": "llama3.2:3b",
+        "input_tokens": 12, "output_tokens": 34, "response_time": 1.25, "status_code": 200,
+        "endpoint": "/api/chat", "request_uid": "abc", "load_duration": 0.0,
+    }
+    writer.write([("concurrency_sample", concurrency), ("request_log", log), ("usage", {})])
+    header, tables = monitor.AgentWriter.decode(writer.encode(writer.rows, status={"state": "up"}))
+    assert header["host"] == "gpu-a"
+    assert header["status"] == {"state": "up"}
+    decoded = {table: [dict(zip(columns, row)) for row in rows] for table, columns, rows in tables}
+    assert decoded == {"concurrency_metrics": [concurrency], "request_logs": [log]}
+
+
+def test_agent_batch_rejects_unknown_table(monitor, tmp_path):
+    frame = monitor.MetricsArchive(str(tmp_path)).encode("models", [("2025-01-01T00:00:00",)],
+                                                          columns=[("timestamp", "ts")])
+    header = b'{"host":"gpu-a"}'
+    data = (monitor.AgentWriter.MAGIC + len(header).to_bytes(4, "little") + header
+            + len(frame).to_bytes(4, "little") + frame)
+    with pytest.raises(ValueError):
+        monitor.AgentWriter.decode(data)
+    with pytest.raises(ValueError):
+        monitor.AgentWriter.decode(b"OMA1" + data[4:])
@@ -0,0 +1,65 @@
+import pytest
+
+
+@pytest.fixture
+def engine(monitor, submitted):
+    engine = monitor.AlertEngine()
+    engine.load_rules([
+        {"name": "slow", "metric": "response_time", "stat": "avg", "window": 60, "op": ">", "threshold": 5,
+         "for": 30, "repeat": 120},
+        {"name": "busy", "metric": "gpu_util", "label": "GPU-0", "stat": "max", "window": 60,
+         "op": ">=", "threshold": 90},
+    ])
+    return engine
+
+
+def states(notifications):
+    return [(event["rule"], event["label"], event["state"]) for event in notifications]
+
+
+def test_pending_firing_repeat_resolved(engine, submitted):
+    engine.observe("response_time", "llama", 8, at=1000)
+    # 条件满足但未持续for秒
+    assert engine.evaluate(now=1000) == []
+    assert engine.status()["active"][0]["state"] == "pending"
+    fired = engine.evaluate(now=1030)
+    assert states(fired) == [("slow", "llama", "firing")]
+    assert fired[0]["value"] == 8
+    assert engine.evaluate(now=1040) == []
+    engine.observe("response_time", "llama", 9, at=1100)
+    # 设置了repeat时持续触发的告警定期重复通知
+    assert states(engine.evaluate(now=1150)) == [("slow", "llama", "firing")]
+    engine.observe("response_time", "llama", 1, at=1160)
+    assert states(engine.evaluate(now=1160)) == [("slow", "llama", "resolved")]
+    assert engine.status()["active"] == []
+    assert [kind for kind, _ in submitted] == ["alert_event"] * 3
+
+
+def test_pending_clears_without_notification(engine):
+    engine.observe("response_time", "llama", 8, at=1000)
+    engine.evaluate(now=1000)
+    engine.observe("response_time", "llama", 0, at=1010)
+    assert engine.evaluate(now=1010) == []
+    assert engine.status()["active"] == []
+
+
+def test_labels_and_expired_windows(engine):
+    engine.observe("gpu_util", "GPU-1", 99, at=1000)
+    assert engine.evaluate(now=1000) == []
+    engine.observe("gpu_util", "GPU-0", 95, at=1000)
+    assert states(engine.evaluate(now=1000)) == [("busy", "GPU-0", "firing")]
+    # 窗口内没有样本后按条件不满足处理
+    resolved = engine.evaluate(now=1100)
+    assert states(resolved) == [("busy", "GPU-0", "resolved")]
+    assert resolved[0]["value"] is None
+
+
+def test_invalid_rules_are_skipped(monitor):
+    engine = monitor.AlertEngine()
+    engine.load_rules([
+        {"name": "bad-op", "metric": "x", "op": "~", "threshold": 1},
+        {"name": "bad-stat", "metric": "x", "stat": "median", "threshold": 1},
+        {"name": "no-threshold", "metric": "x"},
+        {"name": "ok", "metric": "x", "stat": "p95", "threshold": 1},
+    ])
+    assert [rule.name for rule in engine.rules] == ["ok"]
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def client(monitor, tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "DB_FILE", str(tmp_path / "analytics.db"))
+    db = monitor.OllamaMetricsDB()
+    now = datetime.now()
+    db.save_request_logs([{
+        "timestamp": (now - timedelta(minutes=i)).isoformat(),
+        "client_ip": "10.0.0.1",
+        "model_name": "llama3.2:3b",
+        "input_tokens": 10,
+        "output_tokens": 20,
+        "response_time": float(i + 1),
+        "status_code": 200,
+        "endpoint": "/api/chat",
+        "load_duration": 0.0,
+    } for i in range(10)])
+    return monitor.app.test_client()
+
+
+def test_percentile_bounds(client):
+    [group] = client.get("/api/analytics/percentiles?p=0,100").get_json()["groups"]
+    assert (group["p0"], group["p100"], group["count"]) == (1.0, 10.0, 10)
+
+
+@pytest.mark.parametrize("query", [
+    "percentiles?p=150",
+    "percentiles?p=-5",
+    "percentiles?p=50,nan",
+    "percentiles?bucket=0",
+    "percentiles?bucket=-60",
+    "correlation?x=response_time&y=output_tokens&bucket=0",
+    "correlation?x=response_time&y=output_tokens&bucket=-1",
+])
+def test_invalid_parameters_are_rejected(client, query):
+    response = client.get(f"/api/analytics/{query}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_request_intervals_exclude_self_test(monitor, client):
+    db = monitor.OllamaMetricsDB()
+    db.save_request_log({
+        "timestamp": datetime.now().isoformat(),
+        "client_ip": "127.0.0.1",
+        "model_name": "llama3.2:3b",
+        "input_tokens": 5,
+        "output_tokens": 5,
+        "response_time": 0.5,
+        "status_code": 200,
+        "endpoint": monitor.OllamaMetricsDB.SELF_TEST_ENDPOINT,
+        "load_duration": 0.0,
+    })
+    intervals = db.get_request_intervals(1)
+    assert len(intervals) == 10
+    assert all(row[3] == "10.0.0.1" for row in intervals)
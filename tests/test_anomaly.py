@@ -0,0 +1,12 @@
+def test_long_answers_do_not_look_slow(monitor, submitted, monkeypatch):
+    """基线按每输出token耗时计算，输出变长但每token速度不变时不报异常"""
+    monkeypatch.setattr(monitor, "ANOMALY_WARMUP", 5)
+    detector = monitor.AnomalyDetector()
+    for i in range(50):
+        tokens = 100 + i % 5
+        detector.observe_inference("m", tokens * 0.02, {"eval_count": tokens, "eval_duration": tokens * 2e7})
+    detector.observe_inference("m", 2000 * 0.02, {"eval_count": 2000, "eval_duration": 2000 * 2e7})
+    assert [kind for kind, _ in submitted] == []
+    # 每token耗时变为十倍时报异常
+    detector.observe_inference("m", 100 * 0.2, {"eval_count": 100, "eval_duration": 100 * 2e7})
+    assert [event["metric"] for kind, event in submitted if kind == "anomaly_event"] == ["time_per_token"]
@@ -0,0 +1,40 @@
+import math
+
+COLUMNS = [("timestamp", "ts"), ("count", "int"), ("scaled", "float"), ("ratio", "float"), ("label", "text")]
+ROWS = [
+    ("2025-01-01T00:00:00.123456", 1, 0.5, 1 / 3, "a"),
+    ("2025-01-01T00:00:05", -7, None, 2.0, None),
+    ("2025-01-01T00:00:10", None, 12.25, float("nan"), "b"),
+    ("2025-01-01T00:00:15", 2 ** 40, 0.0, -1e-300, "a"),
+]
+
+
+def test_archive_round_trip(monitor, tmp_path):
+    archive = monitor.MetricsArchive(str(tmp_path))
+    header, data = archive.decode(archive.encode("system_metrics", ROWS, columns=COLUMNS))
+    assert header["rows"] == len(ROWS)
+    assert header["columns"]["scaled"]["encoding"] == "scaled"
+    assert header["columns"]["ratio"]["encoding"] == "xor"
+    for i, (name, _) in enumerate(COLUMNS):
+        expected = [row[i] for row in ROWS]
+        if name == "ratio":
+            assert math.isnan(data[name][2])
+            expected[2] = data[name][2] = 0.0
+        assert data[name] == expected
+
+
+def test_archive_reads_selected_columns(monitor, tmp_path):
+    archive = monitor.MetricsArchive(str(tmp_path))
+    _, data = archive.decode(archive.encode("system_metrics", ROWS, columns=COLUMNS), ["label"])
+    assert data == {"label": ["a", None, "b", "a"]}
+
+
+def test_archive_table_default_columns(monitor, tmp_path):
+    archive = monitor.MetricsArchive(str(tmp_path))
+    columns = monitor.MetricsArchive.TABLES["gpu_metrics"]
+    row = tuple(
+        "2025-01-01T00:00:00" if kind == "ts" else "GPU-0" if kind == "text" else 1 if kind == "int" else 1.5
+        for _, kind in columns
+    )
+    _, data = archive.decode(archive.encode("gpu_metrics", [row, row]))
+    assert [tuple(data[name][i] for name, _ in columns) for i in range(2)] == [row, row]
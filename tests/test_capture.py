@@ -0,0 +1,30 @@
+import os
+
+
+def write_segment(directory, name, size):
+    with open(os.path.join(directory, name), "wb") as f:
+        f.write(b"x" * size)
+
+
+def test_cap_skips_other_workers_open_segments(monitor, tmp_path, monkeypatch):
+    """超出总大小时只删除已关闭的段，每个进程最新的段保留，已被删除的段忽略"""
+    monkeypatch.setattr(monitor, "CAPTURE_MAX_BYTES", 250)
+    store = monitor.CaptureStore(str(tmp_path))
+    conn = store._connect()
+    names = [
+        "segment-20260101-000000-000000-111.cap",
+        "segment-20260101-000001-000000-222.cap",
+        "segment-20260101-000002-000000-111.cap",
+        "segment-20260101-000003-000000-222.cap",
+    ]
+    for name in names:
+        write_segment(str(tmp_path), name, 100)
+    store.segment = names[2]
+    vanished = str(tmp_path / "segment-20260101-000000-500000-333.cap")
+    real_glob = monitor.glob.glob
+    monkeypatch.setattr(monitor.glob, "glob", lambda pattern: real_glob(pattern) + [vanished])
+    try:
+        store._enforce_cap(conn)
+    finally:
+        conn.close()
+    assert sorted(n for n in os.listdir(tmp_path) if n.endswith(".cap")) == names[2:]
@@ -0,0 +1,55 @@
+import gzip
+import json
+import threading
+
+
+def test_dashboard_delta_etag_and_gzip(monitor):
+    state = {
+        "system": {"timestamp": ["t1", "t2", "t3"], "cpu_percent": [1, 2, 3]},
+        "gpu": {"timestamp": ["t1", "t3"], "gpu_utilization": [10, 30]},
+        "request_stats": {},
+    }
+    snapshot = monitor.DashboardSnapshot(state)
+    body, gzipped, etag = snapshot.since("t1")
+    assert json.loads(body)["system"]["cpu_percent"] == [2, 3]
+    assert json.loads(body)["gpu"]["gpu_utilization"] == [30]
+    assert gzip.decompress(gzipped) == body
+    # 切分位置相同的请求共用缓存的结果
+    assert snapshot.since("t1x") is snapshot.since("t1")
+    assert snapshot.since("t2")[2] != etag
+
+    monitor.fleet_registry.snapshots(None).snapshot = snapshot
+    client = monitor.app.test_client()
+    response = client.get("/api/dashboard?since=t1", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == f'"{etag}"'
+    assert gzip.decompress(response.data) == body
+    response = client.get("/api/dashboard?since=t1", headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+
+
+def test_delta_cache_is_thread_safe(monitor):
+    """多个请求线程同时取不同切分位置的增量时，缓存不超过上限且结果一致"""
+    stamps = [f"t{i:03d}" for i in range(100)]
+    snapshot = monitor.DashboardSnapshot({
+        "system": {"timestamp": stamps, "cpu_percent": list(range(100))},
+        "gpu": {"timestamp": stamps, "gpu_utilization": list(range(100))},
+    })
+    errors = []
+
+    def fetch(offset):
+        try:
+            for i in range(200):
+                n = (i + offset) % 100
+                body = snapshot.since(stamps[n])[0]
+                assert json.loads(body)["system"]["cpu_percent"] == list(range(n + 1, 100))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch, args=(n * 7,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(snapshot._deltas) <= snapshot.DELTA_CACHE
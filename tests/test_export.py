@@ -0,0 +1,55 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+
+def test_export_includes_archived_days(monitor, tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "DB_FILE", str(tmp_path / "export.db"))
+    monkeypatch.setattr(monitor, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(monitor, "ARCHIVE_AFTER_DAYS", 2)
+    db = monitor.OllamaMetricsDB()
+    now = datetime.now().replace(microsecond=0)
+    stamps = [(now - timedelta(days=d, minutes=1)).isoformat() for d in (5, 4, 3, 0)]
+    conn = sqlite3.connect(monitor.DB_FILE)
+    conn.executemany(
+        "INSERT INTO system_metrics (timestamp, server_status, cpu_percent, host) VALUES (?, 1, ?, ?)",
+        [(ts, float(i), "gpu-a" if i == 1 else None) for i, ts in enumerate(stamps)],
+    )
+    conn.commit()
+    conn.close()
+    archived = monitor.MetricsArchive().archive_sealed_days(db, monitor.ARCHIVE_AFTER_DAYS)
+    assert sum(n for table, _, n in archived if table == "system_metrics") == 3
+
+    client = monitor.app.test_client()
+    start = (now - timedelta(days=6)).isoformat()
+    response = client.get(f"/api/export/system_metrics?format=ndjson&columns=id,timestamp,cpu_percent&start={start}")
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert [row["timestamp"] for row in rows] == stamps
+    assert [row["cpu_percent"] for row in rows] == [0.0, 1.0, 2.0, 3.0]
+    assert rows[0]["id"] is None
+
+    # 窗口只覆盖部分归档日
+    start = (now - timedelta(days=4, minutes=2)).isoformat()
+    response = client.get(f"/api/export/system_metrics?format=ndjson&columns=timestamp&start={start}&host=")
+    assert [json.loads(line)["timestamp"] for line in response.data.splitlines()] == [stamps[2], stamps[3]]
+
+
+def test_export_accepts_offset_times(monitor, tmp_path, monkeypatch):
+    """带时区的start/end换算为本地时间，不会在流式输出中途出错"""
+    monkeypatch.setattr(monitor, "DB_FILE", str(tmp_path / "export.db"))
+    monitor.OllamaMetricsDB()
+    now = datetime.now().replace(microsecond=0)
+    stamps = [(now - timedelta(hours=h)).isoformat() for h in (3, 0)]
+    conn = sqlite3.connect(monitor.DB_FILE)
+    conn.executemany("INSERT INTO system_metrics (timestamp, server_status) VALUES (?, 1)", [(ts,) for ts in stamps])
+    conn.commit()
+    conn.close()
+
+    start = datetime.now(timezone.utc) - timedelta(hours=1)
+    client = monitor.app.test_client()
+    for value in (start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                  start.astimezone(timezone(timedelta(hours=2))).isoformat()):
+        response = client.get("/api/export/system_metrics",
+                              query_string={"format": "ndjson", "columns": "timestamp", "start": value})
+        assert response.status_code == 200
+        assert [json.loads(line)["timestamp"] for line in response.data.splitlines()] == [stamps[1]]
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+
+def test_dashboard_merges_worker_snapshots(monitor, tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "DB_FILE", str(tmp_path / "inflight.db"))
+    monkeypatch.setitem(monitor.app.config, "ROLE", "dashboard")
+    workers = [monitor.InflightRegistry() for _ in range(3)]
+    workers[0].begin("a", "llama3.2:3b", "10.0.0.1", "10.0.0.1", "/api/chat").add_chunk(10)
+    workers[1].begin("b", "llama3.2:3b", "10.0.0.2", "10.0.0.2", "/api/generate")
+    workers[2].begin("c", "qwen2.5:7b", "10.0.0.3", "10.0.0.3", "/api/chat")
+
+    now = datetime.now()
+    writer = monitor.MetricsWriter()
+    for i, registry in enumerate(workers):
+        # 第三个进程的快照已过期，视为已退出
+        stamp = now - timedelta(seconds=60 if i == 2 else 0)
+        writer.write([("inflight_snapshot", {
+            "worker": f"proxy:{i}",
+            "timestamp": stamp.isoformat(),
+            "requests": registry.snapshot()["requests"],
+        })])
+
+    merged = monitor.app.test_client().get("/api/inflight").get_json()
+    assert merged["inflight"] == 2
+    assert sorted(r["request_uid"] for r in merged["requests"]) == ["a", "b"]
+    assert merged["models"]["llama3.2:3b"]["inflight"] == 2
+    assert merged["models"]["llama3.2:3b"]["bytes"] == 10
+    assert set(merged["clients"]) == {"10.0.0.1", "10.0.0.2"}
+
+
+def test_snapshot_replaces_previous(monitor, tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "DB_FILE", str(tmp_path / "inflight.db"))
+    db = monitor.OllamaMetricsDB()
+    for requests in ([{"request_uid": "a"}], []):
+        db.save_inflight_snapshot({"worker": "proxy:1", "timestamp": datetime.now().isoformat(),
+                                   "requests": requests})
+    [row] = db.get_inflight_snapshots(5)
+    assert row["requests"] == "[]"
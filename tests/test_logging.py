@@ -0,0 +1,40 @@
+import logging
+import time
+
+
+BASE = time.time()
+
+
+def make_record(offset, msg="GPU query failed"):
+    record = logging.LogRecord("ollama_monitor", logging.ERROR, __file__, 1, msg, None, None)
+    # 相对当前时间，后台汇总线程在测试期间不会认为窗口已结束
+    record.created = BASE + offset
+    return record
+
+
+def test_collapsed_repeats_flushed_after_window(monitor):
+    """重复在窗口内停止时，窗口结束后仍输出一条汇总"""
+    emitted = []
+    collapse = monitor.CollapsingFilter(window=60, emit=emitted.append)
+    assert collapse.filter(make_record(0))
+    assert not collapse.filter(make_record(10))
+    assert not collapse.filter(make_record(20))
+    assert collapse.flush(now=BASE + 50) == 0
+    assert collapse.flush(now=BASE + 61) == 1
+    assert emitted[0].getMessage() == "GPU query failed ×2"
+    assert emitted[0].repeats == 2
+    # 已输出的计数不会在下一次出现时重复汇总
+    assert collapse.flush(now=BASE + 200) == 0
+    record = make_record(100)
+    assert collapse.filter(record)
+    assert record.getMessage() == "GPU query failed"
+
+
+def test_repeat_after_window_carries_count(monitor):
+    collapse = monitor.CollapsingFilter(window=60, emit=[].append)
+    assert collapse.filter(make_record(0))
+    assert not collapse.filter(make_record(10))
+    record = make_record(70)
+    assert collapse.filter(record)
+    assert record.getMessage() == "GPU query failed ×2"
+    assert collapse.flush(now=BASE + 200) == 0
@@ -0,0 +1,96 @@
+import pytest
+
+import gen_ollama_log
+
+BLOB = "/root/.ollama/models/blobs/sha256-" + "ab" * 32
+
+
+@pytest.fixture
+def parser(monitor):
+    return monitor.OllamaLogParser()
+
+
+def test_load_uses_model_and_time(parser):
+    assert parser.parse(f'time=2025-01-01T10:00:00.000Z level=INFO source=server.go:376 '
+                        f'msg="starting llama server" model={BLOB}') is None
+    assert parser.parse("llm_load_tensors: offloaded 33/33 layers to GPU") is None
+    event = parser.parse('time=2025-01-01T10:00:03.500Z level=INFO source=server.go:601 '
+                         'msg="llama runner started in 3.52 seconds"')
+    assert event["event"] == "load"
+    assert event["value"] == 3.52
+    assert event["model"] == "sha256-" + "ab" * 32
+    assert event["level"] == "INFO"
+    assert event["timestamp"] == parser._local_time("2025-01-01T10:00:03.500Z")
+
+
+def test_untimed_lines_inherit_last_time(parser):
+    parser.parse('time=2025-01-01T10:00:00+00:00 level=INFO msg="loading model"')
+    event = parser.parse("ggml_backend_cuda_buffer_type_alloc_buffer: allocating 4096.00 MiB on device 0: "
+                         "cudaMalloc failed: out of memory")
+    assert event["event"] == "oom"
+    assert event["timestamp"] == parser._local_time("2025-01-01T10:00:00+00:00")
+
+
+@pytest.mark.parametrize("line, event, value", [
+    ("llm_load_tensors: offloaded 20/40 layers to GPU", "cpu_fallback", 0.5),
+    ('time=2025-01-01T10:00:00Z level=INFO msg=offload library=cuda layers.model=33 layers.offload=11',
+     "cpu_fallback", 0.3333),
+    ('time=2025-01-01T10:00:00Z level=INFO msg="inference compute" id=cpu library=cpu', "cpu_fallback", 0.0),
+    ('time=2025-01-01T10:00:00Z level=INFO msg="no compatible GPUs were discovered"', "cpu_fallback", None),
+    ('time=2025-01-01T10:00:00Z level=DEBUG msg="context limit hit - shifting" limit=8192 keep=4 discard=2048',
+     "context_shift", 2048.0),
+    # 崩溃行常带有显存不足的原因，记为崩溃
+    ('time=2025-01-01T10:00:00Z level=ERROR msg="error loading llama server" '
+     'error="llama runner process has terminated: cudaMalloc failed: out of memory"', "runner_crash", None),
+    ("[GIN] 2025/01/01 - 10:00:00 | 200 |    1.234567s |       127.0.0.1 | POST     \"/api/chat\"", None, None),
+])
+def test_event_patterns(parser, line, event, value):
+    result = parser.parse(line)
+    if event is None:
+        assert result is None
+    else:
+        assert (result["event"], result["value"]) == (event, value)
+
+
+def test_generated_log_counts(parser, tmp_path):
+    path = str(tmp_path / "ollama.log")
+    expected = gen_ollama_log.write_log(path, 3000, partial=False, seed=7)
+    counts = {name: 0 for name in gen_ollama_log.EVENTS}
+    with open(path) as f:
+        for line in f:
+            event = parser.parse(line.rstrip("\n"))
+            if event:
+                counts[event["event"]] += 1
+    assert counts == expected
+
+
+def test_recreated_file_with_reused_inode_starts_from_zero(monitor, submitted, tmp_path, monkeypatch):
+    """从保存的位置恢复后，文件被删除并以同一inode重建时，不沿用旧文件的偏移"""
+    path = tmp_path / "ollama.log"
+    state_file = str(tmp_path / "state.json")
+    path.write_text("line one\nline two\n")
+    first = monitor.OllamaLogTailer(str(path), state_file=state_file)
+    first.configure()
+    assert first.poll() == 2
+    first._save_state(force=True)
+    first._close()
+
+    tailer = monitor.OllamaLogTailer(str(path), state_file=state_file)
+    tailer.configure()
+    assert tailer.poll() == 0
+    old_inode = tailer.inode
+    path.unlink()
+    assert tailer.poll() == 0
+    assert tailer.rotations == 1
+
+    path.write_text("new line one\nnew line two\nthree\n")
+    real_stat = monitor.os.stat
+
+    def stat(target, *args, **kwargs):
+        st = real_stat(target, *args, **kwargs)
+        if str(target) == str(path):
+            return type("Stat", (), {"st_ino": old_inode, "st_size": st.st_size})()
+        return st
+
+    monkeypatch.setattr(monitor.os, "stat", stat)
+    assert tailer.poll() == 3
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+
+def log(db, when, endpoint, model="llama3.2:3b"):
+    db.save_request_log({
+        "timestamp": when.isoformat(),
+        "client_ip": "127.0.0.1",
+        "model_name": model,
+        "input_tokens": 1,
+        "output_tokens": 1,
+        "response_time": 0.1,
+        "status_code": 200,
+        "endpoint": endpoint,
+        "load_duration": 0.0,
+    })
+
+
+def test_self_test_requests_are_not_learned(monitor, tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "DB_FILE", str(tmp_path / "preload.db"))
+    db = monitor.OllamaMetricsDB()
+    start = datetime.now() - timedelta(minutes=30)
+    log(db, start, monitor.OllamaMetricsDB.SELF_TEST_ENDPOINT)
+    log(db, start + timedelta(minutes=1), "/api/chat")
+    log(db, start + timedelta(minutes=2), monitor.OllamaMetricsDB.SELF_TEST_ENDPOINT)
+
+    assert [ts for ts, _ in db.get_request_arrivals(1)] == [(start + timedelta(minutes=1)).isoformat()]
+    first = db.get_first_request_after("llama3.2:3b", (start - timedelta(minutes=1)).isoformat())
+    assert first["timestamp"] == (start + timedelta(minutes=1)).isoformat()
+    assert db.get_first_request_after("llama3.2:3b", (start + timedelta(minutes=1)).isoformat()) is None
+
+
+def test_status_does_not_start_thread(monitor, monkeypatch):
+    monkeypatch.setattr(monitor, "PRELOAD_ENABLED", False)
+    monkeypatch.setattr(monitor, "KEEP_ALIVE_POLICY", False)
+    preloader = monitor.ModelPreloader()
+    assert preloader.status()["models"] == []
+    preloader.start()
+    assert preloader.keep_alive_for("llama3.2:3b") is None
+    assert preloader._thread is None
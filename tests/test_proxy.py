@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import fake_ollama
+
+
+@pytest.fixture
+def upstream(monitor, tmp_path, monkeypatch):
+    server = fake_ollama.start_fake_server(ttft=0.01, token_rate=1000, tokens=8)
+    monkeypatch.setattr(monitor, "OLLAMA_HOST", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(monitor, "DB_FILE", str(tmp_path / "proxy.db"))
+    monkeypatch.setattr(monitor, "metrics_writer", monitor.MetricsWriter())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def logged_requests(monitor):
+    monitor.metrics_writer.flush()
+    return monitor.OllamaMetricsDB().get_recent_requests(1)
+
+
+def test_generate_round_trip(monitor, upstream):
+    client = monitor.app.test_client()
+    response = client.post("/ollama/api/generate",
+                           json={"model": "llama3.2:3b", "prompt": "hello", "stream": False})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["done"] is True
+    assert body["eval_count"] == 8
+
+    [log] = logged_requests(monitor)
+    assert log["model_name"] == "llama3.2:3b"
+    assert log["endpoint"] == "/api/generate"
+    assert log["status_code"] == 200
+    assert log["output_tokens"] == 8
+    assert log["input_tokens"] == body["prompt_eval_count"]
+
+
+def test_streaming_chat_round_trip(monitor, upstream):
+    client = monitor.app.test_client()
+    response = client.post("/ollama/api/chat", json={
+        "model": "qwen2.5:7b", "messages": [{"role": "user", "content": "hi"}], "stream": True,
+    })
+    assert response.status_code == 200
+    chunks = [json.loads(line) for line in response.data.splitlines() if line.strip()]
+    assert chunks[-1]["done"] is True
+    assert sum(1 for chunk in chunks if not chunk["done"]) == 8
+
+    [log] = logged_requests(monitor)
+    assert (log["model_name"], log["endpoint"], log["output_tokens"]) == ("qwen2.5:7b", "/api/chat", 8)
+
+
+def test_get_passthrough(monitor, upstream):
+    response = monitor.app.test_client().get("/ollama/api/tags")
+    assert response.status_code == 200
+    assert {model["name"] for model in response.get_json()["models"]} == set(fake_ollama.DEFAULT_MODELS)
@@ -0,0 +1,80 @@
+import socket
+import threading
+
+import pytest
+
+import common
+
+
+@pytest.fixture
+def received(monitor, submitted, monkeypatch):
+    """collector收到并提交的写入"""
+    monkeypatch.setattr(monitor, "COLLECTOR_RETRY_MAX_SECONDS", 0.05)
+    return submitted
+
+
+def start_collector(monitor, port):
+    server = monitor.IngestServer(("127.0.0.1", port), monitor.IngestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def batch(n):
+    return [("request_log", {"model_name": "m", "seq": i}) for i in range(n)]
+
+
+def test_collector_killed_mid_batch(monitor, received):
+    """collector只读到半行就退出，重启后重发的批次完整写入一次"""
+    port = common.free_port()
+    listener = socket.create_server(("127.0.0.1", port))
+    restarted = {}
+
+    def crash_then_restart():
+        conn, _ = listener.accept()
+        conn.recv(100)
+        conn.close()
+        listener.close()
+        restarted["server"] = start_collector(monitor, port)
+
+    thread = threading.Thread(target=crash_then_restart)
+    thread.start()
+    writer = monitor.RemoteWriter(("127.0.0.1", port))
+    writer.write(batch(200))
+    thread.join()
+    restarted["server"].shutdown()
+    restarted["server"].server_close()
+
+    assert [payload["seq"] for _, payload in received] == list(range(200))
+    assert writer.dropped == 0
+
+
+def test_resent_batch_is_written_once(monitor, received):
+    """collector收下批次但确认丢失时，同一批次id的重发只确认不写入"""
+    port = common.free_port()
+    server = start_collector(monitor, port)
+    line = b'{"batch_id": "b1", "items": [["request_log", {"seq": 1}]]}\n'
+    try:
+        for _ in range(2):
+            with socket.create_connection(("127.0.0.1", port)) as sock:
+                sock.sendall(line)
+                assert sock.makefile("rb").readline() == b'{"ack": "b1"}\n'
+        # 不完整的最后一行不写入
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.sendall(b'{"batch_id": "b2", "items": [["request_log", {"se')
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.sendall(b'{"batch_id": "b3", "items": [["request_log", {"seq": 3}]]}\n')
+            assert sock.makefile("rb").readline() == b'{"ack": "b3"}\n'
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert ("request_log", {"seq": 1}) in received
+    assert ("request_log", {"seq": 3}) in received
+    assert len(received) == 2
+
+
+def test_gives_up_after_retry_cap(monitor, received, monkeypatch):
+    monkeypatch.setattr(monitor, "COLLECTOR_MAX_RETRIES", 2)
+    writer = monitor.RemoteWriter(("127.0.0.1", common.free_port()))
+    writer.write(batch(5))
+    assert writer.dropped == 5
+    assert received == []
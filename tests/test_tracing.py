@@ -0,0 +1,32 @@
+import pytest
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+@pytest.fixture
+def exporter(monitor, monkeypatch):
+    monkeypatch.setattr(monitor, "TRACE_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+    monkeypatch.setattr(monitor, "TRACE_SAMPLE_RATE", 1.0)
+    return monitor.SpanExporter()
+
+
+def test_valid_traceparent_is_continued(exporter):
+    trace = exporter.start_trace({"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"}, "proxy")
+    assert (trace.trace_id, trace.parent_id) == (TRACE_ID, PARENT_ID)
+    assert exporter.start_trace({"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"}, "proxy") is None
+
+
+@pytest.mark.parametrize("header", [
+    f"ff-{TRACE_ID}-{PARENT_ID}-01",
+    f"00-{'0' * 32}-{PARENT_ID}-01",
+    f"00-{TRACE_ID}-{'0' * 16}-01",
+    f"00-{TRACE_ID.upper()}-{PARENT_ID}-01",
+    f"00-{TRACE_ID[:-1]}g-{PARENT_ID}-01",
+    f"00-{TRACE_ID}-{PARENT_ID}-1",
+    f"00-{TRACE_ID}-{PARENT_ID}-01-extra",
+])
+def test_invalid_traceparent_starts_new_trace(exporter, header):
+    trace = exporter.start_trace({"traceparent": header}, "proxy")
+    assert trace.parent_id is None
+    assert trace.trace_id != TRACE_ID and len(trace.trace_id) == 32
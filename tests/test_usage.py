@@ -0,0 +1,81 @@
+import pytest
+
+
+def test_sliding_window_weights_previous_bucket(monitor):
+    counter = monitor.SlidingWindowCounter(60)
+    counter.add(10, now=30)
+    assert counter.value(30) == 10
+    # 进入下一个桶后，上一个桶按剩余时间比例计入
+    counter.add(4, now=75)
+    assert counter.value(75) == pytest.approx(10 * (1 - 15 / 60) + 4)
+    assert counter.value(119) == pytest.approx(10 * (1 - 59 / 60) + 4)
+    # 相隔超过一个桶时清零
+    assert counter.value(200) == 0
+
+
+def test_sliding_window_late_samples(monitor):
+    counter = monitor.SlidingWindowCounter(60)
+    counter.add(5, now=70, at=30)
+    counter.add(7, now=70, at=-100)
+    assert counter.value(70) == pytest.approx(5 * (1 - 10 / 60))
+
+
+def test_sliding_window_retry_after(monitor):
+    counter = monitor.SlidingWindowCounter(60)
+    counter.add(10, now=30)
+    assert counter.retry_after(30, 5) == 30
+    counter.add(2, now=60)
+    # 10 * (1 - t / 60) + 2 < 7 在 t = 30 时成立
+    assert counter.retry_after(60, 7) == pytest.approx(30)
+
+
+@pytest.fixture
+def ledger(monitor, monkeypatch):
+    monkeypatch.setattr(monitor, "QUOTA_REQUESTS", {"minute": 2, "hour": None, "day": None})
+    monkeypatch.setattr(monitor, "QUOTA_TOKENS", {"minute": None, "hour": 100, "day": None})
+    monkeypatch.setattr(monitor, "QUOTA_OVERRIDES", {"vip": {"requests": {"minute": 5}}})
+    ledger = monitor.UsageLedger()
+    # 不从数据库恢复用量，也不启动写入数据库的线程
+    ledger._primed = True
+    ledger._flusher = object()
+    return ledger
+
+
+def test_admit_request_quota(ledger):
+    assert ledger.admit("10.0.0.1") == (True, 0, None)
+    assert ledger.admit("10.0.0.1") == (True, 0, None)
+    allowed, retry_after, reason = ledger.admit("10.0.0.1")
+    assert not allowed
+    assert 0 < retry_after <= 60
+    assert reason == "requests quota per minute exceeded"
+    # 其他客户端不受影响，覆盖配置放宽上限
+    assert ledger.admit("10.0.0.2")[0]
+    assert all(ledger.admit("vip")[0] for _ in range(5))
+    assert not ledger.admit("vip")[0]
+
+
+def test_admit_token_quota(ledger):
+    assert ledger.admit("10.0.0.1")[0]
+    ledger.record("10.0.0.1", "llama3.2:3b", 60, 50)
+    allowed, _, reason = ledger.admit("10.0.0.1")
+    assert not allowed
+    assert reason == "tokens quota per hour exceeded"
+
+
+def test_client_id_prefers_bearer_key(monitor):
+    key = monitor.UsageLedger.client_id({"Authorization": "Bearer secret"}, "10.0.0.1")
+    assert key.startswith("key:") and "secret" not in key
+    assert monitor.UsageLedger.client_id({}, "10.0.0.1") == "10.0.0.1"
+
+
+def test_quota_refuses_multiple_proxy_workers(monitor, monkeypatch):
+    """配额计数不跨进程共享，配置配额时不能启动多个proxy worker"""
+    spawned = []
+    monkeypatch.setattr(monitor, "spawn_workers", lambda argv, n: spawned.append(n))
+    monkeypatch.setattr(monitor, "QUOTA_REQUESTS", {"minute": 60, "hour": None, "day": None})
+    with pytest.raises(SystemExit, match="QUOTA_"):
+        monitor.main(["--role", "proxy", "--workers", "2"])
+    monitor.main(["--role", "dashboard", "--workers", "2"])
+    monkeypatch.setattr(monitor, "QUOTA_REQUESTS", {"minute": None, "hour": None, "day": None})
+    monitor.main(["--role", "proxy", "--workers", "2"])
+    assert spawned == [2, 2]